@@ -8,22 +8,30 @@ import time
 import threading
 import logging
 from datetime import datetime, timedelta
-from typing import Dict, Any, Optional
-import subprocess
-import sys
+from typing import Callable, Dict, Any, Optional
 import requests
 import json
-import pkg_resources
 from pathlib import Path
 import hashlib
-import os
+import shutil
+import tempfile
+
+from version_service import VersionService
+from ytdlp_runtime import RuntimeStore
 
 logger = logging.getLogger(__name__)
 
 class AutoUpdater:
     """Handles automatic yt-dlp updates with configurable schedules"""
     
-    def __init__(self):
+    def __init__(self, version_service: Optional[VersionService] = None,
+                 installer: Optional[Callable[[str, str], Any]] = None,
+                 is_leader: Optional[Callable[[], bool]] = None):
+        self.version_service = version_service or VersionService()
+        # (version, package path) -> installs a runtime without touching the live environment
+        self.installer = installer or RuntimeStore("runtimes").install
+        # In a cluster only the leader checks and installs; the others follow its upgrades
+        self.is_leader = is_leader
         self.is_running = False
         self.update_thread = None
         self.last_check = 0
@@ -144,19 +152,29 @@ class AutoUpdater:
     
     async def _check_and_update_async(self):
         """Check for updates and update if available"""
+        if self.is_leader is not None and not self.is_leader():
+            self.update_status["status"] = "idle"
+            self.update_status["message"] = "Updates are checked by the cluster leader"
+            return
         try:
             self.update_status["status"] = "checking"
             self.update_status["message"] = "Checking for updates..."
             
             # Get current and latest versions
             current_version = self._get_current_version()
-            latest_version = self._get_latest_version()
+            latest_version, _ = await self._get_latest_version()
             
             if latest_version == "unknown":
                 self.update_status["status"] = "idle"
                 self.update_status["message"] = "Could not check for updates"
                 return
             
+            if latest_version == self.version_service.snapshot()["pending_version"]:
+                self.update_status["status"] = "idle"
+                self.update_status["message"] = f"yt-dlp {latest_version} is installed; it takes effect after a restart"
+                self.update_status["next_check"] = datetime.now() + timedelta(seconds=self.check_interval)
+                return
+            
             if current_version == latest_version:
                 self.update_status["status"] = "idle"
                 self.update_status["message"] = f"yt-dlp is up to date (v{current_version})"
@@ -191,32 +209,12 @@ class AutoUpdater:
     
     def _get_current_version(self) -> str:
         """Get currently installed yt-dlp version"""
-        try:
-            return pkg_resources.get_distribution("yt-dlp").version
-        except pkg_resources.DistributionNotFound:
-            try:
-                result = subprocess.run(
-                    [sys.executable, "-m", "yt_dlp", "--version"],
-                    capture_output=True, text=True, check=True
-                )
-                return result.stdout.strip()
-            except subprocess.SubprocessError:
-                return "unknown"
+        return self.version_service.current_version()
     
-    def _get_latest_version(self) -> (str, str):
-        """Get latest available yt-dlp version and its SHA256 checksum from PyPI"""
-        try:
-            response = requests.get("https://pypi.org/pypi/yt-dlp/json", timeout=10)
-            response.raise_for_status()
-            data = response.json()
-            version = data["info"]["version"]
-            for release in data["releases"][version]:
-                if release["packagetype"] == "sdist":
-                    return version, release["digests"]["sha256"]
-            return version, None
-        except Exception as e:
-            logger.error(f"Failed to get latest version: {e}")
-            return "unknown", None
+    async def _get_latest_version(self) -> (str, str):
+        """Get latest available yt-dlp version and its SHA256 checksum, revalidating a stale cache"""
+        await self.version_service.refresh()
+        return self.version_service.latest()
     
     def _download_and_verify_package(self, version: str, expected_checksum: str):
         """Download the yt-dlp package and verify its SHA256 checksum"""
@@ -226,15 +224,17 @@ class AutoUpdater:
             response.raise_for_status()
             
             hasher = hashlib.sha256()
+            content = bytearray()
             for chunk in response.iter_content(chunk_size=8192):
                 hasher.update(chunk)
+                content.extend(chunk)
             
             actual_checksum = hasher.hexdigest()
             
             if actual_checksum != expected_checksum:
                 raise Exception("Checksum mismatch")
             
-            return response.content
+            return bytes(content)
         except Exception as e:
             logger.error(f"Failed to download or verify package: {e}")
             raise
@@ -246,45 +246,44 @@ class AutoUpdater:
             self.update_status["progress"] = 0.0
             self.update_status["message"] = "Updating yt-dlp..."
             
-            latest_version, expected_checksum = self._get_latest_version()
+            latest_version, expected_checksum = await self._get_latest_version()
             if latest_version == "unknown" or not expected_checksum:
                 raise Exception("Could not get latest version information")
             
-            package_content = self._download_and_verify_package(latest_version, expected_checksum)
+            loop = asyncio.get_running_loop()
+            package_content = await loop.run_in_executor(
+                None, self._download_and_verify_package, latest_version, expected_checksum
+            )
             
             # Update progress
             self.update_status["progress"] = 0.2
             self.update_status["message"] = "Preparing update..."
             
-            # Run pip install from the downloaded package
-            with open(f"yt-dlp-{latest_version}.tar.gz", "wb") as f:
+            package_dir = Path(tempfile.mkdtemp(prefix="yt-dlp-update-"))
+            package_path = package_dir / f"yt-dlp-{latest_version}.tar.gz"
+            with open(package_path, "wb") as f:
                 f.write(package_content)
             
             self.update_status["progress"] = 0.4
             self.update_status["message"] = "Installing update..."
             
-            result = subprocess.run(
-                [sys.executable, "-m", "pip", "install", f"yt-dlp-{latest_version}.tar.gz"],
-                capture_output=True, text=True
-            )
-            
-            os.remove(f"yt-dlp-{latest_version}.tar.gz")
-            
-            if result.returncode != 0:
-                raise Exception(f"Update failed: {result.stderr}")
+            # Installs side by side and smoke-tests; raises, leaving the active version alone, on failure
+            try:
+                installed = await loop.run_in_executor(None, self.installer, latest_version, str(package_path))
+            finally:
+                shutil.rmtree(package_dir, ignore_errors=True)
             
             # Complete update
             self.update_status["progress"] = 1.0
-            self.update_status["message"] = "Update completed successfully"
+            # The installer says whether the version is in use now or after a restart
+            message = installed if isinstance(installed, str) else f"Installed version {latest_version}"
+            self.update_status["message"] = message
             self.update_status["status"] = "completed"
             self.update_status["last_update"] = datetime.now().isoformat()
-            
-            # Get new version
-            new_version = self._get_current_version()
-            logger.info(f"Successfully updated yt-dlp to version {new_version}")
+            logger.info(f"yt-dlp upgrade: {message}")
             
             if self.notify_on_update:
-                self._send_update_completion_notification(new_version)
+                self._send_update_completion_notification(latest_version)
                 
         except Exception as e:
             logger.error(f"Silent update failed: {e}")
@@ -322,8 +321,16 @@ def _get_instance() -> AutoUpdater:
         _instance = AutoUpdater()
     return _instance
 
-def start_auto_updater():
+def start_auto_updater(version_service: Optional[VersionService] = None,
+                       installer: Optional[Callable[[str, str], Any]] = None,
+                       is_leader: Optional[Callable[[], bool]] = None):
     updater = _get_instance()
+    if version_service is not None:
+        updater.version_service = version_service
+    if installer is not None:
+        updater.installer = installer
+    if is_leader is not None:
+        updater.is_leader = is_leader
     updater.start()
 
 def stop_auto_updater():
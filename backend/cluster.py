@@ -0,0 +1,919 @@
+"""
+Shared state for running several API processes as one service
+A ClusterBackend holds what the processes have to agree on: a priority
+queue of jobs, each leased to the process running it; rate-limit window
+counters; named leader leases; a message bus carrying WebSocket events and
+control commands between processes; and the last stored row of every task.
+MemoryBackend serves a single process (and tests), SQLiteBackend the
+workers of one node sharing a database file, RedisBackend a cluster of
+nodes. ClusterNode is one process's membership: a background thread sends
+and receives bus messages and renews its leases.
+
+Lease deadlines are wall-clock times, so nodes need synchronised clocks.
+"""
+
+import heapq
+import itertools
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Any, Callable, Deque, Dict, Iterable, List, Optional, Set, Tuple
+from urllib.parse import urlparse
+
+from loguru import logger
+
+# Messages kept on the bus for readers that fall behind
+MESSAGE_BACKLOG = 10_000
+# Task rows kept for other processes to read
+STATE_TTL = 7 * 24 * 60 * 60
+MEMORY_STATE_MAX = 100_000
+
+Job = Tuple[str, Dict[str, Any]]
+
+
+class ClusterBackend(ABC):
+    """Storage shared by the processes of one deployment; every method is thread-safe"""
+
+    @abstractmethod
+    def push_job(self, job_id: str, payload: Dict[str, Any], priority: int = 0) -> bool:
+        """Queue a job unless one with this id is already queued or leased"""
+
+    def push_jobs(self, jobs: List[Tuple[str, Dict[str, Any], int]]) -> int:
+        """Queue several (job_id, payload, priority) jobs; returns how many were new"""
+        return sum(self.push_job(job_id, payload, priority) for job_id, payload, priority in jobs)
+
+    @abstractmethod
+    def claim_jobs(self, node_id: str, limit: int, lease: float) -> List[Job]:
+        """Lease up to ``limit`` queued jobs to a node, highest priority and oldest first"""
+
+    @abstractmethod
+    def take_job(self, job_id: str, node_id: str, lease: float) -> Optional[Dict[str, Any]]:
+        """Lease one particular job if it is still queued, returning its payload"""
+
+    @abstractmethod
+    def renew_jobs(self, node_id: str, job_ids: Iterable[str], lease: float) -> List[str]:
+        """Extend a node's leases; returns the ids it no longer holds"""
+
+    @abstractmethod
+    def finish_jobs(self, job_ids: Iterable[str]):
+        """Forget jobs that have finished"""
+
+    @abstractmethod
+    def requeue_expired(self) -> int:
+        """Queue again the jobs whose lease ran out, e.g. because their process died"""
+
+    @abstractmethod
+    def job_counts(self) -> Dict[str, int]:
+        """Numbers of queued and leased jobs"""
+
+    @abstractmethod
+    def hit(self, key: str, start: float, window: float) -> Tuple[int, int]:
+        """Count one request in the window starting at ``start``.
+
+        Returns the count of that window, including this request, and of
+        the window before it.
+        """
+
+    @abstractmethod
+    def unhit(self, key: str, start: float):
+        """Take back a hit that was not allowed"""
+
+    @abstractmethod
+    def try_lead(self, name: str, node_id: str, ttl: float) -> bool:
+        """Take or extend the named leader lease; False while another node holds it"""
+
+    @abstractmethod
+    def resign(self, name: str, node_id: str):
+        """Give up the named lease if this node holds it"""
+
+    @abstractmethod
+    def leader(self, name: str) -> Optional[str]:
+        """Node holding the named lease, if it has not expired"""
+
+    @abstractmethod
+    def publish(self, messages: List[Dict[str, Any]]):
+        """Append messages to the stream every process reads"""
+
+    @abstractmethod
+    def latest_cursor(self) -> Any:
+        """Cursor positioned after the newest message, for a reader that starts now"""
+
+    @abstractmethod
+    def read(self, cursor: Any, limit: int = 500, block: float = 0.0) -> Tuple[Any, List[Dict[str, Any]]]:
+        """Messages after ``cursor``, waiting up to ``block`` seconds for one; returns the new cursor"""
+
+    @abstractmethod
+    def put_states(self, states: Dict[str, Any]):
+        """Store the latest state of each key"""
+
+    @abstractmethod
+    def get_state(self, key: str) -> Optional[Any]:
+        """Last state stored for a key"""
+
+    def close(self):
+        pass
+
+
+class MemoryBackend(ClusterBackend):
+    """In-process stand-in; shared only by the threads of one process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._arrived = threading.Condition(self._lock)
+        # id -> [payload, priority, seq, node, lease deadline]; node is None while queued
+        self._jobs: Dict[str, list] = {}
+        self._queue: List[Tuple[int, int, str]] = []
+        self._seq = itertools.count()
+        self._counters: Dict[Tuple[str, float], Tuple[int, float]] = {}
+        self._leaders: Dict[str, Tuple[str, float]] = {}
+        self._messages: Deque[Tuple[int, Dict[str, Any]]] = deque(maxlen=MESSAGE_BACKLOG)
+        self._message_seq = 0
+        self._states: "OrderedDict[str, Any]" = OrderedDict()
+
+    def push_job(self, job_id: str, payload: Dict[str, Any], priority: int = 0) -> bool:
+        with self._lock:
+            if job_id in self._jobs:
+                return False
+            seq = next(self._seq)
+            self._jobs[job_id] = [payload, priority, seq, None, 0.0]
+            heapq.heappush(self._queue, (-priority, seq, job_id))
+            return True
+
+    def claim_jobs(self, node_id: str, limit: int, lease: float) -> List[Job]:
+        claimed: List[Job] = []
+        with self._lock:
+            deadline = time.time() + lease
+            while self._queue and len(claimed) < limit:
+                _, seq, job_id = heapq.heappop(self._queue)
+                job = self._jobs.get(job_id)
+                # Entries of jobs taken, finished or requeued since are skipped
+                if job is None or job[3] is not None or job[2] != seq:
+                    continue
+                job[3], job[4] = node_id, deadline
+                claimed.append((job_id, job[0]))
+        return claimed
+
+    def take_job(self, job_id: str, node_id: str, lease: float) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job[3] is not None:
+                return None
+            job[3], job[4] = node_id, time.time() + lease
+            return job[0]
+
+    def renew_jobs(self, node_id: str, job_ids: Iterable[str], lease: float) -> List[str]:
+        lost = []
+        with self._lock:
+            deadline = time.time() + lease
+            for job_id in job_ids:
+                job = self._jobs.get(job_id)
+                if job is None or job[3] != node_id:
+                    lost.append(job_id)
+                else:
+                    job[4] = deadline
+        return lost
+
+    def finish_jobs(self, job_ids: Iterable[str]):
+        with self._lock:
+            for job_id in job_ids:
+                self._jobs.pop(job_id, None)
+
+    def requeue_expired(self) -> int:
+        now = time.time()
+        with self._lock:
+            expired = [(job_id, job) for job_id, job in self._jobs.items() if job[3] is not None and job[4] < now]
+            for job_id, job in expired:
+                job[3] = None
+                heapq.heappush(self._queue, (-job[1], job[2], job_id))
+        return len(expired)
+
+    def job_counts(self) -> Dict[str, int]:
+        with self._lock:
+            leased = sum(1 for job in self._jobs.values() if job[3] is not None)
+            return {"queued": len(self._jobs) - leased, "leased": leased}
+
+    def hit(self, key: str, start: float, window: float) -> Tuple[int, int]:
+        with self._lock:
+            count = self._counters.get((key, start), (0, 0.0))[0] + 1
+            self._counters[(key, start)] = (count, start + 2 * window)
+            previous = self._counters.get((key, start - window), (0, 0.0))[0]
+            if len(self._counters) > 4 * MEMORY_STATE_MAX:
+                self._counters = {k: v for k, v in self._counters.items() if v[1] > start}
+        return count, previous
+
+    def unhit(self, key: str, start: float):
+        with self._lock:
+            count, expires = self._counters.get((key, start), (0, 0.0))
+            if count > 0:
+                self._counters[(key, start)] = (count - 1, expires)
+
+    def try_lead(self, name: str, node_id: str, ttl: float) -> bool:
+        now = time.time()
+        with self._lock:
+            holder = self._leaders.get(name)
+            if holder is not None and holder[0] != node_id and holder[1] > now:
+                return False
+            self._leaders[name] = (node_id, now + ttl)
+            return True
+
+    def resign(self, name: str, node_id: str):
+        with self._lock:
+            if self._leaders.get(name, (None,))[0] == node_id:
+                del self._leaders[name]
+
+    def leader(self, name: str) -> Optional[str]:
+        with self._lock:
+            holder = self._leaders.get(name)
+            return holder[0] if holder is not None and holder[1] > time.time() else None
+
+    def publish(self, messages: List[Dict[str, Any]]):
+        with self._lock:
+            for message in messages:
+                self._message_seq += 1
+                self._messages.append((self._message_seq, message))
+            self._arrived.notify_all()
+
+    def latest_cursor(self) -> int:
+        with self._lock:
+            return self._message_seq
+
+    def read(self, cursor: int, limit: int = 500, block: float = 0.0) -> Tuple[int, List[Dict[str, Any]]]:
+        with self._lock:
+            if self._message_seq <= cursor and block > 0:
+                self._arrived.wait(block)
+            batch = [(seq, message) for seq, message in self._messages if seq > cursor][:limit]
+        if not batch:
+            return cursor, []
+        return batch[-1][0], [message for _, message in batch]
+
+    def put_states(self, states: Dict[str, Any]):
+        with self._lock:
+            for key, value in states.items():
+                self._states[key] = value
+                self._states.move_to_end(key)
+            while len(self._states) > MEMORY_STATE_MAX:
+                self._states.popitem(last=False)
+
+    def get_state(self, key: str) -> Optional[Any]:
+        with self._lock:
+            return self._states.get(key)
+
+
+_SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cluster_jobs (
+    id TEXT PRIMARY KEY, payload TEXT, priority INTEGER, queued_at REAL, node TEXT, lease_until REAL
+);
+CREATE INDEX IF NOT EXISTS idx_cluster_jobs_queue ON cluster_jobs (priority DESC, queued_at) WHERE node IS NULL;
+CREATE INDEX IF NOT EXISTS idx_cluster_jobs_lease ON cluster_jobs (lease_until) WHERE node IS NOT NULL;
+CREATE TABLE IF NOT EXISTS cluster_counters (key TEXT, start REAL, count INTEGER, expires REAL, PRIMARY KEY (key, start));
+CREATE TABLE IF NOT EXISTS cluster_leaders (name TEXT PRIMARY KEY, node TEXT, until REAL);
+CREATE TABLE IF NOT EXISTS cluster_messages (seq INTEGER PRIMARY KEY AUTOINCREMENT, body TEXT);
+CREATE TABLE IF NOT EXISTS cluster_state (key TEXT PRIMARY KEY, value TEXT, expires REAL);
+"""
+
+
+class SQLiteBackend(ClusterBackend):
+    """Shared through one SQLite file; for the worker processes of a single node"""
+
+    # Expired counters, messages and states are pruned every this many writes
+    PRUNE_EVERY = 256
+
+    def __init__(self, path: str):
+        self.path = path
+        # Autocommit; multi-statement changes take the write lock up front with BEGIN IMMEDIATE
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SQLITE_SCHEMA)
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def _prune_due(self) -> bool:
+        self._writes += 1
+        return self._writes % self.PRUNE_EVERY == 0
+
+    def push_job(self, job_id: str, payload: Dict[str, Any], priority: int = 0) -> bool:
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO cluster_jobs (id, payload, priority, queued_at) VALUES (?, ?, ?, ?)",
+                (job_id, json.dumps(payload), priority, time.time()),
+            )
+        return cursor.rowcount > 0
+
+    def push_jobs(self, jobs: List[Tuple[str, Dict[str, Any], int]]) -> int:
+        now = time.time()
+        with self._transaction() as conn:
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO cluster_jobs (id, payload, priority, queued_at) VALUES (?, ?, ?, ?)",
+                [(job_id, json.dumps(payload), priority, now) for job_id, payload, priority in jobs],
+            )
+            return conn.total_changes - before
+
+    def claim_jobs(self, node_id: str, limit: int, lease: float) -> List[Job]:
+        if limit <= 0:
+            return []
+        with self._lock:
+            # Idle polls only read; the write lock is taken once there is something to claim
+            if self._conn.execute("SELECT 1 FROM cluster_jobs WHERE node IS NULL LIMIT 1").fetchone() is None:
+                return []
+        with self._transaction() as conn:
+            rows = conn.execute(
+                "SELECT id, payload FROM cluster_jobs WHERE node IS NULL ORDER BY priority DESC, queued_at LIMIT ?",
+                (limit,),
+            ).fetchall()
+            conn.executemany("UPDATE cluster_jobs SET node = ?, lease_until = ? WHERE id = ?",
+                             [(node_id, time.time() + lease, job_id) for job_id, _ in rows])
+        return [(job_id, json.loads(payload)) for job_id, payload in rows]
+
+    def take_job(self, job_id: str, node_id: str, lease: float) -> Optional[Dict[str, Any]]:
+        with self._transaction() as conn:
+            row = conn.execute("SELECT payload FROM cluster_jobs WHERE id = ? AND node IS NULL", (job_id,)).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE cluster_jobs SET node = ?, lease_until = ? WHERE id = ?",
+                         (node_id, time.time() + lease, job_id))
+        return json.loads(row[0])
+
+    def renew_jobs(self, node_id: str, job_ids: Iterable[str], lease: float) -> List[str]:
+        ids = list(job_ids)
+        if not ids:
+            return []
+        deadline = time.time() + lease
+        with self._transaction() as conn:
+            lost = [job_id for job_id in ids if conn.execute(
+                "UPDATE cluster_jobs SET lease_until = ? WHERE id = ? AND node = ?", (deadline, job_id, node_id)
+            ).rowcount == 0]
+        return lost
+
+    def finish_jobs(self, job_ids: Iterable[str]):
+        with self._lock:
+            self._conn.executemany("DELETE FROM cluster_jobs WHERE id = ?", [(job_id,) for job_id in job_ids])
+
+    def requeue_expired(self) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "UPDATE cluster_jobs SET node = NULL, lease_until = NULL WHERE node IS NOT NULL AND lease_until < ?",
+                (time.time(),),
+            ).rowcount
+
+    def job_counts(self) -> Dict[str, int]:
+        with self._lock:
+            queued, leased = self._conn.execute(
+                "SELECT COUNT(*) - COUNT(node), COUNT(node) FROM cluster_jobs"
+            ).fetchone()
+        return {"queued": queued or 0, "leased": leased or 0}
+
+    def hit(self, key: str, start: float, window: float) -> Tuple[int, int]:
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT INTO cluster_counters (key, start, count, expires) VALUES (?, ?, 1, ?) "
+                "ON CONFLICT (key, start) DO UPDATE SET count = count + 1",
+                (key, start, start + 2 * window),
+            )
+            rows = dict(conn.execute(
+                "SELECT start, count FROM cluster_counters WHERE key = ? AND start IN (?, ?)",
+                (key, start, start - window),
+            ).fetchall())
+            if self._prune_due():
+                conn.execute("DELETE FROM cluster_counters WHERE expires < ?", (time.time(),))
+        return rows.get(start, 1), rows.get(start - window, 0)
+
+    def unhit(self, key: str, start: float):
+        with self._lock:
+            self._conn.execute("UPDATE cluster_counters SET count = count - 1 WHERE key = ? AND start = ? AND count > 0",
+                               (key, start))
+
+    def try_lead(self, name: str, node_id: str, ttl: float) -> bool:
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute("SELECT node, until FROM cluster_leaders WHERE name = ?", (name,)).fetchone()
+            if row is not None and row[0] != node_id and row[1] > now:
+                return False
+            conn.execute("INSERT OR REPLACE INTO cluster_leaders (name, node, until) VALUES (?, ?, ?)",
+                         (name, node_id, now + ttl))
+        return True
+
+    def resign(self, name: str, node_id: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM cluster_leaders WHERE name = ? AND node = ?", (name, node_id))
+
+    def leader(self, name: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT node FROM cluster_leaders WHERE name = ? AND until > ?",
+                                     (name, time.time())).fetchone()
+        return row[0] if row else None
+
+    def publish(self, messages: List[Dict[str, Any]]):
+        if not messages:
+            return
+        with self._transaction() as conn:
+            conn.executemany("INSERT INTO cluster_messages (body) VALUES (?)",
+                             [(json.dumps(message),) for message in messages])
+            if self._prune_due():
+                conn.execute("DELETE FROM cluster_messages WHERE seq <= (SELECT MAX(seq) FROM cluster_messages) - ?",
+                             (MESSAGE_BACKLOG,))
+
+    def latest_cursor(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(MAX(seq), 0) FROM cluster_messages").fetchone()[0]
+
+    def read(self, cursor: int, limit: int = 500, block: float = 0.0) -> Tuple[int, List[Dict[str, Any]]]:
+        deadline = time.monotonic() + block
+        while True:
+            with self._lock:
+                rows = self._conn.execute("SELECT seq, body FROM cluster_messages WHERE seq > ? ORDER BY seq LIMIT ?",
+                                          (cursor, limit)).fetchall()
+            if rows or time.monotonic() >= deadline:
+                break
+            # Polled: SQLite has no way to wait for another process's writes
+            time.sleep(min(0.05, max(0.0, deadline - time.monotonic())))
+        if not rows:
+            return cursor, []
+        return rows[-1][0], [json.loads(body) for _, body in rows]
+
+    def put_states(self, states: Dict[str, Any]):
+        if not states:
+            return
+        expires = time.time() + STATE_TTL
+        with self._transaction() as conn:
+            conn.executemany("INSERT OR REPLACE INTO cluster_state (key, value, expires) VALUES (?, ?, ?)",
+                             [(key, json.dumps(value), expires) for key, value in states.items()])
+            if self._prune_due():
+                conn.execute("DELETE FROM cluster_state WHERE expires < ?", (time.time(),))
+
+    def get_state(self, key: str) -> Optional[Any]:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM cluster_state WHERE key = ? AND expires > ?",
+                                     (key, time.time())).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class RedisBackend(ClusterBackend):
+    """Shared through a Redis-compatible server; for a cluster of nodes.
+
+    ``client`` is a redis-py client created with ``decode_responses=True``.
+    Multi-key changes are optimistic WATCH/MULTI transactions, so any server
+    speaking the Redis protocol works without scripting.
+    """
+
+    def __init__(self, client, prefix: str = "widmate"):
+        self.redis = client
+        self.prefix = prefix
+        self._jobs = f"{prefix}:jobs"
+        self._scores = f"{prefix}:job_scores"
+        self._queue = f"{prefix}:queue"
+        self._leases = f"{prefix}:leases"
+        self._owners = f"{prefix}:owners"
+        self._bus = f"{prefix}:bus"
+
+    @staticmethod
+    def _score(priority: int, queued_at: float) -> float:
+        # Lower sorts first: priority, then arrival in milliseconds (exact in a double for |priority| < 900)
+        return -priority * 1e13 + queued_at * 1000
+
+    def _transact(self, watch: str, body: Callable[[Any], Any]) -> Any:
+        """Run body(pipe) against a consistent view of ``watch``, retrying when it changes meanwhile"""
+        from redis.exceptions import WatchError
+        with self.redis.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(watch)
+                    return body(pipe)
+                except WatchError:
+                    continue
+
+    def push_job(self, job_id: str, payload: Dict[str, Any], priority: int = 0) -> bool:
+        if not self.redis.hsetnx(self._jobs, job_id, json.dumps(payload)):
+            return False
+        score = self._score(priority, time.time())
+        pipe = self.redis.pipeline()
+        pipe.hset(self._scores, job_id, score)
+        pipe.zadd(self._queue, {job_id: score})
+        pipe.execute()
+        return True
+
+    def push_jobs(self, jobs: List[Tuple[str, Dict[str, Any], int]]) -> int:
+        if not jobs:
+            return 0
+        pipe = self.redis.pipeline()
+        for job_id, payload, _ in jobs:
+            pipe.hsetnx(self._jobs, job_id, json.dumps(payload))
+        added = pipe.execute()
+        now = time.time()
+        for (job_id, _, priority), new in zip(jobs, added):
+            if new:
+                score = self._score(priority, now)
+                pipe.hset(self._scores, job_id, score)
+                pipe.zadd(self._queue, {job_id: score})
+        pipe.execute()
+        return sum(1 for new in added if new)
+
+    def _lease(self, pipe, job_ids: List[str], node_id: str, lease: float):
+        pipe.zrem(self._queue, *job_ids)
+        pipe.zadd(self._leases, {job_id: time.time() + lease for job_id in job_ids})
+        pipe.hset(self._owners, mapping={job_id: node_id for job_id in job_ids})
+        pipe.hmget(self._jobs, job_ids)
+
+    def claim_jobs(self, node_id: str, limit: int, lease: float) -> List[Job]:
+        if limit <= 0:
+            return []
+
+        def claim(pipe):
+            job_ids = pipe.zrange(self._queue, 0, limit - 1)
+            if not job_ids:
+                pipe.unwatch()
+                return []
+            pipe.multi()
+            self._lease(pipe, job_ids, node_id, lease)
+            payloads = pipe.execute()[-1]
+            return [(job_id, json.loads(payload)) for job_id, payload in zip(job_ids, payloads) if payload]
+        return self._transact(self._queue, claim)
+
+    def take_job(self, job_id: str, node_id: str, lease: float) -> Optional[Dict[str, Any]]:
+        def take(pipe):
+            if pipe.zscore(self._queue, job_id) is None:
+                pipe.unwatch()
+                return None
+            pipe.multi()
+            self._lease(pipe, [job_id], node_id, lease)
+            payload = pipe.execute()[-1][0]
+            return json.loads(payload) if payload else None
+        return self._transact(self._queue, take)
+
+    def renew_jobs(self, node_id: str, job_ids: Iterable[str], lease: float) -> List[str]:
+        ids = list(job_ids)
+        if not ids:
+            return []
+        owners = self.redis.hmget(self._owners, ids)
+        held = [job_id for job_id, owner in zip(ids, owners) if owner == node_id]
+        if held:
+            # xx: a lease that was requeued meanwhile is not brought back
+            self.redis.zadd(self._leases, {job_id: time.time() + lease for job_id in held}, xx=True)
+        return [job_id for job_id, owner in zip(ids, owners) if owner != node_id]
+
+    def finish_jobs(self, job_ids: Iterable[str]):
+        ids = list(job_ids)
+        if not ids:
+            return
+        pipe = self.redis.pipeline()
+        pipe.hdel(self._jobs, *ids)
+        pipe.hdel(self._scores, *ids)
+        pipe.hdel(self._owners, *ids)
+        pipe.zrem(self._queue, *ids)
+        pipe.zrem(self._leases, *ids)
+        pipe.execute()
+
+    def requeue_expired(self) -> int:
+        def requeue(pipe):
+            expired = pipe.zrangebyscore(self._leases, "-inf", time.time())
+            if not expired:
+                pipe.unwatch()
+                return 0
+            scores = pipe.hmget(self._scores, expired)
+            pipe.multi()
+            pipe.zrem(self._leases, *expired)
+            pipe.hdel(self._owners, *expired)
+            requeued = {job_id: float(score) for job_id, score in zip(expired, scores) if score is not None}
+            if requeued:
+                pipe.zadd(self._queue, requeued)
+            pipe.execute()
+            return len(requeued)
+        return self._transact(self._leases, requeue)
+
+    def job_counts(self) -> Dict[str, int]:
+        pipe = self.redis.pipeline()
+        pipe.zcard(self._queue)
+        pipe.zcard(self._leases)
+        queued, leased = pipe.execute()
+        return {"queued": queued, "leased": leased}
+
+    def _counter(self, key: str, start: float) -> str:
+        return f"{self.prefix}:rate:{key}:{int(start * 1000)}"
+
+    def hit(self, key: str, start: float, window: float) -> Tuple[int, int]:
+        current = self._counter(key, start)
+        pipe = self.redis.pipeline()
+        pipe.incr(current)
+        pipe.pexpire(current, int(2 * window * 1000) + 1000)
+        pipe.get(self._counter(key, start - window))
+        count, _, previous = pipe.execute()
+        return int(count), int(previous or 0)
+
+    def unhit(self, key: str, start: float):
+        self.redis.decr(self._counter(key, start))
+
+    def try_lead(self, name: str, node_id: str, ttl: float) -> bool:
+        key = f"{self.prefix}:leader:{name}"
+        ttl_ms = int(ttl * 1000)
+        if self.redis.set(key, node_id, nx=True, px=ttl_ms):
+            return True
+
+        def extend(pipe):
+            if pipe.get(key) != node_id:
+                pipe.unwatch()
+                return False
+            pipe.multi()
+            pipe.pexpire(key, ttl_ms)
+            pipe.execute()
+            return True
+        return self._transact(key, extend)
+
+    def resign(self, name: str, node_id: str):
+        key = f"{self.prefix}:leader:{name}"
+
+        def delete(pipe):
+            if pipe.get(key) != node_id:
+                pipe.unwatch()
+                return
+            pipe.multi()
+            pipe.delete(key)
+            pipe.execute()
+        self._transact(key, delete)
+
+    def leader(self, name: str) -> Optional[str]:
+        return self.redis.get(f"{self.prefix}:leader:{name}")
+
+    def publish(self, messages: List[Dict[str, Any]]):
+        if not messages:
+            return
+        pipe = self.redis.pipeline()
+        for message in messages:
+            pipe.xadd(self._bus, {"m": json.dumps(message)}, maxlen=MESSAGE_BACKLOG, approximate=True)
+        pipe.execute()
+
+    def latest_cursor(self) -> str:
+        newest = self.redis.xrevrange(self._bus, count=1)
+        return newest[0][0] if newest else "0-0"
+
+    def read(self, cursor: str, limit: int = 500, block: float = 0.0) -> Tuple[str, List[Dict[str, Any]]]:
+        # block=0 would wait forever
+        response = self.redis.xread({self._bus: cursor}, count=limit, block=int(block * 1000) or None)
+        if not response:
+            return cursor, []
+        entries = response[0][1]
+        return entries[-1][0], [json.loads(fields["m"]) for _, fields in entries]
+
+    def put_states(self, states: Dict[str, Any]):
+        if not states:
+            return
+        pipe = self.redis.pipeline()
+        for key, value in states.items():
+            pipe.set(f"{self.prefix}:state:{key}", json.dumps(value), ex=STATE_TTL)
+        pipe.execute()
+
+    def get_state(self, key: str) -> Optional[Any]:
+        value = self.redis.get(f"{self.prefix}:state:{key}")
+        return json.loads(value) if value is not None else None
+
+    def close(self):
+        self.redis.close()
+
+
+def create_backend(url: str) -> ClusterBackend:
+    """Backend for a CLUSTER_BACKEND URL: memory://, sqlite:///path/to/file.db or redis://host:port/db"""
+    scheme = urlparse(url).scheme
+    if scheme == "memory":
+        return MemoryBackend()
+    if scheme == "sqlite":
+        path = url[len("sqlite://"):]
+        # sqlite:///cluster.db is relative, sqlite:////var/lib/widmate/cluster.db absolute
+        return SQLiteBackend(path[1:] if path.startswith("/") else path)
+    if scheme in ("redis", "rediss", "unix"):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("CLUSTER_BACKEND=redis://... needs the redis package (pip install redis)")
+        return RedisBackend(redis.Redis.from_url(url, decode_responses=True))
+    raise ValueError(f"Unsupported CLUSTER_BACKEND: {url!r}")
+
+
+class ClusterNode:
+    """One process's membership: its leases, leaderships and bus traffic.
+
+    A background thread sends queued messages and task states in batches,
+    delivers incoming messages from other processes to the handlers
+    registered with on(), and every third of a lease renews the jobs this
+    process holds, contends for the leaderships it wants and requeues jobs
+    whose lease ran out anywhere. Handlers run on that thread.
+    """
+
+    def __init__(self, backend: ClusterBackend, node_id: Optional[str] = None, lease: float = 30.0,
+                 poll_interval: float = 0.25, on_lost: Optional[Callable[[List[str]], None]] = None):
+        self.backend = backend
+        self.node_id = node_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.lease = max(3.0, lease)
+        self.poll_interval = max(0.01, poll_interval)
+        # Called with job ids whose lease this process lost, e.g. after a long stall
+        self.on_lost = on_lost
+        self._handlers: Dict[str, Callable[[Dict[str, Any]], None]] = {}
+        self._lock = threading.Lock()
+        # Messages with the same key coalesce, so a burst of progress sends its last state only
+        self._outgoing: Dict[Any, Dict[str, Any]] = {}
+        self._states: Dict[str, Any] = {}
+        self._held: Set[str] = set()
+        self._finished: Set[str] = set()
+        self._leaderships: Dict[str, bool] = {}
+        self._cursor: Any = None
+        self._maintained_at = 0.0
+        self._contact_at = 0.0
+        self._stopping = False
+        self._thread: Optional[threading.Thread] = None
+        self._counters = {
+            "sent": 0,
+            "received": 0,
+            "requeued": 0,
+            "lost": 0,
+            "errors": 0,
+        }
+
+    def on(self, kind: str, handler: Callable[[Dict[str, Any]], None]):
+        self._handlers[kind] = handler
+
+    def publish(self, kind: str, body: Dict[str, Any], key: Any = None):
+        """Queue a message for every other process; sent within one poll interval"""
+        message = {"kind": kind, "node": self.node_id, "body": body}
+        with self._lock:
+            if key is None:
+                key = object()
+            else:
+                # Re-inserted so the message keeps its place after newer ones
+                self._outgoing.pop((kind, key), None)
+                key = (kind, key)
+            self._outgoing[key] = message
+
+    def share_states(self, states: Dict[str, Any]):
+        """Queue task rows for other processes to read with backend.get_state"""
+        with self._lock:
+            self._states.update(states)
+
+    def hold(self, job_id: str):
+        """Keep renewing the lease of a job this process claimed"""
+        with self._lock:
+            self._held.add(job_id)
+            self._finished.discard(job_id)
+
+    def release(self, job_id: str):
+        """The job finished: stop renewing it and remove it from the queue"""
+        with self._lock:
+            self._held.discard(job_id)
+            self._finished.add(job_id)
+
+    def holds(self, job_id: str) -> bool:
+        with self._lock:
+            return job_id in self._held
+
+    def lead(self, name: str):
+        """Contend for the named leadership from now on"""
+        with self._lock:
+            self._leaderships.setdefault(name, False)
+
+    def is_leader(self, name: str) -> bool:
+        with self._lock:
+            return self._leaderships.get(name, False)
+
+    def healthy(self) -> bool:
+        """Whether the backend answered within the last lease"""
+        return self.is_running() and time.time() - self._contact_at < self.lease
+
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.is_running():
+            return
+        self._stopping = False
+        self._cursor = self.backend.latest_cursor()
+        self._maintain()
+        self._thread = threading.Thread(target=self._loop, name="cluster-node", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Send what is queued and give up leaderships; held jobs are requeued once their lease runs out"""
+        self._stopping = True
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=5)
+        self._thread = None
+        try:
+            self._flush()
+            for name in list(self._leaderships):
+                self.backend.resign(name, self.node_id)
+        except Exception as e:
+            logger.warning(f"Cluster node did not shut down cleanly: {e}")
+        with self._lock:
+            self._leaderships = {name: False for name in self._leaderships}
+
+    def _loop(self):
+        while not self._stopping:
+            try:
+                self._flush()
+                self._receive()
+                if time.time() - self._maintained_at >= self.lease / 3:
+                    self._maintain()
+            except Exception as e:
+                self._counters["errors"] += 1
+                logger.error(f"Cluster backend error: {e}")
+                time.sleep(min(self.lease / 3, 5.0))
+
+    def _flush(self):
+        with self._lock:
+            messages = list(self._outgoing.values())
+            states = self._states
+            finished = list(self._finished)
+            self._outgoing = {}
+            self._states = {}
+            self._finished = set()
+        try:
+            if finished:
+                self.backend.finish_jobs(finished)
+            if states:
+                self.backend.put_states(states)
+            if messages:
+                self.backend.publish(messages)
+        except Exception:
+            # Try again next time, unless newer copies were queued meanwhile
+            with self._lock:
+                self._finished.update(finished)
+                for key, value in states.items():
+                    self._states.setdefault(key, value)
+                self._outgoing = {**{id(m): m for m in messages}, **self._outgoing}
+            raise
+        self._counters["sent"] += len(messages)
+        self._contact_at = time.time()
+
+    def _receive(self):
+        self._cursor, messages = self.backend.read(self._cursor, block=self.poll_interval)
+        self._contact_at = time.time()
+        for message in messages:
+            if message.get("node") == self.node_id:
+                continue
+            self._counters["received"] += 1
+            handler = self._handlers.get(message.get("kind"))
+            if handler is None:
+                continue
+            try:
+                handler(message.get("body") or {})
+            except Exception as e:
+                logger.error(f"Cluster message handler for {message.get('kind')} failed: {e}")
+
+    def _maintain(self):
+        self._maintained_at = time.time()
+        with self._lock:
+            held = list(self._held)
+            names = list(self._leaderships)
+        lost = self.backend.renew_jobs(self.node_id, held, self.lease) if held else []
+        leaderships = {}
+        for name in names:
+            leaderships[name] = self.backend.try_lead(name, self.node_id, self.lease)
+        self._counters["requeued"] += self.backend.requeue_expired()
+        self._contact_at = time.time()
+        with self._lock:
+            for name, leading in leaderships.items():
+                if leading != self._leaderships.get(name):
+                    logger.info(f"Cluster node {self.node_id} {'is now' if leading else 'is no longer'} leader for {name}")
+                if name in self._leaderships:
+                    self._leaderships[name] = leading
+            lost = [job_id for job_id in lost if job_id in self._held]
+            self._held.difference_update(lost)
+        if lost:
+            self._counters["lost"] += len(lost)
+            logger.error(f"Cluster node {self.node_id} lost the lease of {len(lost)} job(s)")
+            if self.on_lost is not None:
+                self.on_lost(lost)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            held = len(self._held)
+            leaderships = dict(self._leaderships)
+        return {
+            "node_id": self.node_id,
+            "backend": type(self.backend).__name__,
+            "running": self.is_running(),
+            "healthy": self.healthy(),
+            "lease_seconds": self.lease,
+            "held_jobs": held,
+            "leader_of": sorted(name for name, leading in leaderships.items() if leading),
+            **self._counters,
+        }
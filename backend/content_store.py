@@ -0,0 +1,227 @@
+"""
+Content-addressed store for completed downloads
+Finished files are moved under <downloads>/.store/<sha256> and hardlinked
+back to their per-download name. Each download holds one reference; the
+blob is deleted when the last reference is released.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from loguru import logger
+
+_CHUNK_SIZE = 1024 * 1024
+
+
+def dedup_key(canonical_url: str, format_selector: str) -> str:
+    """Identity of a download request: same media, same format selection"""
+    return hashlib.sha256(f"{canonical_url}\n{format_selector}".encode("utf-8")).hexdigest()
+
+
+def download_name(download_id: str, path: Path) -> str:
+    """Title part of a per-download file name, which is <download_id>_<title>.<ext>"""
+    name = Path(path).name
+    return name[len(download_id) + 1:] if name.startswith(f"{download_id}_") else name
+
+
+def file_digest(path: Path) -> str:
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_CHUNK_SIZE), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+class ContentStore:
+    """Blob index and reference counts, kept in the downloads SQLite database"""
+
+    def __init__(self, root: Path, db_path: str):
+        self.root = Path(root)
+        self.store_dir = self.root / ".store"
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS blobs (
+                    digest TEXT PRIMARY KEY,
+                    path TEXT,
+                    name TEXT,
+                    size INTEGER,
+                    refcount INTEGER,
+                    created_at REAL
+                );
+                CREATE TABLE IF NOT EXISTS blob_keys (
+                    dedup_key TEXT PRIMARY KEY,
+                    digest TEXT
+                );
+                CREATE TABLE IF NOT EXISTS blob_refs (
+                    download_id TEXT PRIMARY KEY,
+                    digest TEXT,
+                    path TEXT
+                );
+                """
+            )
+            self._conn = conn
+        return self._conn
+
+    def lookup(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return the completed blob for a dedup key if its file still exists"""
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute(
+                "SELECT b.digest, b.path, b.size, b.name FROM blob_keys k JOIN blobs b ON b.digest = k.digest "
+                "WHERE k.dedup_key = ?",
+                (key,),
+            ).fetchone()
+            if row is None:
+                return None
+            if not Path(row[1]).exists():
+                with conn:
+                    conn.execute("DELETE FROM blob_keys WHERE digest = ?", (row[0],))
+                return None
+            return {"digest": row[0], "path": row[1], "size": row[2], "name": row[3]}
+
+    def ingest(self, download_id: str, path: Path, key: Optional[str] = None) -> Dict[str, Any]:
+        """Move a finished file into the store and reference it from ``path``.
+
+        Returns the blob digest and the path the download should serve. When
+        hardlinks are not available the original file itself is the blob.
+        """
+        path = Path(path)
+        name = download_name(download_id, path)
+        digest = file_digest(path)
+        blob_path = self.store_dir / digest[:2] / f"{digest}{path.suffix}"
+
+        with self._lock:
+            conn = self._connection()
+            existing = conn.execute("SELECT path FROM blobs WHERE digest = ?", (digest,)).fetchone()
+            if existing and Path(existing[0]).exists():
+                blob_path = Path(existing[0])
+                # Identical bytes already stored: swap our copy for a link to it
+                if _link(blob_path, path, replace=True):
+                    served = path
+                else:
+                    served = blob_path
+                    path.unlink()
+            else:
+                blob_path.parent.mkdir(parents=True, exist_ok=True)
+                if _link(path, blob_path):
+                    served = path
+                else:
+                    blob_path = path
+                    served = path
+                with conn:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO blobs (digest, path, name, size, refcount, created_at) "
+                        "VALUES (?, ?, ?, ?, 0, ?)",
+                        (digest, str(blob_path), name, blob_path.stat().st_size, time.time()),
+                    )
+            with conn:
+                self._add_ref(conn, download_id, digest, served)
+                if key:
+                    conn.execute("INSERT OR REPLACE INTO blob_keys (dedup_key, digest) VALUES (?, ?)", (key, digest))
+        return {"digest": digest, "path": served}
+
+    def attach(self, download_id: str, digest: str, target: Path) -> Path:
+        """Reference an existing blob from a new download, returning the path to serve"""
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute("SELECT path FROM blobs WHERE digest = ?", (digest,)).fetchone()
+            if row is None:
+                raise FileNotFoundError(digest)
+            blob_path = Path(row[0])
+            served = Path(target) if _link(blob_path, Path(target)) else blob_path
+            with conn:
+                self._add_ref(conn, download_id, digest, served)
+        return served
+
+    def _add_ref(self, conn: sqlite3.Connection, download_id: str, digest: str, served: Path):
+        if conn.execute("SELECT 1 FROM blob_refs WHERE download_id = ?", (download_id,)).fetchone():
+            return
+        conn.execute("INSERT INTO blob_refs (download_id, digest, path) VALUES (?, ?, ?)",
+                     (download_id, digest, str(served)))
+        conn.execute("UPDATE blobs SET refcount = refcount + 1 WHERE digest = ?", (digest,))
+
+    def digest_for(self, download_id: str) -> Optional[str]:
+        """Content hash of the blob a download references, if any"""
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT digest FROM blob_refs WHERE download_id = ?", (download_id,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def release(self, download_id: str) -> bool:
+        """Drop a download's reference; the blob goes once nobody references it.
+
+        Returns False when the download never referenced a blob, so the caller
+        owns its file outright.
+        """
+        with self._lock:
+            conn = self._connection()
+            ref = conn.execute("SELECT digest, path FROM blob_refs WHERE download_id = ?", (download_id,)).fetchone()
+            if ref is None:
+                return False
+            digest, served = ref
+            blob = conn.execute("SELECT path, refcount FROM blobs WHERE digest = ?", (digest,)).fetchone()
+            with conn:
+                conn.execute("DELETE FROM blob_refs WHERE download_id = ?", (download_id,))
+                if blob is None or blob[1] <= 1:
+                    conn.execute("DELETE FROM blobs WHERE digest = ?", (digest,))
+                    conn.execute("DELETE FROM blob_keys WHERE digest = ?", (digest,))
+                else:
+                    conn.execute("UPDATE blobs SET refcount = refcount - 1 WHERE digest = ?", (digest,))
+            if served != (blob[0] if blob else None):
+                _unlink(Path(served))
+            if blob is not None and blob[1] <= 1:
+                _unlink(Path(blob[0]))
+            return True
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(refcount), 0) FROM blobs"
+            ).fetchone()
+        return {"blobs": row[0], "bytes": row[1], "references": row[2]}
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+def _link(src: Path, dst: Path, replace: bool = False) -> bool:
+    """Hardlink src to dst; False if the filesystem cannot"""
+    try:
+        if replace:
+            tmp = dst.with_name(dst.name + ".link")
+            os.link(src, tmp)
+            os.replace(tmp, dst)
+        else:
+            if dst.exists():
+                dst.unlink()
+            os.link(src, dst)
+        return True
+    except OSError as e:
+        logger.debug(f"Hardlink {src} -> {dst} unavailable: {e}")
+        return False
+
+
+def _unlink(path: Path):
+    try:
+        path.unlink()
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning(f"Could not remove {path}: {e}")
@@ -0,0 +1,449 @@
+"""
+Disk quota and eviction for the downloads directory
+Completed files are tracked with their last access through /file. A
+background thread re-measures the directory and, above the high watermark,
+evicts least recently used downloads (and their sidecars) until usage is
+back under the low watermark. Running downloads reserve the bytes they
+still need so new work is deferred or rejected before the disk fills up,
+rather than failing with ENOSPC half way through.
+"""
+
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from loguru import logger
+
+# Left behind by interrupted yt-dlp runs
+PARTIAL_SUFFIXES = ('.part', '.ytdl', '.temp')
+_EVICT_BATCH = 100
+
+
+def is_partial_file(name: str) -> bool:
+    return name.endswith(PARTIAL_SUFFIXES) or '.part-Frag' in name
+
+
+def download_id_of(name: str) -> Optional[str]:
+    """Download id a per-download file name ("<download_id>_<title>.<ext>") starts with"""
+    head, sep, _ = name.partition('_')
+    return head if sep and len(head) == 36 else None
+
+
+def format_bytes(n: float) -> str:
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if abs(n) < 1024:
+            return f"{n:.1f}{unit}"
+        n /= 1024
+    return f"{n:.1f}TiB"
+
+
+class DiskQuota:
+    """Usage accounting, LRU/age eviction and space reservations for one downloads directory"""
+
+    def __init__(self, root: Path, db_path: str, content_store, quota_bytes: int = 0,
+                 high_watermark: float = 0.95, low_watermark: float = 0.85, min_free_bytes: int = 0,
+                 max_age: float = 0, interval: float = 60,
+                 active_ids: Optional[Callable[[], Set[str]]] = None,
+                 on_evict: Optional[Callable[[str], None]] = None):
+        self.root = Path(root)
+        self.db_path = db_path
+        self.content_store = content_store
+        self.quota_bytes = max(0, quota_bytes)
+        self.high_watermark = high_watermark
+        self.low_watermark = min(low_watermark, high_watermark)
+        self.min_free_bytes = max(0, min_free_bytes)
+        self.max_age = max_age
+        self.interval = max(1.0, interval)
+        # Ids of queued, running and paused downloads; their files are never touched
+        self.active_ids = active_ids or set
+        self.on_evict = on_evict
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._used = 0
+        self._scanned_at = 0.0
+        # /file hits, written to the database by the background thread
+        self._touched: Dict[str, float] = {}
+        # download id -> [bytes expected, bytes written so far]
+        self._reservations: Dict[str, List[int]] = {}
+        # Bytes a refused reservation asked for; the next pass evicts to make room
+        self._demand = 0
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread: Optional[threading.Thread] = None
+        self._counters = {
+            "evicted": 0,
+            "evicted_bytes": 0,
+            "removed": 0,
+            "orphans_swept": 0,
+            "refused": 0,
+        }
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS file_usage (
+                    download_id TEXT PRIMARY KEY,
+                    path TEXT,
+                    size INTEGER,
+                    accessed_at REAL
+                );
+                CREATE INDEX IF NOT EXISTS idx_file_usage_accessed ON file_usage(accessed_at);
+                """
+            )
+            self._conn = conn
+        return self._conn
+
+    # -- bookkeeping -----------------------------------------------------
+
+    def record(self, download_id: str, path: Path, new_bytes: bool = True):
+        """Track a completed file for eviction; ``new_bytes=False`` for links to an existing blob"""
+        path = Path(path)
+        if not self._inside(path):
+            return
+        try:
+            size = path.stat().st_size
+        except OSError:
+            return
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO file_usage (download_id, path, size, accessed_at) VALUES (?, ?, ?, ?)",
+                    (download_id, str(path), size, time.time()),
+                )
+            if new_bytes:
+                self._used += size
+        if self._over_high_watermark():
+            self._wakeup.set()
+
+    def touch(self, download_id: str):
+        """Note an access through /file; written out with the next background pass"""
+        self._touched[download_id] = time.time()
+
+    def _flush_touches(self, conn: sqlite3.Connection):
+        touched, self._touched = self._touched, {}
+        if touched:
+            with conn:
+                conn.executemany(
+                    "UPDATE file_usage SET accessed_at = ? WHERE download_id = ?",
+                    [(at, download_id) for download_id, at in touched.items()],
+                )
+
+    def _inside(self, path: Path) -> bool:
+        try:
+            return os.path.commonpath([str(self.root.resolve()), str(path.resolve())]) == str(self.root.resolve())
+        except ValueError:
+            return False
+
+    # -- measuring -------------------------------------------------------
+
+    def scan(self) -> int:
+        """Measure the directory (hardlinked files once) and pick up files not tracked yet"""
+        seen: Set[Tuple[int, int]] = set()
+        active = self.active_ids()
+        used = 0
+        untracked: Dict[str, Tuple[str, int, float]] = {}
+        stack = [self.root]
+        while stack:
+            try:
+                entries = list(os.scandir(stack.pop()))
+            except OSError:
+                continue
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(Path(entry.path))
+                        continue
+                    stat = entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+                if (stat.st_dev, stat.st_ino) not in seen:
+                    seen.add((stat.st_dev, stat.st_ino))
+                    used += stat.st_size
+                download_id = download_id_of(entry.name)
+                # Media files in the top level; sidecars and partials go with their download
+                if (download_id and download_id not in active and Path(entry.path).parent == self.root
+                        and not is_partial_file(entry.name) and not entry.name.endswith('.info.json')):
+                    untracked[download_id] = (entry.path, stat.st_size, stat.st_mtime)
+        with self._lock:
+            conn = self._connection()
+            if untracked:
+                known = {r[0] for r in conn.execute("SELECT download_id FROM file_usage")}
+                rows = [(i, *v) for i, v in untracked.items() if i not in known]
+                if rows:
+                    with conn:
+                        conn.executemany(
+                            "INSERT OR IGNORE INTO file_usage (download_id, path, size, accessed_at) VALUES (?, ?, ?, ?)",
+                            rows,
+                        )
+            self._used = used
+            self._scanned_at = time.time()
+        return used
+
+    def used(self) -> int:
+        return self._used
+
+    def _capacity(self) -> Tuple[int, int]:
+        """(bytes in use, bytes allowed) for the quota, or for the filesystem without one"""
+        if self.quota_bytes:
+            return self._used, self.quota_bytes
+        disk = shutil.disk_usage(self.root)
+        return disk.used, disk.total
+
+    def _over_high_watermark(self) -> bool:
+        used, capacity = self._capacity()
+        return used > capacity * self.high_watermark
+
+    def available(self, exclude: Optional[str] = None) -> int:
+        """Bytes new downloads may still write, after the reserve and running downloads' remaining bytes"""
+        free = shutil.disk_usage(self.root).free - self.min_free_bytes
+        if self.quota_bytes:
+            free = min(free, self.quota_bytes - self._used)
+        with self._lock:
+            outstanding = sum(max(0, total - done) for i, (total, done) in self._reservations.items() if i != exclude)
+        return free - outstanding
+
+    # -- admission -------------------------------------------------------
+
+    def admit(self, estimated_bytes: int = 0) -> Optional[str]:
+        """Reason a new download of about this size cannot be accepted now, or None"""
+        available = self.available()
+        if estimated_bytes <= available and available > 0:
+            return None
+        self._refuse(max(estimated_bytes - available, 1))
+        if available <= 0:
+            return "Download storage is full"
+        return f"Not enough disk space: needs {format_bytes(estimated_bytes)}, {format_bytes(available)} available"
+
+    def reserve(self, download_id: str, total_bytes: int, downloaded_bytes: int = 0) -> Optional[str]:
+        """Hold space for a running download once its size is known; returns a reason to defer it, or None.
+
+        Called on every progress tick: ticks for the file already reserved
+        only update its size and how much of it has been written.
+        """
+        with self._lock:
+            held = self._reservations.get(download_id)
+            # Same file, maybe with a refined size estimate; a smaller count means the next file started
+            if held is not None and downloaded_bytes >= held[1]:
+                held[0], held[1] = total_bytes, downloaded_bytes
+                return None
+        needed = total_bytes - downloaded_bytes
+        available = self.available(exclude=download_id)
+        if needed > available:
+            self._refuse(needed - available)
+            return f"Not enough disk space: needs {format_bytes(needed)}, {format_bytes(max(available, 0))} available"
+        with self._lock:
+            self._reservations[download_id] = [total_bytes, downloaded_bytes]
+        return None
+
+    def release(self, download_id: str):
+        """Drop a download's reservation when it stops"""
+        with self._lock:
+            self._reservations.pop(download_id, None)
+
+    def _refuse(self, shortfall: int):
+        with self._lock:
+            self._demand = max(self._demand, shortfall)
+            self._counters["refused"] += 1
+        self._wakeup.set()
+
+    # -- eviction and removal --------------------------------------------
+
+    def enforce(self) -> List[str]:
+        """Evict expired downloads, then least recently used ones until under the low watermark"""
+        with self._lock:
+            conn = self._connection()
+            self._flush_touches(conn)
+            demand, self._demand = self._demand, 0
+            # Only evict for a refused download if that can actually make room for it
+            if demand and demand > conn.execute("SELECT COALESCE(SUM(size), 0) FROM file_usage").fetchone()[0]:
+                demand = 0
+            expired = []
+            if self.max_age:
+                expired = [r[0] for r in conn.execute(
+                    "SELECT download_id FROM file_usage WHERE accessed_at < ?", (time.time() - self.max_age,)
+                )]
+        evicted = list(expired)
+        if expired:
+            self._evict(expired)
+
+        used, capacity = self._capacity()
+        excess = demand
+        if used > capacity * self.high_watermark:
+            excess = max(excess, int(used - capacity * self.low_watermark))
+        while excess > 0:
+            with self._lock:
+                rows = self._connection().execute(
+                    "SELECT download_id, size FROM file_usage ORDER BY accessed_at LIMIT ?", (_EVICT_BATCH,)
+                ).fetchall()
+            if not rows:
+                logger.warning(f"Disk quota: nothing left to evict, still {format_bytes(excess)} over")
+                break
+            # Oldest first, just enough of them to cover the excess if their bytes are not shared
+            batch, expected = [], 0
+            for download_id, size in rows:
+                batch.append(download_id)
+                expected += size or 0
+                if expected >= excess:
+                    break
+            excess -= self._evict(batch)
+            evicted.extend(batch)
+        return evicted
+
+    def _evict(self, download_ids: List[str]) -> int:
+        freed = self._remove_files(download_ids)
+        with self._lock:
+            self._counters["evicted"] += len(download_ids)
+            self._counters["evicted_bytes"] += freed
+        logger.info(f"Evicted {len(download_ids)} downloads ({format_bytes(freed)}) to free disk space")
+        if self.on_evict is not None:
+            for download_id in download_ids:
+                try:
+                    self.on_evict(download_id)
+                except Exception as e:
+                    logger.error(f"Eviction callback failed for {download_id}: {e}")
+        return freed
+
+    def remove(self, download_ids: Iterable[str]) -> int:
+        """Delete the files of cleared downloads, including sidecars; returns bytes freed"""
+        ids = list(download_ids)
+        freed = self._remove_files(ids) if ids else 0
+        with self._lock:
+            self._counters["removed"] += len(ids)
+        return freed
+
+    def _remove_files(self, download_ids: List[str]) -> int:
+        wanted = set(download_ids)
+        # Chunked to stay under SQLite's bound-parameter limit
+        chunks = [download_ids[start:start + 500] for start in range(0, len(download_ids), 500)]
+        tracked = []
+        with self._lock:
+            conn = self._connection()
+            for chunk in chunks:
+                tracked.extend(conn.execute(
+                    f"SELECT download_id, path FROM file_usage WHERE download_id IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                ).fetchall())
+        freed = 0
+        for download_id, path in tracked:
+            freed += self._unlink_tracked(download_id, Path(path))
+        # Sidecars (.info.json), partials and untracked outputs share the id prefix
+        try:
+            entries = list(os.scandir(self.root))
+        except OSError:
+            entries = []
+        for entry in entries:
+            if download_id_of(entry.name) in wanted and entry.is_file(follow_symlinks=False):
+                freed += _unlink(Path(entry.path))
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                for chunk in chunks:
+                    conn.execute(f"DELETE FROM file_usage WHERE download_id IN ({','.join('?' * len(chunk))})", chunk)
+            self._used = max(0, self._used - freed)
+        return freed
+
+    def _unlink_tracked(self, download_id: str, path: Path) -> int:
+        # Held open so the inode can be asked afterwards whether any link to it is left
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError:
+            fd = None
+        try:
+            # The store drops our link, and the blob too if this was its last reference
+            if not self.content_store.release(download_id):
+                _unlink(path)
+            if fd is None:
+                return 0
+            stat = os.fstat(fd)
+            return stat.st_size if stat.st_nlink == 0 else 0
+        finally:
+            if fd is not None:
+                os.close(fd)
+
+    def sweep_orphans(self) -> int:
+        """Delete partial files of downloads that are no longer queued, running or paused"""
+        active = self.active_ids()
+        removed = 0
+        try:
+            entries = list(os.scandir(self.root))
+        except OSError:
+            return 0
+        for entry in entries:
+            download_id = download_id_of(entry.name)
+            if download_id and download_id not in active and is_partial_file(entry.name):
+                _unlink(Path(entry.path))
+                removed += not os.path.exists(entry.path)
+        with self._lock:
+            self._counters["orphans_swept"] += removed
+        if removed:
+            logger.info(f"Removed {removed} orphaned partial files from {self.root}")
+        return removed
+
+    # -- background pass -------------------------------------------------
+
+    def start(self):
+        """Measure the directory and start the background eviction thread"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._loop, name="disk-quota", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping = True
+        self._wakeup.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=10)
+        self._thread = None
+        with self._lock:
+            if self._conn is not None:
+                self._flush_touches(self._conn)
+                self._conn.close()
+                self._conn = None
+
+    def _loop(self):
+        while not self._stopping:
+            try:
+                self.scan()
+                self.enforce()
+            except Exception as e:
+                logger.error(f"Disk quota pass failed: {e}")
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        used, capacity = self._capacity()
+        with self._lock:
+            reserved = sum(max(0, total - done) for total, done in self._reservations.values())
+            return {
+                "used": self._used,
+                "quota": self.quota_bytes or None,
+                "usage_ratio": used / capacity if capacity else None,
+                "high_watermark": self.high_watermark,
+                "low_watermark": self.low_watermark,
+                "reserved": reserved,
+                "reservations": len(self._reservations),
+                "scanned_at": self._scanned_at,
+                **self._counters,
+            }
+
+
+def _unlink(path: Path) -> int:
+    """Delete a file, returning its size (0 if it was already gone)"""
+    try:
+        size = path.stat().st_size
+        path.unlink()
+        return size
+    except FileNotFoundError:
+        return 0
+    except OSError as e:
+        logger.warning(f"Could not remove {path}: {e}")
+        return 0
@@ -0,0 +1,118 @@
+"""
+Bounded executor for blocking yt-dlp metadata extraction
+Keeps extract_info calls off the event loop with a fixed worker count,
+a bounded backlog and a per-call timeout
+"""
+
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from metrics import registry
+
+WAIT_SECONDS = registry.histogram("widmate_extraction_queue_wait_seconds", "Time extractions waited for a pool thread")
+
+
+class ExtractionBusy(Exception):
+    """Raised when the extraction backlog is full"""
+
+
+class ExtractionTimeout(Exception):
+    """Raised when an extraction does not finish within its timeout"""
+
+
+class ExtractionExecutor:
+    """Runs blocking extraction calls in a dedicated, size-bounded thread pool"""
+
+    def __init__(self, max_workers: int = 4, max_queue: int = 32, timeout: float = 60.0):
+        self.max_workers = max(1, max_workers)
+        self.max_queue = max(0, max_queue)
+        self.timeout = timeout
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="extract")
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+        self._counters = {
+            "submitted": 0,
+            "completed": 0,
+            "failed": 0,
+            "rejected": 0,
+            "timeouts": 0,
+        }
+        self._wait_avg = 0.0
+        self._wait_max = 0.0
+        self._run_avg = 0.0
+
+    async def run(self, func: Callable[..., Any], *args, timeout: Optional[float] = None) -> Any:
+        """Run ``func(*args)`` in the pool and await its result"""
+        with self._lock:
+            if self._queued + self._running >= self.max_workers + self.max_queue:
+                self._counters["rejected"] += 1
+                raise ExtractionBusy("Extraction queue is full")
+            self._queued += 1
+            self._counters["submitted"] += 1
+
+        submitted_at = time.monotonic()
+
+        def _call():
+            started_at = time.monotonic()
+            with self._lock:
+                self._queued -= 1
+                self._running += 1
+                self._record_wait(started_at - submitted_at)
+            ok = False
+            try:
+                result = func(*args)
+                ok = True
+                return result
+            finally:
+                finished_at = time.monotonic()
+                with self._lock:
+                    self._running -= 1
+                    self._counters["completed" if ok else "failed"] += 1
+                    self._run_avg += 0.2 * ((finished_at - started_at) - self._run_avg)
+
+        future = self._pool.submit(_call)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout or self.timeout)
+        except asyncio.TimeoutError:
+            self._drop(future)
+            with self._lock:
+                self._counters["timeouts"] += 1
+            raise ExtractionTimeout("Extraction timed out")
+        except asyncio.CancelledError:
+            # The caller went away (client disconnect, shutdown)
+            self._drop(future)
+            raise
+
+    def _drop(self, future):
+        """A call that has not started yet is dropped; a running one finishes in the background"""
+        # Also True when the awaiting asyncio future already cancelled it; _call never runs either way
+        if future.cancel():
+            with self._lock:
+                self._queued -= 1
+
+    def _record_wait(self, waited: float):
+        self._wait_avg += 0.2 * (waited - self._wait_avg)
+        self._wait_max = max(self._wait_max, waited)
+        WAIT_SECONDS.observe(waited)
+
+    def stats(self) -> Dict[str, Any]:
+        """Current backlog, utilization and wait-time figures"""
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "timeout": self.timeout,
+                "queued": self._queued,
+                "running": self._running,
+                "avg_wait_seconds": round(self._wait_avg, 4),
+                "max_wait_seconds": round(self._wait_max, 4),
+                "avg_run_seconds": round(self._run_avg, 4),
+                **self._counters,
+            }
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,269 @@
+"""
+File responses for /file/{download_id} and /stream/{download_id}
+Adds single-range requests (Range/If-Range), strong validators with 304
+handling and zero-copy transfer when the ASGI server offers it, plus an
+offload mode that hands the transfer to nginx/Caddy (X-Accel-Redirect) or
+Apache/lighttpd (X-Sendfile) after Python has authorized the request.
+Downloads still in progress can be tailed as yt-dlp writes them.
+"""
+
+import asyncio
+import inspect
+import os
+import stat
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple, Union
+from urllib.parse import quote
+
+import anyio
+from fastapi import Request
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+CHUNK_SIZE = 256 * 1024
+
+OFFLOAD_MODES = ("", "x-accel", "x-sendfile")
+
+
+def content_disposition(filename: str) -> str:
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"attachment; filename*=utf-8''{quoted}"
+    return f'attachment; filename="{filename}"'
+
+
+def strong_etag(st: os.stat_result, digest: Optional[str] = None) -> str:
+    """Content hash when known, else inode/size/mtime (completed files are never rewritten)"""
+    if digest:
+        return f'"{digest}"'
+    return f'"{st.st_ino:x}-{st.st_size:x}-{st.st_mtime_ns:x}"'
+
+
+def _etag_list(header: str) -> List[str]:
+    return [tag.strip() for tag in header.split(",") if tag.strip()]
+
+
+def _parse_http_date(value: str) -> Optional[float]:
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """Parse a single "bytes=" range into an inclusive (start, end).
+
+    Returns None when the header should be ignored (malformed, or several
+    ranges, which are answered with the whole file) and raises ValueError
+    when the range cannot be satisfied.
+    """
+    units, _, spec = header.partition("=")
+    if units.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, dash, last = spec.strip().partition("-")
+    if not dash:
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        if not last.isdigit():
+            return None
+        if int(last) == 0 or size == 0:
+            raise ValueError("Unsatisfiable suffix range")
+        return max(0, size - int(last)), size - 1
+    if not first.isdigit() or (last and not last.isdigit()):
+        return None
+    start = int(first)
+    end = int(last) if last else size - 1
+    if last and start > end:
+        return None
+    if start >= size:
+        raise ValueError("Range starts past the end of the file")
+    return start, min(end, size - 1)
+
+
+class DownloadFileResponse(Response):
+    """Serve a completed download with validators, ranges and zero-copy send"""
+
+    def __init__(self, request: Request, path: Path, filename: str, digest: Optional[str] = None,
+                 offload: str = "", offload_prefix: str = "", offload_root: Optional[Path] = None,
+                 media_type: str = "application/octet-stream"):
+        super().__init__(content=None, status_code=200, media_type=media_type)
+        self.path = Path(path)
+        self.file_stat = os.stat(self.path)
+        if not stat.S_ISREG(self.file_stat.st_mode):
+            raise FileNotFoundError(str(self.path))
+        self.start = 0
+        self.end = self.file_stat.st_size - 1
+        self.send_body = request.method != "HEAD"
+
+        size = self.file_stat.st_size
+        etag = strong_etag(self.file_stat, digest)
+        last_modified = formatdate(self.file_stat.st_mtime, usegmt=True)
+        self.headers["etag"] = etag
+        self.headers["last-modified"] = last_modified
+        self.headers["accept-ranges"] = "bytes"
+        self.headers["content-disposition"] = content_disposition(filename)
+
+        if self._not_modified(request, etag):
+            self._set_status(304)
+            del self.headers["content-type"]
+            del self.headers["content-length"]
+            return
+
+        if offload:
+            # The front-end server re-reads the request's Range/If-* headers itself
+            self._offload(offload, offload_prefix, offload_root)
+            return
+
+        range_header = request.headers.get("range")
+        if range_header and self._range_applies(request.headers.get("if-range"), etag, last_modified):
+            try:
+                byte_range = parse_range(range_header, size)
+            except ValueError:
+                self._set_status(416)
+                self.headers["content-range"] = f"bytes */{size}"
+                self.headers["content-length"] = "0"
+                return
+            if byte_range is not None:
+                self.start, self.end = byte_range
+                self._set_status(206)
+                self.headers["content-range"] = f"bytes {self.start}-{self.end}/{size}"
+        self.headers["content-length"] = str(self.end - self.start + 1)
+
+    def _set_status(self, status_code: int):
+        self.status_code = status_code
+        if status_code in (304, 416):
+            self.send_body = False
+
+    def _not_modified(self, request: Request, etag: str) -> bool:
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match is not None:
+            # Weak comparison, as RFC 9110 requires for If-None-Match
+            tags = {tag[2:] if tag.startswith("W/") else tag for tag in _etag_list(if_none_match)}
+            return "*" in tags or etag in tags
+        if_modified_since = request.headers.get("if-modified-since")
+        if if_modified_since:
+            since = _parse_http_date(if_modified_since)
+            return since is not None and int(self.file_stat.st_mtime) <= since
+        return False
+
+    @staticmethod
+    def _range_applies(if_range: Optional[str], etag: str, last_modified: str) -> bool:
+        if if_range is None:
+            return True
+        # Strong comparison only: a weak tag or a different date means "send it all"
+        return if_range == etag or if_range == last_modified
+
+    def _offload(self, mode: str, prefix: str, root: Optional[Path]):
+        self.send_body = False
+        if mode == "x-accel":
+            relative = self.path.resolve().relative_to(Path(root).resolve()) if root else Path(self.path.name)
+            self.headers["x-accel-redirect"] = prefix.rstrip("/") + "/" + quote(relative.as_posix())
+        else:
+            self.headers["x-sendfile"] = str(self.path.resolve())
+        # No body from us; content-length is left to the server that sends the file
+        self.headers["content-length"] = "0"
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if not self.send_body:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        extensions = scope.get("extensions") or {}
+        count = self.end - self.start + 1
+        if count <= 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        elif "http.response.zerocopysend" in extensions:
+            with open(self.path, "rb") as f:
+                await send({
+                    "type": "http.response.zerocopysend",
+                    "file": f,
+                    "offset": self.start,
+                    "count": count,
+                    "more_body": False,
+                })
+        elif "http.response.pathsend" in extensions and count == self.file_stat.st_size:
+            await send({"type": "http.response.pathsend", "path": str(self.path)})
+        else:
+            await self._send_chunks(send, count)
+
+    async def _send_chunks(self, send: Send, count: int):
+        async with await anyio.open_file(self.path, mode="rb") as f:
+            await f.seek(self.start)
+            remaining = count
+            while remaining > 0:
+                chunk = await f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+            if remaining > 0:
+                # File shrank underneath us; end the response rather than hang
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+
+class StreamAborted(Exception):
+    """The file being streamed can no longer be continued"""
+
+
+async def tail_growing_file(source: Callable[[], Union[Optional[Dict[str, Any]], Awaitable[Optional[Dict[str, Any]]]]],
+                            poll_interval: float = 0.25, chunk_size: int = CHUNK_SIZE) -> AsyncIterator[bytes]:
+    """Yield a download's bytes as they are written, until it completes.
+
+    ``source()`` (a plain or coroutine function) describes the download:
+    ``status``, ``path`` (the file being written, or the final file once
+    completed) and ``merge`` (the file being written is only one input of a
+    later merge, so it is not tailed). The
+    open descriptor follows yt-dlp's .part -> final rename; a completed file
+    that is a different inode from the one tailed means postprocessing
+    rewrote it, which can only be handled if nothing was sent yet.
+    """
+    f = None
+    sent = 0
+    try:
+        while True:
+            state = source()
+            if inspect.isawaitable(state):
+                state = await state
+            if state is None or state['status'] in ('failed', 'cancelled'):
+                raise StreamAborted(f"download {state['status'] if state else 'removed'}")
+            completed = state['status'] == 'completed'
+
+            if f is None and state['path'] and (completed or not state['merge']):
+                try:
+                    f = open(state['path'], 'rb')
+                except FileNotFoundError:
+                    pass  # renamed between hook and open; the next poll sees the new name
+
+            if f is not None:
+                chunk = await anyio.to_thread.run_sync(f.read, chunk_size)
+                if chunk:
+                    sent += len(chunk)
+                    yield chunk
+                    continue
+                ours = os.fstat(f.fileno())
+                if ours.st_size < sent:
+                    raise StreamAborted("file was truncated (download restarted)")
+                if completed:
+                    try:
+                        final = os.stat(state['path'])
+                    except FileNotFoundError:
+                        raise StreamAborted("completed file is missing")
+                    if (final.st_ino, final.st_dev) == (ours.st_ino, ours.st_dev):
+                        return
+                    if sent == ours.st_size == final.st_size:
+                        # Swapped for a link to identical stored content (deduplication)
+                        return
+                    if sent:
+                        raise StreamAborted("file was replaced by postprocessing")
+                    f.close()
+                    f = None
+                    continue
+
+            await asyncio.sleep(poll_interval)
+    finally:
+        if f is not None:
+            f.close()
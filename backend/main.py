@@ -1,25 +1,40 @@
 from fastapi import FastAPI, HTTPException, BackgroundTasks, Request, UploadFile, File, WebSocket, WebSocketDisconnect
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Callable, Set, Tuple, Union
+import os
+from ytdlp_runtime import RuntimeStore, RuntimeInstallError, use_active_runtime
+# Import yt-dlp from the side-by-side install an upgrade activated, if any
+use_active_runtime(os.getenv("YTDLP_RUNTIMES_DIR", "runtimes"))
 import yt_dlp
 import asyncio
+import functools
+import itertools
 import uuid
-import os
 import json
+import re
 import time
 from pathlib import Path
 from loguru import logger
-import psutil
 import threading
-from datetime import datetime
-from collections import defaultdict
-import time
-import subprocess
-import sys
-import requests
-import pkg_resources
+from datetime import datetime, timedelta
+from extraction import ExtractionExecutor, ExtractionBusy, ExtractionTimeout
+from metadata_cache import MetadataCache, canonicalize_url
+from ydl_pool import YoutubeDLPool
+from ws_fanout import EventHub
+from process_pool import DownloadProcessPool, perform_download, merges_formats
+from scheduler import DownloadScheduler, parse_weights
+from rate_limit import RateLimiter, SharedRateLimiter, parse_limits
+from content_store import ContentStore, dedup_key, download_name
+from disk_quota import DiskQuota, is_partial_file
+from playlist_jobs import PlaylistJob
+from progress import SpeedMeter, format_eta, format_speed, progress_numbers
+from task_record import TaskRecord, TaskTable
+from cluster import ClusterNode, create_backend
+from version_service import VersionService, DEFAULT_INDEX_URL
+from metrics import LOCK_BUCKETS, TimedLock, registry
+from file_response import DownloadFileResponse, OFFLOAD_MODES, StreamAborted, content_disposition, tail_growing_file
 from auto_updater import start_auto_updater, stop_auto_updater, get_auto_updater_status, configure_auto_updater, force_update_check, force_update
 
 # Initialize FastAPI app
@@ -32,27 +47,23 @@ app = FastAPI(
 # Initialize version info on startup
 @app.on_event("startup")
 async def startup_event():
-    global version_info
-    
-    # Get current and latest versions
-    current_version = get_current_ytdlp_version()
-    latest_version = get_latest_ytdlp_version()
+    # Revalidate the cached latest version in the background; startup never waits on the index
+    snapshot = version_service.snapshot()
+    logger.info(f"yt-dlp version on startup: current={snapshot['current_version']}, last known latest={snapshot['latest_version']}")
+    version_service.revalidate()
     
-    # Update global state
-    version_info["current_version"] = current_version
-    version_info["latest_version"] = latest_version
-    version_info["update_available"] = current_version != latest_version and latest_version != "unknown"
-    version_info["last_check"] = time.time()
-    
-    logger.info(f"yt-dlp version check on startup: current={current_version}, latest={latest_version}")
-    if version_info["update_available"]:
-        logger.info(f"yt-dlp update available: {current_version} -> {latest_version}")
-    else:
-        logger.info(f"yt-dlp is up to date: {current_version}")
+    # Joined before the auto-updater starts, so it knows whether this process leads
+    if cluster_node is not None:
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, cluster_node.start)
+            logger.info(f"Joined the cluster as {cluster_node.node_id} ({type(cluster_backend).__name__})")
+        except Exception as e:
+            logger.error(f"Failed to join the cluster: {e}")
     
     # Start auto-updater service
     try:
-        start_auto_updater()
+        is_leader = (lambda: cluster_node.is_leader(UPDATER_LEADERSHIP)) if cluster_node is not None else None
+        start_auto_updater(version_service, install_ytdlp, is_leader=is_leader)
         logger.info("Auto-updater service started")
     except Exception as e:
         logger.error(f"Failed to start auto-updater: {e}")
@@ -60,35 +71,77 @@ async def startup_event():
 @app.on_event("shutdown")
 async def shutdown_event():
     """Cleanup on shutdown"""
+    global SHUTTING_DOWN
+    SHUTTING_DOWN = True
+    if cluster_claimer is not None:
+        cluster_claimer.cancel()
+    system_stats.stop()
+    disk_quota.stop()
     try:
         stop_auto_updater()
         logger.info("Auto-updater service stopped")
     except Exception as e:
         logger.error(f"Error stopping auto-updater: {e}")
+    
+    extraction_executor.shutdown()
+    ydl_pool.clear()
+    if process_pool is not None:
+        process_pool.shutdown()
+    
+    # Flush pending task state before the process exits
+    try:
+        task_store.close()
+        logger.info("Download store flushed")
+    except Exception as e:
+        logger.error(f"Error flushing download store: {e}")
+    content_store.close()
+    # After the store, so its last rows still reach the other processes
+    if cluster_node is not None:
+        cluster_node.stop()
+        cluster_backend.close()
 
-# Simple rate limiting storage
-rate_limit_storage = defaultdict(list)
-RATE_LIMIT_WINDOW = 60  # 1 minute
-RATE_LIMIT_MAX_REQUESTS = 30
+# Several processes or nodes serving as one: memory://, sqlite:///cluster.db (one node) or redis://host:6379/0
+CLUSTER_BACKEND = os.getenv("CLUSTER_BACKEND", "").strip()
+CLUSTER_LEASE = float(os.getenv("CLUSTER_LEASE_SECONDS", "30"))
+CLUSTER_CLAIM_INTERVAL = float(os.getenv("CLUSTER_CLAIM_INTERVAL", "2"))
+UPDATER_LEADERSHIP = "auto-updater"
+cluster_backend = create_backend(CLUSTER_BACKEND) if CLUSTER_BACKEND else None
+cluster_node: Optional[ClusterNode] = None
+if cluster_backend is not None:
+    cluster_node = ClusterNode(
+        cluster_backend,
+        lease=CLUSTER_LEASE,
+        poll_interval=float(os.getenv("CLUSTER_POLL_INTERVAL", "0.25")),
+        on_lost=lambda job_ids: drop_lost_jobs(job_ids),
+    )
+    cluster_node.lead(UPDATER_LEADERSHIP)
+
+# Per-endpoint limits as requests/window-seconds; RATE_LIMITS overrides individual entries
+DEFAULT_RATE_LIMITS = "info=30/60,download=10/60,download_batch=5/60,version_check=10/60,version_update=5/60,search=1/1"
+RATE_LIMIT_RULES = {**parse_limits(DEFAULT_RATE_LIMITS), **parse_limits(os.getenv("RATE_LIMITS", ""))}
+if cluster_backend is not None:
+    # Every process counts against the same limits
+    rate_limiter = SharedRateLimiter(RATE_LIMIT_RULES, cluster_backend)
+else:
+    rate_limiter = RateLimiter(RATE_LIMIT_RULES, max_keys=int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000")))
 REQUIRE_API_KEY = os.getenv("REQUIRE_API_KEY", "false").lower() == "true"
 API_KEYS = set([k.strip() for k in os.getenv("API_KEYS", "").split(",") if k.strip()])
+RATE_LIMITED = registry.counter("widmate_rate_limited_requests", "Requests rejected with 429", ("endpoint",))
 
-def check_rate_limit(client_key: str, max_requests: int = RATE_LIMIT_MAX_REQUESTS) -> bool:
-    """Simple rate limiting check"""
-    now = time.time()
-    # Clean old requests
-    rate_limit_storage[client_key] = [
-        req_time for req_time in rate_limit_storage[client_key]
-        if now - req_time < RATE_LIMIT_WINDOW
-    ]
-    
-    # Check if limit exceeded
-    if len(rate_limit_storage[client_key]) >= max_requests:
-        return False
-    
-    # Add current request
-    rate_limit_storage[client_key].append(now)
-    return True
+async def enforce_rate_limit(request: Request, response: Response, endpoint: str):
+    """Count the request against its endpoint limit, raising 429 once exceeded"""
+    if isinstance(rate_limiter, SharedRateLimiter):
+        # Counted in the cluster backend, a round trip that must not block the event loop
+        result = await asyncio.get_running_loop().run_in_executor(
+            None, rate_limiter.check, endpoint, get_client_key(request))
+    else:
+        result = rate_limiter.check(endpoint, get_client_key(request))
+    if result is None:
+        return
+    if not result.allowed:
+        RATE_LIMITED.labels(endpoint).inc()
+        raise HTTPException(status_code=429, detail="Rate limit exceeded", headers=result.headers())
+    response.headers.update(result.headers())
 
 def get_client_key(request: Request) -> str:
     api_key = request.headers.get("X-API-Key") or request.query_params.get("api_key")
@@ -115,76 +168,380 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Retry-After", "X-RateLimit-Limit", "X-RateLimit-Remaining", "X-RateLimit-Reset"],
 )
 
 # Configure logging
 logger.add("logs/widmate_backend.log", rotation="10 MB", retention="7 days")
 
-from storage import save_download_tasks, load_download_tasks
+from storage import DownloadStore, row_task, task_row
+from system_stats import SystemStatsCollector
 
 # Global storage for download tasks
-download_tasks: Dict[str, Dict[str, Any]] = load_download_tasks()
-download_lock = threading.Lock()
-ws_clients: List[WebSocket] = []
+task_store = DownloadStore()
+# Only queued, running and paused tasks live in memory; history is queried from the store.
+# In a cluster a process holds only the jobs it claimed from the shared queue.
+download_tasks = TaskTable(task_store.load_active() if cluster_node is None else None)
+if cluster_node is not None:
+    # Other processes read the rows of the tasks this one runs (see stored_task)
+    task_store.on_flush = lambda rows: cluster_node.share_states({row[0]: row for row in rows})
+download_lock = TimedLock(
+    wait=registry.histogram("widmate_download_lock_wait_seconds", "Time spent waiting for download_lock", buckets=LOCK_BUCKETS),
+    hold=registry.histogram("widmate_download_lock_hold_seconds", "Time download_lock was held", buckets=LOCK_BUCKETS),
+)
 EVENT_LOOP: Optional[asyncio.AbstractEventLoop] = None
-event_queue: Optional[asyncio.Queue] = None
-download_queue: Optional[asyncio.Queue] = None
+
+def render_event(event: Dict[str, Any]) -> Dict[str, Any]:
+    """Add display strings for speed/eta to an outgoing WebSocket event"""
+    speed, eta = event.get('speed'), event.get('eta')
+    event['speed_bps'] = speed
+    event['eta_seconds'] = eta
+    event['speed'] = format_speed(speed)
+    event['eta'] = format_eta(eta)
+    return event
+
+event_hub = EventHub(
+    max_rate=float(os.getenv("WS_MAX_EVENTS_PER_SECOND", "4")),
+    max_pending=int(os.getenv("WS_MAX_PENDING", "256")),
+    send_timeout=float(os.getenv("WS_SEND_TIMEOUT", "10")),
+    render=render_event,
+)
+download_queue: Optional[DownloadScheduler] = None
 workers: List[asyncio.Task] = []
+# download_id -> {url, ydl_opts, client_key, priority} for jobs that may still be (re)started
+job_specs: Dict[str, Any] = {}
+# download_id -> 'cancelled' | 'paused' for running jobs asked to stop
+abort_requests: Dict[str, str] = {}
+running_downloads = set()
+# Request-level dedup: dedup key -> primary download_id, primary -> attached download_ids
+inflight_downloads: Dict[str, str] = {}
+download_followers: Dict[str, List[str]] = {}
+# download_id -> {path, merge} of the file yt-dlp is currently writing
+write_targets: Dict[str, Dict[str, Any]] = {}
+# download_id -> smoothed speed of a running job
+speed_meters: Dict[str, SpeedMeter] = {}
+# Playlist downloads fanned out into per-item jobs: parent download_id -> roll-up of its items
+playlist_jobs: Dict[str, PlaylistJob] = {}
 MAX_WORKERS = int(os.getenv("MAX_CONCURRENT_DOWNLOADS", "3"))
+TERMINAL_STATUSES = ('completed', 'failed', 'cancelled')
+DOWNLOADS_PAGE_MAX = int(os.getenv("DOWNLOADS_PAGE_MAX", "200"))
+PLAYLIST_PAGE_DEFAULT = 50
+PLAYLIST_PAGE_MAX = int(os.getenv("PLAYLIST_PAGE_MAX", "200"))
+PLAYLIST_MAX_PARALLEL = int(os.getenv("PLAYLIST_MAX_PARALLEL", "2"))
+BATCH_MAX_DOWNLOADS = int(os.getenv("BATCH_MAX_DOWNLOADS", "500"))
+
+# "thread" runs yt-dlp in the API process; "process" isolates each download in a worker process
+DOWNLOAD_EXECUTOR = os.getenv("DOWNLOAD_EXECUTOR", "thread").lower()
+process_pool: Optional[DownloadProcessPool] = None
+
+# Metadata extraction (/info, /search) runs in its own bounded pool so a slow
+# site cannot stall the event loop
+extraction_executor = ExtractionExecutor(
+    max_workers=int(os.getenv("EXTRACT_MAX_WORKERS", "4")),
+    max_queue=int(os.getenv("EXTRACT_MAX_QUEUE", "32")),
+    timeout=float(os.getenv("EXTRACT_TIMEOUT", "60")),
+)
+
+# Extracted info dicts, shared between /info and the download path
+metadata_cache = MetadataCache(
+    ttl=float(os.getenv("INFO_CACHE_TTL", "300")),
+    max_entries=int(os.getenv("INFO_CACHE_MAX_ENTRIES", "512")),
+    max_bytes=int(os.getenv("INFO_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+)
+
+# Option profiles for pooled extraction instances (see ydl_pool)
+EXTRACTION_PROFILES = {
+    'info': {'quiet': True, 'no_warnings': True},
+    'search': {'quiet': True, 'no_warnings': True, 'extract_flat': True},
+    'playlist_page': {'quiet': True, 'no_warnings': True, 'extract_flat': 'in_playlist', 'lazy_playlist': True},
+    'playlist_items': {'quiet': True, 'no_warnings': True, 'extract_flat': 'in_playlist'},
+}
+ydl_pool = YoutubeDLPool(
+    EXTRACTION_PROFILES,
+    max_idle=int(os.getenv("EXTRACT_MAX_WORKERS", "4")),
+    max_uses=int(os.getenv("YDL_POOL_MAX_USES", "500")),
+)
+
+EXTRACTION_SECONDS = registry.histogram("widmate_extraction_seconds", "yt-dlp metadata extraction time", ("extractor",))
+
+def timed_extract(ydl: yt_dlp.YoutubeDL, url: str, **kwargs) -> Optional[Dict[str, Any]]:
+    """ydl.extract_info, recording its latency under the extractor that handled the URL"""
+    started = time.perf_counter()
+    extractor = 'failed'
+    try:
+        info = ydl.extract_info(url, download=False, **kwargs)
+        extractor = (info or {}).get('extractor_key') or 'unknown'
+        return info
+    finally:
+        EXTRACTION_SECONDS.labels(extractor).observe(time.perf_counter() - started)
+
+def extract_info_blocking(url: str, profile: str) -> Optional[Dict[str, Any]]:
+    """Run yt-dlp metadata extraction; call through extraction_executor"""
+    with ydl_pool.checkout(profile) as ydl:
+        return timed_extract(ydl, url)
+
+PLAYLIST_HEADER_FIELDS = ('id', 'title', 'description', 'thumbnail', 'uploader', 'upload_date', 'view_count', 'playlist_count')
+
+def playlist_entry(entry: Dict[str, Any], index: int) -> Dict[str, Any]:
+    thumbnail = entry.get('thumbnail') or ((entry.get('thumbnails') or [{}])[-1]).get('url')
+    return {
+        'index': index,
+        'id': entry.get('id', ''),
+        'title': entry.get('title', 'Unknown'),
+        'duration': entry.get('duration'),
+        'thumbnail': thumbnail,
+        'url': entry.get('webpage_url', entry.get('url', ''))
+    }
+
+def extract_playlist_page(url: str, offset: int, limit: int,
+                          on_event: Optional[Callable[[str, Dict[str, Any]], None]] = None) -> Optional[Dict[str, Any]]:
+    """Resolve one page of a playlist without walking the rest of it.
+
+    Entries come from yt-dlp's lazy entries (paged or generator), so only
+    the pages covering offset..offset+limit are fetched. ``on_event`` is
+    called with ("playlist", header) and then ("entry", entry) as they are
+    resolved. A URL that turns out to be a single video is fully processed
+    and returned as its normal info dict.
+    """
+    with ydl_pool.checkout('playlist_page') as ydl:
+        info = timed_extract(ydl, url, process=False)
+        # Follow redirects (short links, embeds) without resolving their targets
+        for _ in range(5):
+            if not info or info.get('_type') not in ('url', 'url_transparent'):
+                break
+            info = timed_extract(ydl, info['url'], ie_key=info.get('ie_key'), process=False)
+        if not info:
+            return None
+        if info.get('_type') not in ('playlist', 'multi_video'):
+            return ydl.sanitize_info(ydl.process_ie_result(info, download=False))
+        
+        header = {field: info.get(field) for field in PLAYLIST_HEADER_FIELDS}
+        if not header['thumbnail'] and info.get('thumbnails'):
+            header['thumbnail'] = info['thumbnails'][-1].get('url')
+        if on_event:
+            on_event('playlist', header)
+        
+        entries = info.get('entries')
+        if entries is None:
+            entries = []
+        # Not "or []": truth-testing a PagedList fetches its first page
+        if isinstance(entries, yt_dlp.utils.PagedList):
+            window = entries.getslice(offset, offset + limit + 1)
+        else:
+            window = itertools.islice(entries, offset, offset + limit + 1)
+        page = []
+        has_more = False
+        for i, entry in enumerate(window):
+            if i == limit:
+                # One entry past the page is enough to know there is another page
+                has_more = True
+                break
+            if not entry:
+                continue
+            item = playlist_entry(entry, offset + i + 1)
+            page.append(item)
+            if on_event:
+                on_event('entry', item)
+        return {**header, '_type': 'playlist', 'entries': page, 'playlist_offset': offset, 'has_more': has_more}
+
+def extract_playlist_items(url: str, playlist_items: str) -> List[str]:
+    """URLs of the selected playlist entries (the URL itself if it is a single video)"""
+    with ydl_pool.checkout('playlist_items', playlist_items=playlist_items) as ydl:
+        info = timed_extract(ydl, url)
+    if not info:
+        return []
+    if info.get('_type') not in ('playlist', 'multi_video'):
+        return [info.get('webpage_url') or url]
+    return [entry.get('webpage_url') or entry['url'] for entry in info.get('entries') or []
+            if entry and (entry.get('webpage_url') or entry.get('url'))]
+
+async def run_in_extraction_pool(func: Callable[..., Any], *args) -> Any:
+    """Run a blocking extraction off the event loop, mapping backpressure to HTTP errors"""
+    try:
+        return await extraction_executor.run(func, *args)
+    except ExtractionBusy:
+        raise HTTPException(status_code=503, detail="Server busy, try again later", headers={"Retry-After": "5"})
+    except ExtractionTimeout:
+        raise HTTPException(status_code=504, detail="Timed out retrieving video information")
+
+async def run_extraction(url: str, profile: str = 'info') -> Optional[Dict[str, Any]]:
+    return await run_in_extraction_pool(extract_info_blocking, url, profile)
+
+@app.on_event("startup")
+async def startup_ydl_pool_event():
+    # Extractor loading takes a moment; do it before the first /info instead of during it
+    asyncio.get_running_loop().run_in_executor(None, ydl_pool.warm)
+
+@app.on_event("startup")
+async def startup_store_event():
+    try:
+        task_store.start()
+    except Exception as e:
+        logger.error(f"Failed to start download store: {e}")
 
 @app.on_event("startup")
 async def startup_ws_event():
-    global EVENT_LOOP, event_queue
+    global EVENT_LOOP
     try:
         EVENT_LOOP = asyncio.get_running_loop()
-        event_queue = asyncio.Queue()
-        async def _broadcast_events():
-            while True:
-                event = await event_queue.get()
-                stale = []
-                for ws in ws_clients:
-                    try:
-                        await ws.send_json(event)
-                    except Exception:
-                        stale.append(ws)
-                for ws in stale:
-                    try:
-                        ws_clients.remove(ws)
-                    except ValueError:
-                        pass
-        asyncio.create_task(_broadcast_events())
+        event_hub.bind(EVENT_LOOP)
     except Exception as e:
         logger.error(f"Failed to start WebSocket broadcaster: {e}")
 
 @app.on_event("startup")
 async def startup_workers_event():
-    global download_queue, workers
+    global download_queue, workers, process_pool
     try:
-        download_queue = asyncio.Queue()
+        if DOWNLOAD_EXECUTOR == "process":
+            process_pool = DownloadProcessPool(
+                size=int(os.getenv("DOWNLOAD_PROCESS_POOL_SIZE", str(MAX_WORKERS))),
+                max_jobs_per_worker=int(os.getenv("DOWNLOAD_WORKER_MAX_JOBS", "50")),
+                max_memory_mb=int(os.getenv("DOWNLOAD_WORKER_MAX_RSS_MB", "1024")),
+                start_method=os.getenv("DOWNLOAD_PROCESS_START_METHOD") or None,
+                runtime_path=ytdlp_runtimes.active_path(),
+            )
+            logger.info(f"Downloads run in a process pool of {process_pool.size} workers")
+        download_queue = DownloadScheduler(
+            concurrency=MAX_WORKERS,
+            max_per_host=int(os.getenv("SCHEDULER_MAX_PER_HOST", "0")),
+            bandwidth_limit=int(os.getenv("SCHEDULER_BANDWIDTH_LIMIT", "0")),
+            weights=parse_weights(os.getenv("SCHEDULER_CLIENT_WEIGHTS", "")),
+            max_per_group=PLAYLIST_MAX_PARALLEL,
+        )
         async def _worker():
             while True:
                 job = await download_queue.get()
                 try:
+                    # get() has applied this job's share of SCHEDULER_BANDWIDTH_LIMIT as its ratelimit
                     download_id, url, ydl_opts = job
                     loop = asyncio.get_running_loop()
                     await loop.run_in_executor(None, lambda: download_video_task(download_id, url, ydl_opts))
                 finally:
-                    download_queue.task_done()
+                    download_queue.task_done(job)
+                    if cluster_wakeup is not None:
+                        # A slot is free: see whether the shared queue has work
+                        cluster_wakeup.set()
         for _ in range(MAX_WORKERS):
             workers.append(asyncio.create_task(_worker()))
     except Exception as e:
         logger.error(f"Failed to start workers: {e}")
 
+@app.on_event("startup")
+async def startup_recovery_event():
+    # Before the disk quota sweep, so the .part files of recovered jobs are not taken for orphans
+    try:
+        if cluster_node is None:
+            recover_downloads()
+        else:
+            # Another process may be running them; the shared queue decides who continues what
+            await asyncio.get_running_loop().run_in_executor(None, requeue_orphaned_downloads)
+    except Exception as e:
+        logger.error(f"Failed to recover interrupted downloads: {e}")
+
+@app.on_event("startup")
+async def startup_cluster_event():
+    global cluster_wakeup, cluster_claimer
+    if cluster_node is None:
+        return
+    cluster_wakeup = asyncio.Event()
+    cluster_claimer = asyncio.create_task(cluster_claim_loop())
+
+@app.on_event("startup")
+async def startup_disk_quota_event():
+    try:
+        # Partial files of other nodes sharing the directory would look like orphans from here
+        if cluster_node is None:
+            await asyncio.get_running_loop().run_in_executor(None, disk_quota.sweep_orphans)
+        disk_quota.start()
+    except Exception as e:
+        logger.error(f"Failed to start disk quota manager: {e}")
+
+@app.on_event("startup")
+async def startup_system_stats_event():
+    # Registered last: /health/ready reports ready once everything above has started
+    global STARTUP_COMPLETE
+    try:
+        await asyncio.get_running_loop().run_in_executor(None, system_stats.start)
+    except Exception as e:
+        logger.error(f"Failed to start system stats collector: {e}")
+    STARTUP_COMPLETE = True
+
 # Create directories
 DOWNLOADS_DIR = Path(os.getenv("DOWNLOADS_DIR", "downloads"))
 LOGS_DIR = Path(os.getenv("LOGS_DIR", "logs"))
 DOWNLOADS_DIR.mkdir(exist_ok=True)
 LOGS_DIR.mkdir(exist_ok=True)
 
+# Completed files, addressed by content hash and shared between identical requests
+content_store = ContentStore(DOWNLOADS_DIR, task_store.db_path)
+
+def active_download_ids() -> Set[str]:
+    with download_lock:
+        active = set(download_tasks)
+    if cluster_node is not None:
+        # The unfinished jobs of this node's other processes, when they share its store
+        active.update(task_store.load_active())
+    return active
+
+def mark_evicted(download_id: str):
+    """Record on a finished task that its file was removed to free space"""
+    task = task_store.get(download_id)
+    if task is None or task.status != 'completed':
+        return
+    task.filename = None
+    task.error = "File was removed to free disk space"
+    task.updated_at = time.time()
+    task_store.mark_dirty(task)
+
+# Byte quota and LRU eviction for DOWNLOADS_DIR; watermarks apply to the filesystem when no quota is set
+disk_quota = DiskQuota(
+    DOWNLOADS_DIR,
+    task_store.db_path,
+    content_store,
+    quota_bytes=int(os.getenv("DOWNLOADS_QUOTA_BYTES", "0")),
+    high_watermark=float(os.getenv("DISK_HIGH_WATERMARK", "0.95")),
+    low_watermark=float(os.getenv("DISK_LOW_WATERMARK", "0.85")),
+    min_free_bytes=int(os.getenv("DISK_MIN_FREE_BYTES", str(512 * 1024 * 1024))),
+    max_age=float(os.getenv("DOWNLOADS_MAX_AGE", "0")),
+    interval=float(os.getenv("DISK_QUOTA_INTERVAL", "60")),
+    active_ids=active_download_ids,
+    on_evict=mark_evicted,
+)
+# A download that does not fit yet goes back in the queue this often, this many times
+DISK_DEFER_SECONDS = float(os.getenv("DISK_DEFER_SECONDS", "30"))
+DISK_DEFER_MAX = int(os.getenv("DISK_DEFER_MAX", "10"))
+
+# Host and content-store figures for /system/stats, sampled in the background
+SYSTEM_STATS_INTERVAL = float(os.getenv("SYSTEM_STATS_INTERVAL", "5"))
+system_stats = SystemStatsCollector(
+    DOWNLOADS_DIR,
+    interval=SYSTEM_STATS_INTERVAL,
+    samplers={"content_store": content_store.stats, "disk_quota": disk_quota.stats},
+)
+if cluster_node is not None:
+    # Queue lengths are a backend round trip, so they are sampled too
+    system_stats.samplers["cluster"] = lambda: {**cluster_node.stats(), "jobs": cluster_backend.job_counts()}
+# Readiness: set once every startup hook has run, and again when shutdown begins
+STARTUP_COMPLETE = False
+SHUTTING_DOWN = False
+
+# /file can hand the transfer to the front-end server: "x-accel" (nginx, Caddy) or "x-sendfile"
+FILE_OFFLOAD = os.getenv("FILE_OFFLOAD", "").strip().lower()
+FILE_OFFLOAD_PREFIX = os.getenv("FILE_OFFLOAD_PREFIX", "/protected-downloads")
+
+# /stream: how long to wait for a queued job to start writing, and how often to look for new bytes
+STREAM_START_TIMEOUT = float(os.getenv("STREAM_START_TIMEOUT", "300"))
+STREAM_POLL_INTERVAL = float(os.getenv("STREAM_POLL_INTERVAL", "0.25"))
+if FILE_OFFLOAD not in OFFLOAD_MODES:
+    logger.warning(f"Ignoring unknown FILE_OFFLOAD={FILE_OFFLOAD!r}; serving files from Python")
+    FILE_OFFLOAD = ""
+
 # Pydantic models
 class VideoInfoRequest(BaseModel):
     url: str
     playlist_info: bool = False
+    playlist_offset: int = 0   # entries to skip (playlist_info only)
+    playlist_limit: int = 50   # entries per page, capped at PLAYLIST_PAGE_MAX
 
 class DownloadRequest(BaseModel):
     url: str
@@ -193,6 +550,7 @@ class DownloadRequest(BaseModel):
     playlist_items: Optional[str] = None  # "1-5" or "1,3,5" for specific items
     audio_only: bool = False
     output_path: Optional[str] = None
+    priority: int = 0  # higher runs first among the same client's queued downloads
     
     class Config:
         schema_extra = {
@@ -203,18 +561,31 @@ class DownloadRequest(BaseModel):
             }
         }
 
+class BatchDownloadRequest(BaseModel):
+    downloads: List[DownloadRequest]  # up to BATCH_MAX_DOWNLOADS
+
 class DownloadStatus(BaseModel):
     id: str
-    status: str  # pending, downloading, completed, failed, cancelled
+    status: str  # pending, downloading, paused, completed, failed, cancelled
     progress: float = 0.0
-    speed: Optional[str] = None
-    eta: Optional[str] = None
+    speed: Optional[str] = None  # display form of speed_bps
+    eta: Optional[str] = None  # display form of eta_seconds
+    speed_bps: Optional[float] = None
+    eta_seconds: Optional[float] = None
     downloaded_bytes: int = 0
     total_bytes: Optional[int] = None
     filename: Optional[str] = None
     error: Optional[str] = None
     created_at: datetime
     updated_at: datetime
+    queue_position: Optional[int] = None  # jobs expected to start before this one
+    estimated_start: Optional[datetime] = None
+    parent_id: Optional[str] = None  # the playlist download this item belongs to
+    items: Optional[Dict[str, int]] = None  # playlist downloads: item counts by status, plus total
+
+class DownloadPage(BaseModel):
+    items: List[DownloadStatus]
+    next_cursor: Optional[str] = None  # pass as ?cursor= for the next page; None on the last page
 
 class VideoInfo(BaseModel):
     id: str
@@ -227,13 +598,16 @@ class VideoInfo(BaseModel):
     view_count: Optional[int] = None
     formats: List[Dict[str, Any]] = []
     is_playlist: bool = False
-    playlist_count: Optional[int] = None
+    playlist_count: Optional[int] = None  # total if the site reports it, else entries up to this page
     playlist_entries: List[Dict[str, Any]] = []
+    playlist_offset: int = 0
+    playlist_has_more: bool = False  # request playlist_offset + len(playlist_entries) for the next page
 
 class VersionInfo(BaseModel):
     current_version: str
     latest_version: str
     update_available: bool
+    pending_version: Optional[str] = None  # installed, used after a restart
     update_status: str = "idle"  # idle, downloading, installing, completed, failed
     update_progress: float = 0.0
     update_message: str = ""
@@ -293,123 +667,875 @@ def get_ydl_opts(download_id: str, format_id: Optional[str] = None, quality: str
         'max_filesize': 8 * 1024 * 1024 * 1024,
     }
 
+EVENT_FIELDS = ('status', 'progress', 'speed', 'eta', 'downloaded_bytes', 'total_bytes', 'filename')
+
+def db_timestamp(value: Optional[datetime]) -> Optional[str]:
+    """Format a datetime like the stored created_at/updated_at values (local, naive)"""
+    if value is None:
+        return None
+    if value.tzinfo is not None:
+        value = value.astimezone().replace(tzinfo=None)
+    return str(value)
+
+def task_event(task: TaskRecord) -> Dict[str, Any]:
+    """Snapshot the fields pushed to WebSocket subscribers; call under download_lock"""
+    event = {'id': task.id}
+    for field in EVENT_FIELDS:
+        event[field] = getattr(task, field)
+    return event
+
+def publish_task_event(event: Dict[str, Any]):
+    if cluster_node is not None:
+        # A copy: the hub renders display strings into the one it sends; bursts coalesce per download
+        cluster_node.publish('event', dict(event), key=event['id'])
+    event_hub.publish_threadsafe(event, terminal=event['status'] in TERMINAL_STATUSES)
+
+class DownloadAborted(yt_dlp.utils.DownloadCancelled):
+    """Raised from yt-dlp hooks to stop a job that was cancelled or paused"""
+    
+    def __init__(self, reason: str):
+        super().__init__(f"Download {reason}")
+        self.reason = reason
+
+def check_abort(download_id: str):
+    """Raise DownloadAborted if the job was asked to stop; call under download_lock"""
+    reason = abort_requests.get(download_id)
+    if reason:
+        raise DownloadAborted(reason)
+
+def postprocessor_hook(d: Dict[str, Any], download_id: str):
+    """Stop before the next postprocessor if the job was cancelled"""
+    with download_lock:
+        check_abort(download_id)
+
+def partial_files(download_id: str, ydl_opts: Dict[str, Any]) -> List[Path]:
+    """The .part/fragment files a job has written so far"""
+    outtmpl = ydl_opts.get('outtmpl') or str(DOWNLOADS_DIR / "_")
+    # YoutubeDL normalizes outtmpl into a dict in place
+    if isinstance(outtmpl, dict):
+        outtmpl = outtmpl.get('default', str(DOWNLOADS_DIR / "_"))
+    output_dir = Path(outtmpl).parent
+    return [path for path in output_dir.glob(f"{download_id}_*") if is_partial_file(path.name)]
+
+def remove_partial_files(download_id: str, ydl_opts: Dict[str, Any]):
+    """Delete the .part/fragment files left behind by an aborted job"""
+    for path in partial_files(download_id, ydl_opts):
+        try:
+            path.unlink()
+        except OSError as e:
+            logger.warning(f"Could not remove partial file {path}: {e}")
+
+MIRRORED_FIELDS = ('status', 'progress', 'speed', 'eta', 'downloaded_bytes', 'total_bytes')
+
+def mirror_to_followers(task: TaskRecord) -> List[Dict[str, Any]]:
+    """Copy a primary's progress onto attached duplicate requests; call under download_lock"""
+    events = []
+    for follower_id in download_followers.get(task.id, ()):
+        follower = download_tasks.get(follower_id)
+        if follower is None:
+            continue
+        for field in MIRRORED_FIELDS:
+            setattr(follower, field, getattr(task, field))
+        follower.updated_at = task.updated_at
+        task_store.mark_dirty(follower)
+        events.append(task_event(follower))
+    return events
+
+def final_file_hook(filename: str, download_id: str):
+    """Record the file yt-dlp produced once all postprocessors have run"""
+    with download_lock:
+        task = download_tasks.get(download_id)
+        if task is not None:
+            task.filename = filename
+
+DOWNLOAD_BYTES = registry.counter("widmate_download_bytes", "Bytes received by downloads; rate() gives throughput")
+DOWNLOAD_SECONDS = registry.histogram("widmate_download_seconds", "Time from a worker taking a download to it finishing")
+
 def progress_hook(d: Dict[str, Any], download_id: str):
     """Progress hook for yt-dlp downloads"""
     with download_lock:
+        # A cancelled task has already left download_tasks, so check the abort first
+        check_abort(download_id)
         if download_id not in download_tasks:
             return
             
         task = download_tasks[download_id]
         
         if d['status'] == 'downloading':
-            task['status'] = 'downloading'
-            try:
-                task['progress'] = float(str(d.get('_percent_str', '0%')).strip().strip('%'))
-            except Exception:
-                task['progress'] = 0.0
-            task['speed'] = d.get('_speed_str', 'N/A')
-            task['eta'] = d.get('_eta_str', 'N/A')
-            task['downloaded_bytes'] = d.get('downloaded_bytes', 0)
-            task['total_bytes'] = d.get('total_bytes', 0)
+            task.status = 'downloading'
+            # Where the bytes are going right now, for /stream readers
+            write_targets[download_id] = {
+                'path': d.get('tmpfilename') or d.get('filename'),
+                'merge': d['merge'] if 'merge' in d else merges_formats(d),
+            }
+            downloaded = d.get('downloaded_bytes') or 0
+            total = d.get('total_bytes') or d.get('total_bytes_estimate')
+            if total:
+                shortage = disk_quota.reserve(download_id, int(total), downloaded)
+                if shortage:
+                    job_specs.get(download_id, {})['disk_shortage'] = shortage
+                    raise DownloadAborted('deferred')
+            # A smaller count means yt-dlp moved on to the next file (e.g. audio after video)
+            DOWNLOAD_BYTES.inc(downloaded - task.downloaded_bytes if downloaded >= task.downloaded_bytes else downloaded)
+            meter = speed_meters.get(download_id)
+            if meter is None:
+                meter = speed_meters[download_id] = SpeedMeter()
+            speed = meter.update(downloaded)
+            task.progress, task.eta = progress_numbers(downloaded, total, speed)
+            task.speed = speed
+            task.downloaded_bytes = downloaded
+            task.total_bytes = total
             
         elif d['status'] == 'finished':
-            task['status'] = 'completed'
-            task['progress'] = 100.0
-            task['filename'] = d.get('filename', '')
-            logger.info(f"Download completed: {download_id}")
+            # Postprocessing may still follow; download_video_task marks completion
+            task.progress = 100.0
+            task.filename = d.get('filename', '')
             
         elif d['status'] == 'error':
-            task['status'] = 'failed'
-            task['error'] = str(d.get('error', 'Unknown error'))
-            logger.error(f"Download failed: {download_id} - {task['error']}")
+            task.status = 'failed'
+            task.error = str(d.get('error', 'Unknown error'))
+            logger.error(f"Download failed: {download_id} - {task.error}")
         
-        task['updated_at'] = datetime.now()
-        save_download_tasks(download_tasks)
-    try:
-        if EVENT_LOOP and event_queue:
-            EVENT_LOOP.call_soon_threadsafe(
-                lambda: event_queue.put_nowait({
-                    'id': download_id,
-                    'status': download_tasks.get(download_id, {}).get('status'),
-                    'progress': download_tasks.get(download_id, {}).get('progress'),
-                    'speed': download_tasks.get(download_id, {}).get('speed'),
-                    'eta': download_tasks.get(download_id, {}).get('eta'),
-                    'downloaded_bytes': download_tasks.get(download_id, {}).get('downloaded_bytes'),
-                    'total_bytes': download_tasks.get(download_id, {}).get('total_bytes'),
-                    'filename': download_tasks.get(download_id, {}).get('filename'),
-                })
-            )
-    except Exception:
-        pass
+        task.updated_at = time.time()
+        # Progress ticks are coalesced; status transitions are written through
+        task_store.mark_dirty(task, durable=task.status in TERMINAL_STATUSES)
+        rollup_child(task)
+        events = [task_event(task)] + mirror_to_followers(task)
+    for event in events:
+        publish_task_event(event)
 
 @app.websocket("/ws")
-async def websocket_endpoint(ws: WebSocket):
+async def websocket_endpoint(ws: WebSocket, ids: Optional[str] = None):
+    """Push download events; ?ids=a,b limits the stream to those downloads"""
     await ws.accept()
-    ws_clients.append(ws)
-    try:
-        while True:
-            await ws.receive_text()
-    except WebSocketDisconnect:
-        try:
-            ws_clients.remove(ws)
-        except ValueError:
-            pass
+    subscribe_ids = [i.strip() for i in ids.split(",") if i.strip()] if ids else None
+    await event_hub.serve(ws, subscribe_ids)
+
+def enqueue_download(download_id: str, background_tasks: Optional[BackgroundTasks] = None):
+    """Hand a job from job_specs to the scheduler (or run it directly before startup)"""
+    spec = job_specs[download_id]
+    job = (download_id, spec['url'], spec['ydl_opts'])
+    if download_queue is not None:
+        download_queue.put_nowait(job, client_key=spec['client_key'], priority=spec['priority'],
+                                  group=spec.get('parent_id'))
+    elif background_tasks is not None:
+        background_tasks.add_task(download_video_task, *job)
+
+def enqueue_downloads(download_ids: List[str], background_tasks: Optional[BackgroundTasks] = None):
+    """Hand several jobs to the scheduler together, waking the workers once"""
+    if download_queue is None:
+        for download_id in download_ids:
+            enqueue_download(download_id, background_tasks)
+        return
+    jobs = []
+    for download_id in download_ids:
+        spec = job_specs[download_id]
+        jobs.append(((download_id, spec['url'], spec['ydl_opts']), spec['client_key'], spec['priority'],
+                     spec.get('parent_id')))
+    download_queue.put_many(jobs)
 
 def download_video_task(download_id: str, url: str, ydl_opts: Dict[str, Any]):
     """Background task to download video"""
+    with download_lock:
+        task = download_tasks.get(download_id)
+        # Cancelled or paused while queued, or a duplicate queue entry after resume
+        if task is None or task.status != 'pending' or download_id in running_downloads:
+            return
+        running_downloads.add(download_id)
+    started = time.perf_counter()
+    
     try:
-        # Add progress hook
-        ydl_opts['progress_hooks'] = [lambda d: progress_hook(d, download_id)]
+        # Reuse a fresh /info result so yt-dlp can skip re-extraction
+        cached_info = None
+        if not ydl_opts.get('playlist_items'):
+            cached_info = metadata_cache.peek(metadata_cache.key_for(url))
+            if cached_info is not None and 'entries' in cached_info:
+                cached_info = None
         
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            logger.info(f"Starting download: {download_id} - {url}")
-            ydl.download([url])
+        logger.info(f"Starting download: {download_id} - {url}")
+        if process_pool is not None:
+            process_pool.run(
+                url, ydl_opts, cached_info,
+                on_progress=lambda d: progress_hook(d, download_id),
+                on_postprocess=lambda d: postprocessor_hook(d, download_id),
+                on_file=lambda filename: final_file_hook(filename, download_id),
+            )
+        else:
+            # Add progress hook
+            ydl_opts['progress_hooks'] = [lambda d: progress_hook(d, download_id)]
+            ydl_opts['postprocessor_hooks'] = [lambda d: postprocessor_hook(d, download_id)]
+            ydl_opts['post_hooks'] = [lambda filename: final_file_hook(filename, download_id)]
+            perform_download(url, ydl_opts, cached_info)
+        
+        complete_download(download_id)
             
+    except DownloadAborted as e:
+        # Status was already set by the cancel/pause endpoint; paused jobs keep their .part files
+        if e.reason == 'cancelled':
+            remove_partial_files(download_id, ydl_opts)
+        elif e.reason == 'deferred':
+            defer_download(download_id)
+        logger.info(f"Download {e.reason}: {download_id}")
     except Exception as e:
-        with download_lock:
-            if download_id in download_tasks:
-                download_tasks[download_id]['status'] = 'failed'
-                download_tasks[download_id]['error'] = str(e)
-                download_tasks[download_id]['updated_at'] = datetime.now()
-                save_download_tasks(download_tasks)
+        fail_download(download_id, str(e))
         logger.error(f"Download error: {download_id} - {str(e)}")
+    finally:
+        DOWNLOAD_SECONDS.observe(time.perf_counter() - started)
+        disk_quota.release(download_id)
+        with download_lock:
+            running_downloads.discard(download_id)
+            abort_requests.pop(download_id, None)
+            write_targets.pop(download_id, None)
+            speed_meters.pop(download_id, None)
+            task = download_tasks.get(download_id)
+            if task is None or task.status in TERMINAL_STATUSES:
+                job_specs.pop(download_id, None)
+                download_tasks.pop(download_id, None)
+
+def defer_download(download_id: str):
+    """Queue a job that does not fit on disk yet again later, keeping its .part file"""
+    with download_lock:
+        task = download_tasks.get(download_id)
+        spec = job_specs.get(download_id)
+        if task is None or spec is None or task.status in TERMINAL_STATUSES or task.status == 'paused':
+            return
+        spec['disk_deferrals'] = spec.get('disk_deferrals', 0) + 1
+        shortage = spec.pop('disk_shortage', "Not enough disk space")
+        give_up = spec['disk_deferrals'] > DISK_DEFER_MAX
+        if not give_up:
+            task.status = 'pending'
+            task.speed = None
+            task.eta = None
+            task.updated_at = time.time()
+            task_store.mark_dirty(task, durable=True)
+            rollup_child(task)
+            events = [task_event(task)] + mirror_to_followers(task)
+    if give_up:
+        fail_download(download_id, shortage)
+        return
+    for event in events:
+        publish_task_event(event)
+    logger.warning(f"Download {download_id} deferred for {DISK_DEFER_SECONDS:.0f}s: {shortage}")
+    if EVENT_LOOP is not None:
+        EVENT_LOOP.call_soon_threadsafe(EVENT_LOOP.call_later, DISK_DEFER_SECONDS, requeue_deferred, download_id)
+
+def requeue_deferred(download_id: str):
+    """Put a deferred job back in the queue unless it was paused or cancelled meanwhile"""
+    with download_lock:
+        task = download_tasks.get(download_id)
+        if task is None or task.status != 'pending' or download_id not in job_specs:
+            return
+    enqueue_download(download_id)
+
+def retire_task(task: TaskRecord):
+    """Persist a task's terminal state and drop it from memory; call under download_lock"""
+    task_store.mark_dirty(task, durable=True)
+    download_tasks.pop(task.id, None)
+    event_hub.forget(task.id)
+    rollup_child(task)
+    if cluster_node is not None and task.parent_id is None:
+        cluster_node.release(task.id)
+
+def stored_task(download_id: str) -> Optional[TaskRecord]:
+    """A task's stored row; in a cluster the newer of this node's row and the one its owner shared"""
+    task = task_store.get(download_id)
+    if cluster_backend is None:
+        return task
+    row = cluster_backend.get_state(download_id)
+    shared = row_task(row) if row is not None else None
+    if task is None or (shared is not None and shared.updated_at > task.updated_at):
+        return shared
+    return task
+
+def get_task(download_id: str) -> Optional[TaskRecord]:
+    """Look a task up in memory, falling back to the store for finished ones"""
+    with download_lock:
+        task = download_tasks.get(download_id)
+        if task is not None:
+            return task.copy()
+    return stored_task(download_id)
+
+async def find_task(download_id: str) -> Optional[TaskRecord]:
+    """get_task for async handlers: a stored row is read off the event loop"""
+    with download_lock:
+        task = download_tasks.get(download_id)
+        if task is not None:
+            return task.copy()
+    return await asyncio.get_running_loop().run_in_executor(None, stored_task, download_id)
+
+def require_active_task(download_id: str, finished_detail: str) -> TaskRecord:
+    """Return an in-memory task or raise 400 (finished) / 404 (unknown); call under download_lock"""
+    task = download_tasks.get(download_id)
+    if task is None:
+        if task_store.get(download_id) is not None:
+            raise HTTPException(status_code=400, detail=finished_detail)
+        raise HTTPException(status_code=404, detail="Download not found")
+    if task.status in TERMINAL_STATUSES:
+        raise HTTPException(status_code=400, detail=finished_detail)
+    return task
+
+def release_dedup_key(download_id: str) -> List[str]:
+    """Stop routing new duplicates to this job and return its followers; call under download_lock"""
+    key = job_specs.get(download_id, {}).get('dedup_key')
+    if key and inflight_downloads.get(key) == download_id:
+        del inflight_downloads[key]
+    return download_followers.pop(download_id, [])
+
+def complete_download(download_id: str):
+    """Mark a finished job completed, store its file and complete attached duplicates"""
+    with download_lock:
+        task = download_tasks.get(download_id)
+        if task is None or task.status in TERMINAL_STATUSES or task.status == 'paused':
+            return
+        filename = task.filename
+        key = job_specs.get(download_id, {}).get('dedup_key')
+    
+    # yt-dlp reports most failures through ignoreerrors instead of raising
+    if not filename or not Path(filename).exists():
+        fail_download(download_id, "Download produced no output file")
+        return
+    
+    # The served path may be the blob under .store/; followers are named and placed after the download's own file
+    own_file = Path(filename)
+    name = download_name(download_id, own_file)
+    blob = None
+    if key:
+        try:
+            blob = content_store.ingest(download_id, Path(filename), key)
+            filename = str(blob['path'])
+        except OSError as e:
+            logger.warning(f"Could not add {download_id} to the content store: {e}")
+    
+    events = []
+    recorded = []
+    now = time.time()
+    with download_lock:
+        followers = release_dedup_key(download_id)
+        task = download_tasks.get(download_id)
+        if task is None or task.status in TERMINAL_STATUSES:
+            return
+        size = Path(filename).stat().st_size
+        targets = [task] + [download_tasks[f] for f in followers if f in download_tasks]
+        for target in targets:
+            if target is not task:
+                if blob is None:
+                    target.status = 'failed'
+                    target.error = "Shared download could not be stored"
+                    target.updated_at = now
+                    retire_task(target)
+                    events.append(task_event(target))
+                    continue
+                target_path = own_file.with_name(f"{target.id}_{name}")
+                target.filename = str(content_store.attach(target.id, blob['digest'], target_path))
+                job_specs.pop(target.id, None)
+            else:
+                target.filename = filename
+            recorded.append((target.id, target.filename, target is task))
+            target.status = 'completed'
+            target.progress = 100.0
+            target.downloaded_bytes = size
+            target.total_bytes = size
+            target.updated_at = now
+            retire_task(target)
+            events.append(task_event(target))
+    
+    # Followers link to the primary's file, so only its bytes are new
+    for target_id, target_file, new_bytes in recorded:
+        disk_quota.record(target_id, Path(target_file), new_bytes=new_bytes)
+    for event in events:
+        publish_task_event(event)
+    logger.info(f"Download completed: {download_id}")
+
+def fail_download(download_id: str, error: str):
+    """Mark a job and any attached duplicates failed"""
+    events = []
+    with download_lock:
+        followers = release_dedup_key(download_id)
+        for target_id in [download_id] + followers:
+            task = download_tasks.get(target_id)
+            if task is None or task.status in TERMINAL_STATUSES:
+                continue
+            task.status = 'failed'
+            task.error = error
+            task.updated_at = time.time()
+            retire_task(task)
+            if target_id != download_id:
+                job_specs.pop(target_id, None)
+            events.append(task_event(task))
+    for event in events:
+        publish_task_event(event)
+
+def detach_download(download_id: str) -> Optional[str]:
+    """Take a job out of dedup sharing before it is cancelled or paused.
+
+    A follower simply stops mirroring its primary. A primary hands its
+    followers to the first of them, which is returned so the caller can
+    queue it once the lock is released. Call under download_lock.
+    """
+    for primary_id, followers in download_followers.items():
+        if download_id in followers:
+            followers.remove(download_id)
+            job_specs.get(download_id, {}).pop('dedup_key', None)
+            return None
+    
+    key = job_specs.get(download_id, {}).get('dedup_key')
+    followers = release_dedup_key(download_id)
+    job_specs.get(download_id, {}).pop('dedup_key', None)
+    if not followers:
+        return None
+    
+    new_primary, rest = followers[0], followers[1:]
+    inflight_downloads[key] = new_primary
+    job_specs[new_primary]['dedup_key'] = key
+    if rest:
+        download_followers[new_primary] = rest
+    task = download_tasks[new_primary]
+    task.status = 'pending'
+    task.progress = 0.0
+    task.downloaded_bytes = 0
+    task.updated_at = time.time()
+    task_store.mark_dirty(task)
+    for follower_id in rest:
+        follower = download_tasks.get(follower_id)
+        if follower is not None:
+            follower.status = 'pending'
+            follower.progress = 0.0
+    return new_primary
+
+def playlist_child_spec(job: PlaylistJob, child_id: str, url: str) -> Dict[str, Any]:
+    """Job spec for one playlist item, built from the playlist's original request"""
+    request = job.request
+    ydl_opts = get_ydl_opts(child_id, request.get('format_id'), request.get('quality') or "720p",
+                            request.get('audio_only', False), request.get('output_path'))
+    ydl_opts['noplaylist'] = True
+    return {
+        'url': url,
+        'ydl_opts': ydl_opts,
+        'client_key': job.client_key,
+        'priority': job.priority,
+        'parent_id': job.parent_id,
+    }
+
+def rollup_child(task: TaskRecord):
+    """Fold a playlist item's state into its parent download; call under download_lock"""
+    parent_id = task.parent_id
+    job = playlist_jobs.get(parent_id) if parent_id else None
+    if job is None:
+        return
+    job.update(task.id, task.status, task.downloaded_bytes or 0, task.total_bytes)
+    status = job.status()
+    parent = download_tasks.get(parent_id)
+    if parent is not None:
+        changed = parent.status != status
+        parent.status = status
+        parent.downloaded_bytes = job.downloaded_bytes
+        parent.total_bytes = job.total_bytes_estimate()
+        parent.progress = 100.0 if status == 'completed' else job.progress()
+        parent.updated_at = time.time()
+        if status in TERMINAL_STATUSES:
+            failed = job.counts.get('failed', 0)
+            parent.error = f"{failed} of {len(job.children)} items failed" if failed else None
+            retire_task(parent)
+        else:
+            task_store.mark_dirty(parent, durable=changed)
+        publish_task_event(task_event(parent))
+    # Kept while there are failed items to retry
+    if status in TERMINAL_STATUSES and not job.counts.get('failed'):
+        playlist_jobs.pop(parent_id, None)
+
+def fail_playlist(parent_id: str, error: str):
+    """Fail a playlist download that could not be expanded into items"""
+    with download_lock:
+        playlist_jobs.pop(parent_id, None)
+        parent = download_tasks.get(parent_id)
+        if parent is None or parent.status in TERMINAL_STATUSES:
+            return
+        parent.status = 'failed'
+        parent.error = error
+        parent.updated_at = time.time()
+        retire_task(parent)
+        event = task_event(parent)
+    publish_task_event(event)
+
+async def expand_playlist(parent_id: str):
+    """Resolve a playlist download's items and queue one child job per item"""
+    job = playlist_jobs[parent_id]
+    url = job.request['url']
+    try:
+        urls = await run_in_extraction_pool(extract_playlist_items, url, job.request['playlist_items'])
+    except HTTPException as e:
+        fail_playlist(parent_id, e.detail)
+        return
+    except Exception as e:
+        logger.error(f"Playlist expansion failed: {parent_id} - {e}")
+        fail_playlist(parent_id, str(e))
+        return
+    if not urls:
+        fail_playlist(parent_id, "Playlist has no matching items")
+        return
+    
+    events = []
+    queued = []
+    with download_lock:
+        parent = download_tasks.get(parent_id)
+        if parent is None or parent.status in TERMINAL_STATUSES:
+            # Cancelled while the playlist was being resolved
+            playlist_jobs.pop(parent_id, None)
+            return
+        child_status = 'paused' if parent.status == 'paused' else 'pending'
+        now = time.time()
+        for item_url in urls:
+            child_id = str(uuid.uuid4())
+            child = TaskRecord(child_id, item_url, child_status, created_at=now, parent_id=parent_id)
+            download_tasks[child_id] = child
+            job_specs[child_id] = playlist_child_spec(job, child_id, item_url)
+            job.add_child(child_id, child_status)
+            task_store.mark_dirty(child, new=True)
+            events.append(task_event(child))
+            if child_status == 'pending':
+                queued.append(child_id)
+        job.expanded = True
+        parent.total_bytes = None
+        task_store.mark_dirty(parent, durable=True)
+    
+    for child_id in queued:
+        enqueue_download(child_id)
+    for event in events:
+        publish_task_event(event)
+    logger.info(f"Playlist {parent_id} expanded into {len(urls)} items")
+
+def restart_interrupted(task: TaskRecord, spec: Dict[str, Any]):
+    """Reset a job a restart interrupted to pending, counting the bytes its .part files hold; call under download_lock"""
+    resumable = 0
+    for path in partial_files(task.id, spec['ydl_opts']):
+        if path.name.endswith('.part'):
+            try:
+                resumable += path.stat().st_size
+            except OSError:
+                pass
+    task.status = 'pending'
+    task.speed = None
+    task.eta = None
+    task.downloaded_bytes = resumable
+    task.progress = min(100.0, 100.0 * resumable / task.total_bytes) if task.total_bytes else 0.0
+    task.updated_at = time.time()
+
+def fail_interrupted(task: TaskRecord):
+    """Fail a job a restart interrupted that cannot be started again; call under download_lock"""
+    task.status = 'failed'
+    task.error = "Interrupted by a restart and could not be resumed"
+    task.updated_at = time.time()
+    retire_task(task)
+
+def recover_playlist(parent: TaskRecord, saved: Dict[str, Any], items: List[TaskRecord]) -> List[str]:
+    """Rebuild a playlist's roll-up from its stored items and restart the unfinished ones; call under download_lock"""
+    job = PlaylistJob(parent.id, saved['playlist_request'], saved['client_key'], saved.get('priority', 0))
+    playlist_jobs[parent.id] = job
+    job.expanded = True
+    queued = []
+    for item in items:
+        # Unfinished items are already in memory; finished ones only count towards the roll-up
+        child = download_tasks.get(item.id, item)
+        job.add_child(child.id, child.status)
+        if child.status not in TERMINAL_STATUSES:
+            job_specs[child.id] = playlist_child_spec(job, child.id, child.url)
+            if child.status != 'paused':
+                restart_interrupted(child, job_specs[child.id])
+                queued.append(child.id)
+        job.update(child.id, child.status, child.downloaded_bytes or 0, child.total_bytes)
+    # Re-derives the parent's status, retiring it if every item had already finished
+    rollup_child(download_tasks.get(items[-1].id, items[-1]))
+    return queued
+
+def resume_job(task: TaskRecord, saved: Optional[Dict[str, Any]], items: List[TaskRecord],
+               queued: List[str], playlists: List[str]) -> bool:
+    """Set an interrupted job up again from the options it was saved with; call under download_lock.
+
+    Ids to queue and playlists to expand are appended to ``queued`` and
+    ``playlists``. Returns False when there are no saved options to start
+    the job from.
+    """
+    if saved is None:
+        return False
+    if 'playlist_request' in saved:
+        if items:
+            queued.extend(recover_playlist(task, saved, items))
+        else:
+            # Stopped before its items were resolved
+            playlist_jobs[task.id] = PlaylistJob(task.id, saved['playlist_request'], saved['client_key'],
+                                                 saved.get('priority', 0))
+            playlists.append(task.id)
+        return True
+    
+    spec = {field: saved[field] for field in ('url', 'ydl_opts', 'client_key', 'priority')}
+    job_specs[task.id] = spec
+    if task.status == 'paused':
+        return True
+    restart_interrupted(task, spec)
+    key = saved.get('dedup_key')
+    primary_id = inflight_downloads.get(key) if key else None
+    if primary_id:
+        download_followers.setdefault(primary_id, []).append(task.id)
+        return True
+    if key:
+        inflight_downloads[key] = task.id
+        spec['dedup_key'] = key
+    queued.append(task.id)
+    return True
+
+def recover_downloads():
+    """Queue again the downloads a previous process left unfinished.
+
+    Runs once at startup, after the workers have started. Jobs continue from
+    their .part files with the options they were submitted with; paused jobs
+    stay paused and can be resumed; playlists rebuild their roll-up from the
+    stored items. Jobs saved without options cannot be restarted and fail.
+    """
+    with download_lock:
+        interrupted = sorted(download_tasks.values(), key=lambda t: t.created_at)
+    if not interrupted:
+        return
+    options = task_store.load_options([task.id for task in interrupted])
+    items = {task.id: task_store.children(task.id) for task in interrupted
+             if 'playlist_request' in options.get(task.id, {})}
+    
+    queued: List[str] = []
+    playlists: List[str] = []
+    failed = 0
+    with download_lock:
+        for task in interrupted:
+            if task.parent_id or download_tasks.get(task.id) is not task:
+                continue
+            if not resume_job(task, options.get(task.id), items.get(task.id, []), queued, playlists):
+                fail_interrupted(task)
+                failed += 1
+        
+        # Items whose playlist could not be recovered
+        for task in interrupted:
+            if task.parent_id and task.parent_id not in playlist_jobs and download_tasks.get(task.id) is task:
+                fail_interrupted(task)
+                failed += 1
+        task_store.mark_dirty_many([t for t in interrupted if download_tasks.get(t.id) is t], durable=True)
+    
+    enqueue_downloads(queued)
+    for parent_id in playlists:
+        asyncio.ensure_future(expand_playlist(parent_id))
+    logger.info(f"Recovered {len(queued)} interrupted downloads and {len(playlists)} unexpanded playlists; "
+                f"{failed} could not be resumed")
+
+# Cluster mode: jobs go through the backend's shared queue and run in whichever
+# process claims them; everything above then works per process as before
+ClaimedJob = Tuple[TaskRecord, Optional[Dict[str, Any]], List[TaskRecord], bool]
+cluster_wakeup: Optional[asyncio.Event] = None
+cluster_claimer: Optional[asyncio.Task] = None
+
+def share_jobs(tasks: List[TaskRecord], options: Dict[str, Dict[str, Any]]) -> int:
+    """Put jobs in the shared queue for any process to claim; their rows must already be stored"""
+    jobs = [(task.id, {'task': list(task_row(task)), 'options': options.get(task.id)},
+             (options.get(task.id) or {}).get('priority', 0)) for task in tasks]
+    added = cluster_backend.push_jobs(jobs)
+    # Wake idle processes now instead of at their next poll
+    cluster_node.publish('jobs', {}, key='jobs')
+    wake_claimer()
+    return added
+
+def wake_claimer():
+    if cluster_wakeup is not None and EVENT_LOOP is not None:
+        EVENT_LOOP.call_soon_threadsafe(cluster_wakeup.set)
+
+def requeue_orphaned_downloads():
+    """Share unfinished downloads from this node's store that no process has a job for.
 
-# Global variable to store version check information
+    Runs at startup instead of recover_downloads. Jobs that are still
+    queued or leased keep their entry (push_jobs skips known ids); rows of
+    jobs that finished elsewhere are recognised when claimed.
+    """
+    active = [task for task in task_store.load_active().values() if task.parent_id is None]
+    if not active:
+        return
+    options = task_store.load_options([task.id for task in active])
+    added = share_jobs(active, options)
+    if added:
+        logger.info(f"Shared {added} unfinished downloads found in the store")
+
+def local_capacity() -> int:
+    """Worker slots not taken by running, queued or still expanding jobs"""
+    if download_queue is None:
+        return 0
+    with download_lock:
+        busy = len(running_downloads) + sum(1 for job in playlist_jobs.values() if not job.expanded)
+    return MAX_WORKERS - busy - download_queue.qsize()
+
+def load_claimed_jobs(claimed: List[Tuple[str, Dict[str, Any]]]) -> List[ClaimedJob]:
+    """The newest known row, saved options and stored items of claimed jobs, and whether the row is in this node's store"""
+    loaded = []
+    for job_id, payload in claimed:
+        local = task_store.get(job_id)
+        task = stored_task(job_id) or row_task(payload['task'])
+        saved = payload.get('options')
+        items = task_store.children(job_id) if saved and 'playlist_request' in saved else []
+        loaded.append((task, saved, items, local is not None))
+    return loaded
+
+def adopt_jobs(loaded: List[ClaimedJob]):
+    """Run claimed jobs in this process, set up as recover_downloads sets up interrupted ones"""
+    queued: List[str] = []
+    playlists: List[str] = []
+    adopted: List[TaskRecord] = []
+    new: List[TaskRecord] = []
+    options: Dict[str, Dict[str, Any]] = {}
+    with download_lock:
+        for task, saved, items, in_store in loaded:
+            if task.id in download_tasks:
+                # Already running here, e.g. taken back after its lease was lost
+                cluster_node.hold(task.id)
+                continue
+            cluster_node.hold(task.id)
+            if task.status in TERMINAL_STATUSES:
+                # Finished elsewhere before its job entry was removed
+                cluster_node.release(task.id)
+                continue
+            download_tasks[task.id] = task
+            for item in items:
+                if item.status not in TERMINAL_STATUSES:
+                    download_tasks[item.id] = item
+            if not resume_job(task, saved, items, queued, playlists):
+                fail_interrupted(task)
+                continue
+            if in_store:
+                adopted.append(task)
+                adopted.extend(items)
+            else:
+                new.append(task)
+                options[task.id] = saved
+        task_store.mark_dirty_many([t for t in adopted if download_tasks.get(t.id) is t], durable=True)
+        # Rows claimed from another node's submission are new to this node's store
+        task_store.mark_dirty_many([t for t in new if download_tasks.get(t.id) is t], durable=True, new=True,
+                                   options=options)
+    
+    enqueue_downloads(queued)
+    for parent_id in playlists:
+        asyncio.ensure_future(expand_playlist(parent_id))
+    if queued or playlists:
+        logger.info(f"Claimed {len(loaded)} jobs from the cluster queue")
+
+def drop_lost_jobs(job_ids: List[str]):
+    """Stop running jobs whose lease another process has taken over; their files stay for it"""
+    with download_lock:
+        for job_id in job_ids:
+            job = playlist_jobs.pop(job_id, None)
+            for download_id in [job_id] + (list(job.children) if job is not None else []):
+                if download_id in running_downloads:
+                    abort_requests[download_id] = 'lost'
+                release_dedup_key(download_id)
+                download_tasks.pop(download_id, None)
+                job_specs.pop(download_id, None)
+
+def apply_remote_event(event: Dict[str, Any]):
+    """Pass another process's task event to this process's WebSocket subscribers"""
+    terminal = event.get('status') in TERMINAL_STATUSES
+    if terminal:
+        # A row this node stored when the job was submitted here would otherwise stay unfinished
+        task = task_store.get(event['id'])
+        if task is not None and task.status not in TERMINAL_STATUSES:
+            for field in EVENT_FIELDS:
+                setattr(task, field, event.get(field))
+            task.updated_at = time.time()
+            task_store.mark_dirty(task)
+    # Last: the hub renders display strings into the event it is given
+    event_hub.publish_threadsafe(event, terminal=terminal)
+
+async def cluster_claim_loop():
+    """Claim shared jobs whenever this process has free worker slots"""
+    loop = asyncio.get_running_loop()
+    while not SHUTTING_DOWN:
+        try:
+            await asyncio.wait_for(cluster_wakeup.wait(), timeout=CLUSTER_CLAIM_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        cluster_wakeup.clear()
+        free = local_capacity()
+        if free <= 0 or SHUTTING_DOWN:
+            continue
+        try:
+            claimed = await loop.run_in_executor(None, cluster_backend.claim_jobs, cluster_node.node_id,
+                                                 free, CLUSTER_LEASE)
+            if claimed:
+                adopt_jobs(await loop.run_in_executor(None, load_claimed_jobs, claimed))
+        except Exception as e:
+            logger.error(f"Claiming cluster jobs failed: {e}")
+
+if cluster_node is not None:
+    cluster_node.on('event', apply_remote_event)
+    cluster_node.on('jobs', lambda body: wake_claimer())
+
+# Latest/current yt-dlp versions, cached on disk and revalidated in the background
+version_service = VersionService(
+    index_url=os.getenv("YTDLP_INDEX_URL", DEFAULT_INDEX_URL),
+    cache_path=os.getenv("VERSION_CACHE_FILE", "config/version_cache.json"),
+    ttl=float(os.getenv("VERSION_CHECK_TTL", "1800")),
+    timeout=float(os.getenv("VERSION_CHECK_TIMEOUT", "10")),
+)
+
+# Progress of an update started through /version/update
 version_info = {
-    "current_version": "",
-    "latest_version": "",
-    "update_available": False,
     "update_status": "idle",
     "update_progress": 0.0,
     "update_message": "",
     "error": None,
-    "last_check": 0
 }
 
-def get_current_ytdlp_version() -> str:
-    """Get the currently installed yt-dlp version"""
-    try:
-        return pkg_resources.get_distribution("yt-dlp").version
-    except pkg_resources.DistributionNotFound:
-        # Try using yt-dlp directly
+def version_response() -> VersionInfo:
+    """VersionInfo from the cached versions and the update state"""
+    snapshot = version_service.snapshot()
+    return VersionInfo(
+        current_version=snapshot["current_version"],
+        latest_version=snapshot["latest_version"],
+        update_available=snapshot["update_available"],
+        pending_version=snapshot["pending_version"],
+        update_status=version_info["update_status"],
+        update_progress=version_info["update_progress"],
+        update_message=version_info["update_message"],
+        error=version_info["error"]
+    )
+
+# Upgrades install into versioned directories here instead of the live environment
+ytdlp_runtimes = RuntimeStore(
+    os.getenv("YTDLP_RUNTIMES_DIR", "runtimes"),
+    keep=int(os.getenv("YTDLP_RUNTIMES_KEEP", "3")),
+    smoke_url=os.getenv("YTDLP_SMOKE_URL", ""),
+)
+
+def install_ytdlp(version: str, requirement: Optional[str] = None, announce: bool = True) -> str:
+    """Install and smoke-test a yt-dlp version side by side, then move new downloads onto it"""
+    state = ytdlp_runtimes.install(version, requirement)
+    if cluster_node is not None and announce:
+        # The other processes follow (see follow_runtime)
+        cluster_node.publish('runtime', {'version': state['version']})
+    if process_pool is not None:
+        # Idle workers are replaced now, busy ones once their job finishes
+        process_pool.set_runtime(state["path"])
+        version_service.refresh_current(state["version"])
+        return f"Installed version {state['version']}; new downloads use it"
+    # Thread downloads share this process's yt-dlp, which is only swapped on restart
+    version_service.mark_installed(state["version"])
+    return f"Installed version {state['version']}; it takes effect after a restart"
+
+def follow_runtime(body: Dict[str, Any]):
+    """Switch to the yt-dlp version another process installed; a process on another node installs it first"""
+    version = body.get('version')
+    if not version:
+        return
+    def follow():
         try:
-            result = subprocess.run([sys.executable, "-m", "yt_dlp", "--version"], 
-                                   capture_output=True, text=True, check=True)
-            return result.stdout.strip()
-        except subprocess.SubprocessError:
-            logger.error("Failed to get yt-dlp version")
-            return "unknown"
-
-def get_latest_ytdlp_version() -> str:
-    """Get the latest available yt-dlp version from PyPI"""
-    try:
-        response = requests.get("https://pypi.org/pypi/yt-dlp/json", timeout=10)
-        response.raise_for_status()
-        data = response.json()
-        return data["info"]["version"]
-    except (requests.RequestException, KeyError, json.JSONDecodeError) as e:
-        logger.error(f"Failed to get latest yt-dlp version: {e}")
-        return "unknown"
+            # A no-op install when this node's runtime directory already has it active
+            logger.info(f"Following the cluster to yt-dlp {version}: {install_ytdlp(version, announce=False)}")
+        except Exception as e:
+            logger.error(f"Could not follow the cluster to yt-dlp {version}: {e}")
+    threading.Thread(target=follow, name="follow-runtime", daemon=True).start()
+
+if cluster_node is not None:
+    cluster_node.on('runtime', follow_runtime)
 
 async def update_ytdlp(background_tasks: BackgroundTasks):
     """Update yt-dlp to the latest version"""
@@ -426,40 +1552,25 @@ async def update_ytdlp(background_tasks: BackgroundTasks):
     
     def do_update():
         global version_info
+        latest_version = version_service.snapshot()["latest_version"]
         try:
-            # Update progress for UI
-            version_info["update_progress"] = 0.2
-            version_info["update_message"] = "Preparing to update..."
-            
-            # Use pip to update yt-dlp
+            version_info["update_status"] = "installing"
             version_info["update_progress"] = 0.4
-            version_info["update_message"] = "Installing update..."
+            version_info["update_message"] = f"Installing and testing version {latest_version}..."
             
-            result = subprocess.run(
-                [sys.executable, "-m", "pip", "install", "--upgrade", "yt-dlp"],
-                capture_output=True,
-                text=True
-            )
+            message = install_ytdlp(latest_version)
             
-            if result.returncode != 0:
-                logger.error(f"Failed to update yt-dlp: {result.stderr}")
-                version_info["update_status"] = "failed"
-                version_info["error"] = f"Update failed: {result.stderr}"
-                return
-            
-            # Update progress
-            version_info["update_progress"] = 0.8
-            version_info["update_message"] = "Optimizing performance..."
-            time.sleep(1)  # Give a moment for UI to show progress
-            
-            # Get the new version
-            new_version = get_current_ytdlp_version()
-            version_info["current_version"] = new_version
             version_info["update_progress"] = 1.0
-            version_info["update_message"] = f"Successfully updated to version {new_version}"
+            version_info["update_message"] = message
             version_info["update_status"] = "completed"
-            logger.info(f"Successfully updated yt-dlp to version {new_version}")
+            logger.info(f"yt-dlp upgrade: {message}")
             
+        except RuntimeInstallError as e:
+            # The candidate was discarded; downloads keep running on the active version
+            logger.error(f"yt-dlp {latest_version} rejected, keeping the active version: {e}")
+            version_info["update_status"] = "failed"
+            version_info["update_message"] = "Update rolled back"
+            version_info["error"] = str(e)
         except Exception as e:
             logger.error(f"Error during yt-dlp update: {e}")
             version_info["update_status"] = "failed"
@@ -475,68 +1586,57 @@ async def root():
         "message": "WidMate Video Downloader API",
         "version": "1.0.0",
         "status": "running",
-        "active_downloads": len([t for t in download_tasks.values() if t['status'] == 'downloading'])
+        "active_downloads": download_tasks.counts.get('downloading')
     }
 
+@app.get("/health/live")
+async def health_live():
+    """Liveness probe: the event loop is serving requests"""
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+async def health_ready(response: Response):
+    """Readiness probe: startup finished and the background services are running"""
+    reasons = []
+    if not STARTUP_COMPLETE:
+        reasons.append("starting")
+    if SHUTTING_DOWN:
+        reasons.append("shutting down")
+    if not task_store.is_running():
+        reasons.append("download store flush thread is not running")
+    if STARTUP_COMPLETE and not any(not worker.done() for worker in workers):
+        reasons.append("no download workers running")
+    if system_stats.age() > 3 * system_stats.interval:
+        reasons.append("system stats are stale")
+    if cluster_node is not None and not cluster_node.healthy():
+        reasons.append("cluster backend is unreachable")
+    if reasons:
+        response.status_code = 503
+        return {"status": "not ready", "reasons": reasons}
+    return {"status": "ready"}
+
 @app.get("/version/check", response_model=VersionInfo)
-async def check_version(request: Request, force: bool = False):
+async def check_version(request: Request, response: Response, force: bool = False):
     """Check for yt-dlp updates"""
-    global version_info
-    
     # Rate limiting
     enforce_auth(request)
-    client_key = get_client_key(request)
-    if not check_rate_limit(client_key, 10):
-        raise HTTPException(status_code=429, detail="Rate limit exceeded")
-    
-    # Only check once every 30 minutes unless forced
-    current_time = time.time()
-    if not force and current_time - version_info["last_check"] < 1800:  # 30 minutes
-        return VersionInfo(
-            current_version=version_info["current_version"],
-            latest_version=version_info["latest_version"],
-            update_available=version_info["update_available"],
-            update_status=version_info["update_status"],
-            update_progress=version_info["update_progress"],
-            update_message=version_info["update_message"],
-            error=version_info["error"]
-        )
-    
-    # Get current and latest versions
-    current_version = get_current_ytdlp_version()
-    latest_version = get_latest_ytdlp_version()
+    await enforce_rate_limit(request, response, "version_check")
     
-    # Update global state
-    version_info["current_version"] = current_version
-    version_info["latest_version"] = latest_version
-    version_info["update_available"] = current_version != latest_version and latest_version != "unknown"
-    version_info["last_check"] = current_time
-    
-    logger.info(f"Version check: current={current_version}, latest={latest_version}, update_available={version_info['update_available']}")
-    
-    return VersionInfo(
-        current_version=current_version,
-        latest_version=latest_version,
-        update_available=version_info["update_available"],
-        update_status=version_info["update_status"],
-        update_progress=version_info["update_progress"],
-        update_message=version_info["update_message"],
-        error=version_info["error"]
-    )
+    # Answer from the cache; a stale (or forced) check revalidates in the background
+    version_service.revalidate(max_age=0 if force else None)
+    return version_response()
 
 @app.post("/version/update")
-async def update_version(request: Request, background_tasks: BackgroundTasks):
+async def update_version(request: Request, response: Response, background_tasks: BackgroundTasks):
     """Update yt-dlp to the latest version"""
     global version_info
     
     # Rate limiting
     enforce_auth(request)
-    client_key = get_client_key(request)
-    if not check_rate_limit(client_key, 5):  # Stricter rate limit for updates
-        raise HTTPException(status_code=429, detail="Rate limit exceeded")
+    await enforce_rate_limit(request, response, "version_update")
     
     # Check if update is needed
-    if not version_info["update_available"]:
+    if not version_service.snapshot()["update_available"]:
         return {"message": "Already up to date"}
     
     # Check if already updating
@@ -555,101 +1655,104 @@ async def update_version(request: Request, background_tasks: BackgroundTasks):
 @app.get("/version/status", response_model=VersionInfo)
 async def get_update_status():
     """Get the current status of yt-dlp update"""
-    global version_info
+    return version_response()
+
+def video_info_response(info: Dict[str, Any]) -> VideoInfo:
+    """Build the /info response for a single video"""
+    formats = []
+    if 'formats' in info:
+        for fmt in info['formats']:
+            if fmt.get('vcodec') != 'none':  # Video formats
+                formats.append({
+                    'format_id': fmt.get('format_id', ''),
+                    'ext': fmt.get('ext', ''),
+                    'resolution': f"{fmt.get('width', 0)}x{fmt.get('height', 0)}",
+                    'fps': fmt.get('fps'),
+                    'filesize': fmt.get('filesize'),
+                    'quality': fmt.get('format_note', ''),
+                    'vcodec': fmt.get('vcodec', ''),
+                    'acodec': fmt.get('acodec', ''),
+                })
     
-    return VersionInfo(
-        current_version=version_info["current_version"],
-        latest_version=version_info["latest_version"],
-        update_available=version_info["update_available"],
-        update_status=version_info["update_status"],
-        update_progress=version_info["update_progress"],
-        update_message=version_info["update_message"],
-        error=version_info["error"]
+    return VideoInfo(
+        id=info.get('id', ''),
+        title=info.get('title', 'Unknown'),
+        description=info.get('description', ''),
+        duration=info.get('duration'),
+        thumbnail=info.get('thumbnail'),
+        uploader=info.get('uploader', ''),
+        upload_date=info.get('upload_date', ''),
+        view_count=info.get('view_count'),
+        formats=formats,
+        is_playlist=False,
+        playlist_count=None,
+        playlist_entries=[]
     )
 
+def playlist_info_response(info: Dict[str, Any]) -> VideoInfo:
+    """Build the /info response for one page of a playlist"""
+    entries = info['entries']
+    offset = info.get('playlist_offset', 0)
+    return VideoInfo(
+        id=info.get('id') or '',
+        title=info.get('title') or 'Unknown Playlist',
+        description=info.get('description') or '',
+        duration=None,
+        thumbnail=info.get('thumbnail'),
+        uploader=info.get('uploader') or '',
+        upload_date=info.get('upload_date') or '',
+        view_count=info.get('view_count'),
+        formats=[],
+        is_playlist=True,
+        playlist_count=info.get('playlist_count') or offset + len(entries),
+        playlist_entries=entries,
+        playlist_offset=offset,
+        playlist_has_more=info.get('has_more', False)
+    )
+
+def playlist_page_bounds(video_request: VideoInfoRequest):
+    return max(0, video_request.playlist_offset), max(1, min(video_request.playlist_limit, PLAYLIST_PAGE_MAX))
+
 @app.post("/info")
-async def get_video_info(request: Request, video_request: VideoInfoRequest) -> VideoInfo:
+async def get_video_info(request: Request, response: Response, video_request: VideoInfoRequest) -> VideoInfo:
     # Rate limiting
     enforce_auth(request)
-    client_key = get_client_key(request)
-    if not check_rate_limit(client_key, 30):
-        raise HTTPException(status_code=429, detail="Rate limit exceeded")
+    await enforce_rate_limit(request, response, "info")
     """Get video metadata and available formats"""
     try:
         logger.info(f"Getting info for: {video_request.url}")
         
-        ydl_opts = {
-            'quiet': True,
-            'no_warnings': True,
-            'extractflat': video_request.playlist_info,
-        }
-        
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(video_request.url, download=False)
-            
-            if not info:
-                raise HTTPException(status_code=404, detail="Video not found or URL invalid")
-            
-            # Handle playlist
-            if 'entries' in info:
-                playlist_entries = []
-                for i, entry in enumerate(info['entries'][:50]):  # Limit to first 50 entries
-                    if entry:
-                        playlist_entries.append({
-                            'index': i + 1,
-                            'id': entry.get('id', ''),
-                            'title': entry.get('title', 'Unknown'),
-                            'duration': entry.get('duration'),
-                            'thumbnail': entry.get('thumbnail'),
-                            'url': entry.get('webpage_url', entry.get('url', ''))
-                        })
-                
-                return VideoInfo(
-                    id=info.get('id', ''),
-                    title=info.get('title', 'Unknown Playlist'),
-                    description=info.get('description', ''),
-                    duration=None,
-                    thumbnail=info.get('thumbnail'),
-                    uploader=info.get('uploader', ''),
-                    upload_date=info.get('upload_date', ''),
-                    view_count=info.get('view_count'),
-                    formats=[],
-                    is_playlist=True,
-                    playlist_count=len(playlist_entries),
-                    playlist_entries=playlist_entries
-                )
-            
-            # Handle single video
-            formats = []
-            if 'formats' in info:
-                for fmt in info['formats']:
-                    if fmt.get('vcodec') != 'none':  # Video formats
-                        formats.append({
-                            'format_id': fmt.get('format_id', ''),
-                            'ext': fmt.get('ext', ''),
-                            'resolution': f"{fmt.get('width', 0)}x{fmt.get('height', 0)}",
-                            'fps': fmt.get('fps'),
-                            'filesize': fmt.get('filesize'),
-                            'quality': fmt.get('format_note', ''),
-                            'vcodec': fmt.get('vcodec', ''),
-                            'acodec': fmt.get('acodec', ''),
-                        })
-            
-            return VideoInfo(
-                id=info.get('id', ''),
-                title=info.get('title', 'Unknown'),
-                description=info.get('description', ''),
-                duration=info.get('duration'),
-                thumbnail=info.get('thumbnail'),
-                uploader=info.get('uploader', ''),
-                upload_date=info.get('upload_date', ''),
-                view_count=info.get('view_count'),
-                formats=formats,
-                is_playlist=False,
-                playlist_count=None,
-                playlist_entries=[]
+        if video_request.playlist_info:
+            # Only the requested page of the playlist is resolved
+            offset, limit = playlist_page_bounds(video_request)
+            cache_key = metadata_cache.key_for(video_request.url, True) + (offset, limit)
+            info = await metadata_cache.get_or_load(
+                cache_key, lambda: run_in_extraction_pool(extract_playlist_page, video_request.url, offset, limit)
             )
-            
+        else:
+            cache_key = metadata_cache.key_for(video_request.url)
+            info = await metadata_cache.get_or_load(cache_key, lambda: run_extraction(video_request.url))
+        
+        if not info:
+            raise HTTPException(status_code=404, detail="Video not found or URL invalid")
+        
+        if info.get('_type') == 'playlist' and 'has_more' in info:
+            return playlist_info_response(info)
+        
+        # Handle playlist (without playlist_info the whole playlist is extracted; report the first page)
+        if 'entries' in info:
+            entries = [playlist_entry(entry, i + 1) for i, entry in enumerate(info['entries'][:PLAYLIST_PAGE_DEFAULT]) if entry]
+            return playlist_info_response({
+                **{field: info.get(field) for field in PLAYLIST_HEADER_FIELDS},
+                'playlist_count': len(info['entries']),
+                'entries': entries,
+                'has_more': len(info['entries']) > PLAYLIST_PAGE_DEFAULT,
+            })
+        
+        return video_info_response(info)
+        
+    except HTTPException:
+        raise
     except yt_dlp.DownloadError as e:
         logger.error(f"yt-dlp error: {str(e)}")
         raise HTTPException(status_code=400, detail="Could not retrieve video information")
@@ -657,34 +1760,147 @@ async def get_video_info(request: Request, video_request: VideoInfoRequest) -> V
         logger.error(f"Unexpected error: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
-@app.post("/download")
-async def start_download(request: Request, download_request: DownloadRequest, background_tasks: BackgroundTasks) -> Dict[str, str]:
-    # Rate limiting
+def ndjson(obj: Dict[str, Any]) -> bytes:
+    return (json.dumps(obj, default=str) + "\n").encode("utf-8")
+
+@app.post("/info/stream")
+async def stream_video_info(request: Request, response: Response, video_request: VideoInfoRequest):
+    """Like /info with playlist_info, but emits NDJSON lines as playlist entries resolve.
+
+    Lines are {"type": "playlist", ...header}, then {"type": "entry", ...}
+    per entry, then {"type": "end", "has_more": ..., "next_offset": ...}.
+    A single video yields one {"type": "video", ...} line; a failure after
+    the first line yields {"type": "error", "detail": ...}.
+    """
     enforce_auth(request)
-    client_key = get_client_key(request)
-    if not check_rate_limit(client_key, 10):
-        raise HTTPException(status_code=429, detail="Rate limit exceeded")
-    """Start video download"""
-    try:
+    await enforce_rate_limit(request, response, "info")
+    offset, limit = playlist_page_bounds(video_request)
+    
+    loop = asyncio.get_running_loop()
+    events: asyncio.Queue = asyncio.Queue()
+    def on_event(kind: str, payload: Dict[str, Any]):
+        loop.call_soon_threadsafe(events.put_nowait, {'type': kind, **payload})
+    job = asyncio.ensure_future(run_in_extraction_pool(extract_playlist_page, video_request.url, offset, limit, on_event))
+    
+    async def next_event() -> Optional[Dict[str, Any]]:
+        """The next queued line, or None once extraction has finished and the queue is drained"""
+        if events.empty() and not job.done():
+            getter = asyncio.ensure_future(events.get())
+            await asyncio.wait({getter, job}, return_when=asyncio.FIRST_COMPLETED)
+            if getter.done():
+                return getter.result()
+            getter.cancel()
+        return None if events.empty() else events.get_nowait()
+    
+    def result_lines() -> List[bytes]:
+        try:
+            info = job.result()
+        except HTTPException as e:
+            return [ndjson({'type': 'error', 'status': e.status_code, 'detail': e.detail})]
+        except Exception as e:
+            logger.error(f"Streaming info error for {video_request.url}: {e}")
+            return [ndjson({'type': 'error', 'status': 400, 'detail': "Could not retrieve video information"})]
+        if not info:
+            return [ndjson({'type': 'error', 'status': 404, 'detail': "Video not found or URL invalid"})]
+        if info.get('_type') != 'playlist':
+            return [ndjson({'type': 'video', **video_info_response(info).dict()})]
+        return [ndjson({'type': 'end', 'has_more': info['has_more'], 'next_offset': offset + limit if info['has_more'] else None})]
+    
+    # Errors before anything was resolved still get a proper status code
+    first = await next_event()
+    if first is None:
+        try:
+            if not job.result():
+                raise HTTPException(status_code=404, detail="Video not found or URL invalid")
+        except yt_dlp.DownloadError as e:
+            logger.error(f"yt-dlp error: {str(e)}")
+            raise HTTPException(status_code=400, detail="Could not retrieve video information")
+    
+    async def lines():
+        event = first
+        while event is not None:
+            yield ndjson(event)
+            event = await next_event()
+        for line in result_lines():
+            yield line
+    
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+PLAYLIST_ITEMS_PATTERN = re.compile(r"^[\d\s,:-]+$")
+
+def validate_download_request(download_request: DownloadRequest) -> Optional[str]:
+    """Reason a download request cannot be accepted, or None"""
+    if not download_request.url.strip() or any(c.isspace() for c in download_request.url.strip()):
+        return "url must be a single URL"
+    if download_request.playlist_items is not None and not PLAYLIST_ITEMS_PATTERN.match(download_request.playlist_items):
+        return "playlist_items must look like \"1-5\" or \"1,3,5\""
+    return None
+
+def estimated_download_size(download_request: DownloadRequest) -> int:
+    """Expected bytes for a request from a cached /info result; 0 when unknown"""
+    if download_request.playlist_items:
+        return 0
+    info = metadata_cache.peek(metadata_cache.key_for(download_request.url))
+    if not info or 'entries' in info:
+        return 0
+    if download_request.format_id:
+        wanted = download_request.format_id.split('+')
+        chosen = [f for f in info.get('formats') or [] if f.get('format_id') in wanted]
+    else:
+        chosen = info.get('requested_formats') or [info]
+    return int(sum(f.get('filesize') or f.get('filesize_approx') or 0 for f in chosen))
+
+def enforce_disk_space(download_requests: List[DownloadRequest]):
+    """Refuse new downloads with 507 when they would not fit on disk"""
+    reason = disk_quota.admit(sum(estimated_download_size(r) for r in download_requests))
+    if reason:
+        logger.warning(f"Download refused: {reason}")
+        raise HTTPException(status_code=507, detail=reason)
+
+def serve_stored_copies(requests: List[Tuple[str, str]]) -> Dict[str, Tuple[Path, Dict[str, Any]]]:
+    """Reference stored files for (download_id, dedup key) pairs that were already downloaded.
+
+    Returns download_id -> (path to serve, blob) for the hits. Blocking;
+    run it in an executor.
+    """
+    blobs: Dict[str, Optional[Dict[str, Any]]] = {}
+    served: Dict[str, Tuple[Path, Dict[str, Any]]] = {}
+    for download_id, key in requests:
+        if key not in blobs:
+            blobs[key] = content_store.lookup(key)
+        blob = blobs[key]
+        if blob is None:
+            continue
+        try:
+            path = content_store.attach(download_id, blob['digest'], DOWNLOADS_DIR / f"{download_id}_{blob['name']}")
+        except FileNotFoundError:
+            blobs[key] = None
+            continue
+        disk_quota.record(download_id, path, new_bytes=False)
+        served[download_id] = (path, blob)
+    return served
+
+async def submit_downloads(download_requests: List[DownloadRequest], client_key: str,
+                           background_tasks: Optional[BackgroundTasks] = None, durable: bool = False) -> List[Dict[str, str]]:
+    """Create, deduplicate and queue downloads, returning one result per request in order.
+
+    Requests for media that is already stored complete at once, and ones for
+    media already being fetched (including earlier requests in the same
+    call) follow that job. Every task row goes to the store in one write
+    and every new job reaches the scheduler together; in a cluster the jobs
+    go to the shared queue instead, rows committed first.
+    """
+    now = time.time()
+    tasks: List[TaskRecord] = []
+    messages: Dict[str, str] = {}
+    requested = []
+    for download_request in download_requests:
         download_id = str(uuid.uuid4())
-        
-        # Create download task entry
-        with download_lock:
-            download_tasks[download_id] = {
-                'id': download_id,
-                'url': download_request.url,
-                'status': 'pending',
-                'progress': 0.0,
-                'speed': None,
-                'eta': None,
-                'downloaded_bytes': 0,
-                'total_bytes': None,
-                'filename': None,
-                'error': None,
-                'created_at': datetime.now(),
-                'updated_at': datetime.now()
-            }
-            save_download_tasks(download_tasks)
+        task = TaskRecord(download_id, download_request.url, created_at=now)
+        tasks.append(task)
+        if download_request.playlist_items:
+            requested.append((task, None, None, download_request))
+            continue
         
         # Get yt-dlp options
         ydl_opts = get_ydl_opts(
@@ -695,140 +1911,695 @@ async def start_download(request: Request, download_request: DownloadRequest, ba
             download_request.output_path
         )
         
-        # Add playlist items filter if specified
-        if download_request.playlist_items:
-            ydl_opts['playlist_items'] = download_request.playlist_items
-        
-        if download_queue is not None:
-            await download_queue.put((download_id, download_request.url, ydl_opts))
-        else:
-            background_tasks.add_task(
-                download_video_task,
-                download_id,
-                download_request.url,
-                ydl_opts
-            )
-        
-        logger.info(f"Download queued: {download_id}")
+        # Single files in the default location can be shared between identical requests
+        key = None
+        if not download_request.output_path:
+            key = dedup_key(canonicalize_url(download_request.url), ydl_opts['format'])
+        requested.append((task, ydl_opts, key, download_request))
+    
+    # One executor call for the whole batch: each hit is a store lookup, a hardlink and a stat
+    stored = await asyncio.get_running_loop().run_in_executor(
+        None, serve_stored_copies, [(task.id, key) for task, _, key, _ in requested if key])
+    pending = []
+    for task, ydl_opts, key, download_request in requested:
+        if ydl_opts is None:
+            pending.append((task, None, None, download_request))
+            continue
+        if task.id in stored:
+            # Already downloaded: reference the stored file instead of fetching again
+            served, blob = stored[task.id]
+            task.status = 'completed'
+            task.progress = 100.0
+            task.filename = str(served)
+            task.downloaded_bytes = task.total_bytes = blob['size']
+            messages[task.id] = "Download served from an existing file"
+            logger.info(f"Download {task.id} served from stored file {blob['digest']}")
+            continue
         
-        return {
-            "download_id": download_id,
-            "status": "pending",
-            "message": "Download started"
+        spec = {
+            'url': download_request.url,
+            'ydl_opts': ydl_opts,
+            'client_key': client_key,
+            'priority': download_request.priority,
         }
+        pending.append((task, spec, key, download_request))
+    
+    # Saved with the rows so unfinished jobs can be queued again after a restart
+    options: Dict[str, Dict[str, Any]] = {}
+    for task, spec, key, download_request in pending:
+        if spec is None:
+            options[task.id] = {'playlist_request': download_request.dict(), 'client_key': client_key,
+                                'priority': download_request.priority}
+        else:
+            options[task.id] = {**spec, 'dedup_key': key}
+    # Finished, playlist and shared rows are written through, like other status transitions
+    durable = (durable or cluster_node is not None or len(pending) < len(tasks)
+               or any(spec is None for _, spec, _, _ in pending))
+    # Stored before any worker can see the jobs, and off the event loop: a batch commits
+    # hundreds of rows. Later updates to these tasks replace the rows as usual.
+    await asyncio.get_running_loop().run_in_executor(
+        None, functools.partial(task_store.mark_dirty_many, tasks, durable=durable, new=True, options=options))
+    
+    queued: List[str] = []
+    playlists: List[str] = []
+    shared: List[TaskRecord] = []
+    with download_lock:
+        for task, spec, key, download_request in pending:
+            download_id = task.id
+            if cluster_node is not None:
+                # Runs in whichever process claims it from the shared queue
+                shared.append(task)
+                messages[download_id] = "Playlist download started" if spec is None else "Download started"
+                continue
+            download_tasks[download_id] = task
+            if spec is None:
+                # The selected items run as child jobs of this one, in parallel
+                playlist_jobs[download_id] = PlaylistJob(download_id, download_request.dict(), client_key,
+                                                         download_request.priority)
+                playlists.append(download_id)
+                messages[download_id] = "Playlist download started"
+                continue
+            job_specs[download_id] = spec
+            primary_id = inflight_downloads.get(key) if key else None
+            primary = download_tasks.get(primary_id) if primary_id else None
+            if primary is not None:
+                # Same media is already being fetched: follow that job instead of starting another
+                for field in MIRRORED_FIELDS:
+                    setattr(task, field, getattr(primary, field))
+                download_followers.setdefault(primary_id, []).append(download_id)
+                task_store.mark_dirty(task)
+                messages[download_id] = "Download attached to an identical download in progress"
+                logger.info(f"Download {download_id} attached to in-flight download {primary_id}")
+                continue
+            if key:
+                inflight_downloads[key] = download_id
+                spec['dedup_key'] = key
+            queued.append(download_id)
+            messages[download_id] = "Download started"
+        results = [
+            {"download_id": task.id, "status": task.status.value, "message": messages[task.id]}
+            for task in tasks
+        ]
+    
+    if shared:
+        # A backend round trip, kept off the event loop
+        await asyncio.get_running_loop().run_in_executor(None, share_jobs, shared, options)
+    enqueue_downloads(queued, background_tasks)
+    for download_id in playlists:
+        asyncio.ensure_future(expand_playlist(download_id))
+    return results
+
+@app.post("/download")
+async def start_download(request: Request, response: Response, download_request: DownloadRequest, background_tasks: BackgroundTasks) -> Dict[str, str]:
+    """Start video download"""
+    # Rate limiting
+    enforce_auth(request)
+    await enforce_rate_limit(request, response, "download")
+    client_key = get_client_key(request)
+    error = validate_download_request(download_request)
+    if error:
+        raise HTTPException(status_code=422, detail=error)
+    enforce_disk_space([download_request])
+    try:
+        result = (await submit_downloads([download_request], client_key, background_tasks))[0]
+        logger.info(f"Download queued: {result['download_id']}")
+        return result
         
     except Exception as e:
         logger.error(f"Error starting download: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to start download")
 
-@app.get("/status/{download_id}")
-async def get_download_status(download_id: str) -> DownloadStatus:
+@app.post("/downloads/batch")
+async def start_download_batch(request: Request, response: Response, batch: BatchDownloadRequest,
+                               background_tasks: BackgroundTasks) -> Dict[str, Any]:
+    """Start many downloads in one request; either all are accepted or none"""
+    enforce_auth(request)
+    await enforce_rate_limit(request, response, "download_batch")
+    client_key = get_client_key(request)
+    if not batch.downloads:
+        raise HTTPException(status_code=422, detail="downloads must not be empty")
+    if len(batch.downloads) > BATCH_MAX_DOWNLOADS:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_DOWNLOADS} downloads per batch")
+    errors = []
+    for index, download_request in enumerate(batch.downloads):
+        error = validate_download_request(download_request)
+        if error:
+            errors.append({"index": index, "error": error})
+    if errors:
+        raise HTTPException(status_code=422, detail=errors)
+    enforce_disk_space(batch.downloads)
+    try:
+        # The client gets ids back, so the rows are committed before answering
+        results = await submit_downloads(batch.downloads, client_key, background_tasks, durable=True)
+    except Exception as e:
+        logger.error(f"Error starting download batch: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to start downloads")
+    logger.info(f"Download batch queued: {len(results)} downloads")
+    return {"downloads": results, "count": len(results)}
+
+@app.get("/status/{download_id}", response_model=DownloadStatus)
+async def get_download_status(download_id: str):
     """Get download progress and status"""
+    task = await find_task(download_id)
+    if task is None:
+        raise HTTPException(status_code=404, detail="Download not found")
+    status = task.to_json()
     with download_lock:
-        if download_id not in download_tasks:
-            raise HTTPException(status_code=404, detail="Download not found")
-        
-        task = download_tasks[download_id]
-        return DownloadStatus(**task)
+        job = playlist_jobs.get(download_id)
+        if job is not None:
+            status['items'] = job.summary()
+    
+    if task.status == 'pending' and download_queue is not None:
+        queued = download_queue.position(download_id)
+        if queued is not None:
+            status['queue_position'], wait = queued
+            if wait is not None:
+                status['estimated_start'] = (datetime.now() + timedelta(seconds=wait)).isoformat()
+    return JSONResponse(status)
 
-@app.get("/file/{download_id}")
-async def get_downloaded_file(download_id: str):
-    """Download the completed file"""
-    with download_lock:
-        if download_id not in download_tasks:
-            raise HTTPException(status_code=404, detail="Download not found")
-        
-        task = download_tasks[download_id]
-        
-        if task['status'] != 'completed':
-            raise HTTPException(status_code=400, detail="Download not completed")
-        
-        filename = task.get('filename')
-        if not filename:
-            raise HTTPException(status_code=404, detail="File not found")
+@app.api_route("/file/{download_id}", methods=["GET", "HEAD"])
+async def get_downloaded_file(download_id: str, request: Request):
+    """Download the completed file (supports Range, If-Range and conditional GET)"""
+    task = await find_task(download_id)
+    if task is None:
+        raise HTTPException(status_code=404, detail="Download not found")
+    
+    if task.status != 'completed':
+        raise HTTPException(status_code=400, detail="Download not completed")
+    
+    filename = task.filename
+    if not filename:
+        # Evicted under disk pressure: the task says so in its error
+        raise HTTPException(status_code=410 if task.error else 404, detail=task.error or "File not found")
 
-        safe_dir = Path(DOWNLOADS_DIR).resolve()
-        file_path = Path(filename).resolve()
-        try:
-            common_path = os.path.commonpath([str(safe_dir), str(file_path)])
-        except Exception:
-            logger.warning(f"Invalid path encountered for download_id: {download_id}, path: {filename}")
-            raise HTTPException(status_code=404, detail="File not found")
-        if common_path != str(safe_dir):
-            logger.warning(f"Path traversal attempt blocked for download_id: {download_id}, path: {filename}")
-            raise HTTPException(status_code=404, detail="File not found")
-
-        if not file_path.exists():
-            raise HTTPException(status_code=404, detail="File not found")
-        
-        return FileResponse(
-            path=str(file_path),
+    safe_dir = Path(DOWNLOADS_DIR).resolve()
+    file_path = Path(filename).resolve()
+    try:
+        common_path = os.path.commonpath([str(safe_dir), str(file_path)])
+    except Exception:
+        logger.warning(f"Invalid path encountered for download_id: {download_id}, path: {filename}")
+        raise HTTPException(status_code=404, detail="File not found")
+    if common_path != str(safe_dir):
+        logger.warning(f"Path traversal attempt blocked for download_id: {download_id}, path: {filename}")
+        raise HTTPException(status_code=404, detail="File not found")
+
+    try:
+        file_response = DownloadFileResponse(
+            request,
+            file_path,
             filename=file_path.name,
-            media_type='application/octet-stream'
+            digest=content_store.digest_for(download_id),
+            offload=FILE_OFFLOAD,
+            offload_prefix=FILE_OFFLOAD_PREFIX,
+            offload_root=safe_dir,
         )
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="File not found")
+    if request.method == "GET":
+        disk_quota.touch(download_id)
+    return file_response
+
+async def stream_source(download_id: str) -> Optional[Dict[str, Any]]:
+    """Current write target and state of a download, following a deduplicated job's primary"""
+    with download_lock:
+        task = download_tasks.get(download_id)
+        if task is not None and task.status not in TERMINAL_STATUSES:
+            source_id = next((p for p, f in download_followers.items() if download_id in f), download_id)
+            target = write_targets.get(source_id) or {}
+            return {'status': task.status, 'path': target.get('path'), 'merge': target.get('merge', False)}
+    task = await find_task(download_id)
+    if task is None:
+        return None
+    return {'status': task.status, 'path': task.filename, 'merge': False}
+
+@app.get("/stream/{download_id}")
+async def stream_download(download_id: str):
+    """Stream a download while it is still being fetched.
+
+    Bytes are sent as yt-dlp writes them, ending when the job completes.
+    Jobs that merge separate video and audio streams start sending once the
+    merged file exists. If postprocessing replaces a file that was already
+    partly sent, the response is cut short and the client should fall back
+    to /file with a Range request.
+    """
+    task = await find_task(download_id)
+    if task is None:
+        raise HTTPException(status_code=404, detail="Download not found")
+    if task.status in ('failed', 'cancelled'):
+        raise HTTPException(status_code=400, detail=f"Download {task.status}")
+    with download_lock:
+        if download_id in playlist_jobs:
+            raise HTTPException(status_code=400, detail="Playlist downloads cannot be streamed")
+    
+    # Wait until there is a file to name the response after
+    deadline = time.monotonic() + STREAM_START_TIMEOUT
+    while True:
+        source = await stream_source(download_id)
+        if source is None or source['status'] in ('failed', 'cancelled'):
+            raise HTTPException(status_code=400, detail="Download did not complete")
+        if source['path'] and (source['status'] == 'completed' or not source['merge']):
+            break
+        if time.monotonic() > deadline:
+            raise HTTPException(status_code=503, detail="Download has not started yet", headers={"Retry-After": "10"})
+        await asyncio.sleep(STREAM_POLL_INTERVAL)
+    
+    name = Path(source['path']).name
+    if name.endswith('.part'):
+        name = name[:-len('.part')]
+    
+    async def body():
+        try:
+            async for chunk in tail_growing_file(lambda: stream_source(download_id), STREAM_POLL_INTERVAL):
+                yield chunk
+        except StreamAborted as e:
+            # Ending without the final chunk tells the client the body is incomplete
+            logger.warning(f"Stream of {download_id} aborted: {e}")
+            raise
+    
+    return StreamingResponse(
+        body(),
+        media_type='application/octet-stream',
+        headers={'Content-Disposition': content_disposition(name), 'Cache-Control': 'no-store'},
+    )
+
+def cancel_task(task: TaskRecord) -> Dict[str, Any]:
+    """Cancel a queued, running or paused task; call under download_lock.
+
+    Returns the follow-up work for after the lock is released (see
+    finish_task_change).
+    """
+    download_id = task.id
+    # A running job stops at its next progress tick and frees its worker slot
+    if download_id in running_downloads:
+        abort_requests[download_id] = 'cancelled'
+    elif download_queue is not None:
+        download_queue.remove(download_id)
+    new_primary = detach_download(download_id)
+    spec = job_specs.pop(download_id, None)
+    was_paused = task.status == 'paused'
+    
+    task.status = 'cancelled'
+    task.updated_at = time.time()
+    retire_task(task)
+    return {
+        'event': task_event(task),
+        'new_primary': new_primary,
+        'partial_opts': spec['ydl_opts'] if was_paused and spec else None,
+    }
+
+def pause_task(task: TaskRecord) -> Dict[str, Any]:
+    """Pause a queued or running task, keeping its partial file; call under download_lock"""
+    download_id = task.id
+    if download_id in running_downloads:
+        abort_requests[download_id] = 'paused'
+    elif download_queue is not None:
+        download_queue.remove(download_id)
+    new_primary = detach_download(download_id)
+    task.status = 'paused'
+    task.speed = None
+    task.eta = None
+    task.updated_at = time.time()
+    task_store.mark_dirty(task, durable=True)
+    rollup_child(task)
+    return {'event': task_event(task), 'new_primary': new_primary}
+
+def resume_task(task: TaskRecord) -> Dict[str, Any]:
+    """Mark a paused task pending again; call under download_lock and enqueue it afterwards"""
+    task.status = 'pending'
+    task.updated_at = time.time()
+    task_store.mark_dirty(task, durable=True)
+    rollup_child(task)
+    return {'event': task_event(task), 'enqueue': task.id}
+
+def finish_task_change(change: Dict[str, Any], background_tasks: Optional[BackgroundTasks] = None):
+    """Do the work a cancel/pause/resume deferred until download_lock was released"""
+    if change.get('partial_opts'):
+        remove_partial_files(change['event']['id'], change['partial_opts'])
+    if change.get('new_primary'):
+        enqueue_download(change['new_primary'])
+    if change.get('enqueue'):
+        # yt-dlp continues from the existing .part file (continuedl)
+        enqueue_download(change['enqueue'], background_tasks)
+    publish_task_event(change['event'])
+
+def playlist_children(parent_id: str, statuses) -> List[TaskRecord]:
+    """In-memory child tasks of a playlist in the given statuses; call under download_lock"""
+    job = playlist_jobs.get(parent_id)
+    if job is None:
+        return []
+    children = (download_tasks.get(child_id) for child_id in job.children)
+    return [child for child in children if child is not None and child.status in statuses]
+
+CONTROL_STATUS = {'cancel': 'cancelled', 'pause': 'paused', 'resume': 'pending'}
+
+async def forward_to_owner(download_id: str, action: str, finished_detail: str) -> Optional[Dict[str, str]]:
+    """In a cluster, bring a download here or send the action to the process running it.
+
+    A job still waiting in the shared queue is claimed by this process and
+    None is returned, so the caller carries on as for a local download.
+    Otherwise every process is sent the action, the one running the
+    download carries it out, and the response for the client is returned.
+    """
+    if cluster_node is None:
+        return None
+    with download_lock:
+        if download_id in download_tasks:
+            return None
+    loop = asyncio.get_running_loop()
+    payload = await loop.run_in_executor(None, cluster_backend.take_job, download_id, cluster_node.node_id,
+                                         CLUSTER_LEASE)
+    if payload is not None:
+        adopt_jobs(await loop.run_in_executor(None, load_claimed_jobs, [(download_id, payload)]))
+        return None
+    task = await loop.run_in_executor(None, stored_task, download_id)
+    if task is None:
+        raise HTTPException(status_code=404, detail="Download not found")
+    if task.status in TERMINAL_STATUSES:
+        raise HTTPException(status_code=400, detail=finished_detail)
+    cluster_node.publish('control', {'action': action, 'id': download_id})
+    return {
+        "download_id": download_id,
+        "status": CONTROL_STATUS[action],
+        "message": f"{action.capitalize()} sent to the process running this download"
+    }
+
+def runs_here(download_id: str, action: str) -> bool:
+    """Whether a cluster control action for this download is this process's to carry out"""
+    with download_lock:
+        if download_id in download_tasks or download_id in playlist_jobs:
+            return True
+    if action != 'retry':
+        return False
+    # A failed item of a finished playlist is retried by the process that ran the playlist
+    task = task_store.get(download_id)
+    with download_lock:
+        return task is not None and task.parent_id in playlist_jobs
+
+async def apply_remote_control(body: Dict[str, Any]):
+    """Carry out a cancel, pause, resume or retry another process received for a download running here"""
+    download_id, action = body.get('id'), body.get('action')
+    if not download_id or not runs_here(download_id, action):
+        return
+    try:
+        if action == 'cancel':
+            await cancel_download(download_id)
+        elif action == 'pause':
+            await pause_download(download_id)
+        elif action == 'resume':
+            await resume_download(download_id, BackgroundTasks())
+        elif action == 'retry':
+            await retry_download(download_id)
+    except HTTPException as e:
+        logger.info(f"Ignoring {action} of {download_id} sent by another process: {e.detail}")
+
+def receive_remote_control(body: Dict[str, Any]):
+    if EVENT_LOOP is not None:
+        asyncio.run_coroutine_threadsafe(apply_remote_control(body), EVENT_LOOP)
+
+if cluster_node is not None:
+    cluster_node.on('control', receive_remote_control)
 
 @app.delete("/download/{download_id}")
 async def cancel_download(download_id: str) -> Dict[str, str]:
-    """Cancel an active download"""
+    """Cancel an active download (for a playlist, all of its unfinished items)"""
+    forwarded = await forward_to_owner(download_id, 'cancel', "Download cannot be cancelled")
+    if forwarded is not None:
+        return forwarded
     with download_lock:
-        if download_id not in download_tasks:
-            raise HTTPException(status_code=404, detail="Download not found")
-        
-        task = download_tasks[download_id]
-        
-        if task['status'] in ['completed', 'failed', 'cancelled']:
-            raise HTTPException(status_code=400, detail="Download cannot be cancelled")
+        task = require_active_task(download_id, "Download cannot be cancelled")
+        # The parent goes first so its items' cancellations do not re-derive its status
+        changes = [cancel_task(task)]
+        for child in playlist_children(download_id, ('pending', 'downloading', 'paused')):
+            changes.append(cancel_task(child))
+    
+    for change in changes:
+        finish_task_change(change)
+    logger.info(f"Download cancelled: {download_id}")
+    
+    return {
+        "download_id": download_id,
+        "status": "cancelled",
+        "message": "Download cancelled"
+    }
+
+@app.post("/download/{download_id}/pause")
+async def pause_download(download_id: str) -> Dict[str, str]:
+    """Pause a queued or running download, keeping its partial file"""
+    forwarded = await forward_to_owner(download_id, 'pause', "Download cannot be paused")
+    if forwarded is not None:
+        return forwarded
+    with download_lock:
+        task = require_active_task(download_id, "Download cannot be paused")
         
-        task['status'] = 'cancelled'
-        task['updated_at'] = datetime.now()
-        save_download_tasks(download_tasks)
+        if task.status not in ['pending', 'downloading']:
+            raise HTTPException(status_code=400, detail="Download cannot be paused")
         
-        logger.info(f"Download cancelled: {download_id}")
+        if download_id in playlist_jobs:
+            changes = [pause_task(child) for child in playlist_children(download_id, ('pending', 'downloading'))]
+            changes.append(pause_task(task))
+        else:
+            changes = [pause_task(task)]
+    
+    for change in changes:
+        finish_task_change(change)
+    logger.info(f"Download paused: {download_id}")
+    
+    return {
+        "download_id": download_id,
+        "status": "paused",
+        "message": "Download paused"
+    }
+
+@app.post("/download/{download_id}/resume")
+async def resume_download(download_id: str, background_tasks: BackgroundTasks) -> Dict[str, str]:
+    """Resume a paused download from its partial file"""
+    forwarded = await forward_to_owner(download_id, 'resume', "Download is not paused")
+    if forwarded is not None:
+        return forwarded
+    with download_lock:
+        task = require_active_task(download_id, "Download is not paused")
         
+        if task.status != 'paused':
+            raise HTTPException(status_code=400, detail="Download is not paused")
+        if download_id in playlist_jobs:
+            children = playlist_children(download_id, ('paused',))
+            if any(child.id in running_downloads for child in children):
+                raise HTTPException(status_code=409, detail="Download is still pausing, try again shortly")
+            changes = [resume_task(child) for child in children]
+            task.status = 'pending'
+            task.updated_at = time.time()
+            task_store.mark_dirty(task, durable=True)
+            changes.append({'event': task_event(task)})
+        else:
+            if download_id in running_downloads:
+                raise HTTPException(status_code=409, detail="Download is still pausing, try again shortly")
+            if download_id not in job_specs:
+                raise HTTPException(status_code=409, detail="Download cannot be resumed")
+            changes = [resume_task(task)]
+    
+    for change in changes:
+        finish_task_change(change, background_tasks)
+    logger.info(f"Download resumed: {download_id}")
+    
+    return {
+        "download_id": download_id,
+        "status": "pending",
+        "message": "Download resumed"
+    }
+
+@app.post("/download/{download_id}/retry")
+async def retry_download(download_id: str) -> Dict[str, Any]:
+    """Retry a playlist's failed items (or one failed item), keeping finished ones"""
+    if cluster_node is not None and not runs_here(download_id, 'retry'):
+        if await find_task(download_id) is None:
+            raise HTTPException(status_code=404, detail="Download not found")
+        cluster_node.publish('control', {'action': 'retry', 'id': download_id})
         return {
             "download_id": download_id,
-            "status": "cancelled",
-            "message": "Download cancelled"
+            "retried": [],
+            "message": "Retry sent to the process that ran this playlist"
         }
+    with download_lock:
+        task = download_tasks.get(download_id) or task_store.get(download_id)
+        if task is None:
+            raise HTTPException(status_code=404, detail="Download not found")
+        parent_id = download_id if download_id in playlist_jobs else task.parent_id
+        if not parent_id:
+            raise HTTPException(status_code=400, detail="Only playlist downloads can be retried")
+        job = playlist_jobs.get(parent_id)
+        if job is None:
+            raise HTTPException(status_code=409, detail="Playlist is no longer tracked; start it again")
+        if parent_id == download_id:
+            targets = [c for c in job.children if job.status_of(c) == 'failed']
+        else:
+            targets = [download_id] if job.status_of(download_id) == 'failed' else []
+        if not targets:
+            raise HTTPException(status_code=400, detail="No failed items to retry")
+        
+        parent = download_tasks.get(parent_id)
+        if parent is None:
+            # The playlist had finished; bring it back while its items run again
+            parent = task_store.get(parent_id)
+            parent.error = None
+            download_tasks[parent_id] = parent
+        events = []
+        for child_id in targets:
+            child = task_store.get(child_id)
+            child.status = 'pending'
+            child.progress = 0.0
+            child.speed = child.eta = child.error = child.total_bytes = None
+            child.downloaded_bytes = 0
+            child.updated_at = time.time()
+            download_tasks[child_id] = child
+            job_specs[child_id] = playlist_child_spec(job, child_id, child.url)
+            task_store.mark_dirty(child, durable=True)
+            rollup_child(child)
+            events.append(task_event(child))
+    
+    for child_id in targets:
+        enqueue_download(child_id)
+    for event in events:
+        publish_task_event(event)
+    logger.info(f"Retrying {len(targets)} item(s) of playlist {parent_id}")
+    
+    return {
+        "download_id": download_id,
+        "retried": targets,
+        "message": f"Retrying {len(targets)} failed item(s)"
+    }
 
-@app.get("/downloads")
-async def list_downloads() -> List[DownloadStatus]:
-    """List all downloads"""
+@app.get("/downloads", response_model=Union[List[DownloadStatus], DownloadPage])
+async def list_downloads(
+    status: Optional[str] = None,
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+    url_prefix: Optional[str] = None,
+    sort: str = "created_at",
+    order: str = "desc",
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+):
+    """List downloads, newest first by default.
+
+    Without ``limit`` or ``cursor`` this is the plain list it has always
+    been, capped at DOWNLOADS_PAGE_MAX (an ``X-Next-Cursor`` header says
+    there are more). Passing either returns a page in a
+    ``{items, next_cursor}`` envelope.
+    """
+    paged = limit is not None or cursor is not None
+    if sort not in ("created_at", "updated_at"):
+        raise HTTPException(status_code=400, detail="sort must be created_at or updated_at")
+    if order not in ("asc", "desc"):
+        raise HTTPException(status_code=400, detail="order must be asc or desc")
+    statuses = [part.strip() for part in status.split(",") if part.strip()] if status else None
+    query = functools.partial(
+        task_store.query,
+        statuses=statuses,
+        created_after=db_timestamp(created_after),
+        created_before=db_timestamp(created_before),
+        url_prefix=url_prefix,
+        sort=sort,
+        descending=order == "desc",
+        limit=max(1, min(limit or 50, DOWNLOADS_PAGE_MAX)) if paged else DOWNLOADS_PAGE_MAX,
+        cursor=cursor,
+    )
+    try:
+        tasks, next_cursor = await asyncio.get_running_loop().run_in_executor(None, query)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # The store only has what the write-behind flusher committed; tasks still in memory are current.
+    # Rows are serialized directly; the models only document the response
     with download_lock:
-        return [DownloadStatus(**task) for task in download_tasks.values()]
+        items = [download_tasks.get(task.id, task).to_json() for task in tasks]
+    if statuses:
+        # A live task may have moved past the status it was stored with
+        items = [item for item in items if item['status'] in statuses]
+    if paged:
+        return JSONResponse({'items': items, 'next_cursor': next_cursor})
+    return JSONResponse(items, headers={'X-Next-Cursor': next_cursor} if next_cursor else None)
 
 @app.delete("/downloads")
 async def clear_downloads() -> Dict[str, str]:
     """Clear completed and failed downloads"""
     with download_lock:
-        to_remove = []
-        for download_id, task in download_tasks.items():
-            if task['status'] in ['completed', 'failed', 'cancelled']:
-                to_remove.append(download_id)
-        
-        for download_id in to_remove:
+        for download_id in [i for i, t in download_tasks.items() if t.status in TERMINAL_STATUSES]:
             del download_tasks[download_id]
-        
-        logger.info(f"Cleared {len(to_remove)} downloads")
-        
-        return {
-            "message": f"Cleared {len(to_remove)} downloads",
-            "cleared_count": len(to_remove)
-        }
+    loop = asyncio.get_running_loop()
+    removed = await loop.run_in_executor(None, task_store.delete_terminal)
+    
+    # Delete their files and sidecars; a shared file goes with its last reference.
+    # This unlinks every file and scans DOWNLOADS_DIR, so it stays off the event loop too
+    await loop.run_in_executor(None, disk_quota.remove, removed)
+    with download_lock:
+        for download_id in removed:
+            playlist_jobs.pop(download_id, None)
+    
+    logger.info(f"Cleared {len(removed)} downloads")
+    
+    return {
+        "message": f"Cleared {len(removed)} downloads",
+        "cleared_count": len(removed)
+    }
+
+def active_download_speed() -> float:
+    with download_lock:
+        return sum(t.speed or 0.0 for t in download_tasks.values() if t.status == 'downloading')
+
+def process_worker_counts() -> Optional[Dict[tuple, int]]:
+    if process_pool is None:
+        return None
+    stats = process_pool.stats()
+    return {("alive",): stats["alive"], ("busy",): stats["busy"]}
+
+# Gauges are read at scrape time from state the components already keep
+registry.gauge("widmate_download_workers", "Download worker slots", lambda: MAX_WORKERS)
+registry.gauge("widmate_download_workers_busy", "Download worker slots running a job",
+               lambda: download_queue.stats()["running"] if download_queue is not None else None)
+registry.gauge("widmate_downloads_queued", "Downloads waiting in the scheduler",
+               lambda: download_queue.qsize() if download_queue is not None else None)
+registry.gauge("widmate_download_speed_bytes_per_second", "Summed smoothed speed of running downloads",
+               active_download_speed)
+registry.gauge("widmate_process_workers", "Download worker processes", process_worker_counts, ("state",))
+registry.gauge("widmate_extraction_workers_busy", "Extraction threads running a call",
+               lambda: extraction_executor.stats()["running"])
+registry.gauge("widmate_extraction_queued", "Extractions waiting for a thread",
+               lambda: extraction_executor.stats()["queued"])
+registry.gauge("widmate_ws_subscribers", "Connected WebSocket clients", lambda: len(event_hub.subscribers))
+registry.gauge("widmate_ws_pending_events", "Events buffered for WebSocket clients",
+               lambda: sum(len(s.pending) for s in list(event_hub.subscribers)))
+registry.gauge("widmate_store_pending_rows", "Dirty download rows awaiting a flush", task_store.pending)
+registry.gauge("widmate_cluster_held_jobs", "Shared-queue jobs this process holds the lease of",
+               lambda: cluster_node.stats()["held_jobs"] if cluster_node is not None else None)
+registry.gauge("widmate_cluster_leader", "1 while this process leads the auto-updater",
+               lambda: float(cluster_node.is_leader(UPDATER_LEADERSHIP)) if cluster_node is not None else None)
+
+@app.get("/metrics")
+async def get_metrics() -> Response:
+    """Prometheus metrics"""
+    return Response(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
 
 @app.get("/system/stats")
 async def get_system_stats() -> Dict[str, Any]:
     """Get system statistics"""
+    # Host figures and the content store come from the background sample; counts are kept live
+    sampled = system_stats.snapshot()
+    status_counts = download_tasks.counts.snapshot()
     return {
-        "cpu_percent": psutil.cpu_percent(),
-        "memory_percent": psutil.virtual_memory().percent,
-        "disk_usage": {
-            "total": psutil.disk_usage('/').total,
-            "used": psutil.disk_usage('/').used,
-            "free": psutil.disk_usage('/').free,
-        },
-        "active_downloads": len([t for t in download_tasks.values() if t['status'] == 'downloading']),
-        "total_downloads": len(download_tasks)
+        **sampled,
+        "active_downloads": status_counts['downloading'],
+        "queued_downloads": status_counts['pending'],
+        "downloads_by_status": status_counts,
+        "total_downloads": task_store.count(),
+        "extraction": extraction_executor.stats(),
+        "ydl_pool": ydl_pool.stats(),
+        "version_service": version_service.stats(),
+        "ytdlp_runtime": ytdlp_runtimes.stats(),
+        "info_cache": metadata_cache.stats(),
+        "websocket": event_hub.stats(),
+        "process_pool": process_pool.stats() if process_pool is not None else None,
+        "scheduler": download_queue.stats() if download_queue is not None else None,
+        "rate_limiter": rate_limiter.stats(),
+        "system_stats": system_stats.stats()
     }
 
 # Auto-updater management endpoints
@@ -838,63 +2609,43 @@ async def get_auto_updater_status():
     return get_auto_updater_status()
 
 
-rate_limiter = {}
-
-import re
-
 def sanitize_search_query(query: str) -> str:
     """Sanitize search query to prevent injection attacks"""
     return re.sub(r'[^a-zA-Z0-9\s-]', '', query)
 
 @app.post("/search", response_model=SearchResponse)
-async def search_videos(request: Request, search_request: SearchRequest) -> SearchResponse:
+async def search_videos(request: Request, response: Response, search_request: SearchRequest) -> SearchResponse:
     """Search for videos using yt-dlp"""
     start_time = time.time()
     
     try:
         enforce_auth(request)
-        client_key = get_client_key(request)
-        current_time = time.time()
-        
-        if client_key in rate_limiter:
-            if current_time - rate_limiter[client_key] < 1:  # 1 second between requests
-                raise HTTPException(status_code=429, detail="Rate limit exceeded")
-        
-        rate_limiter[client_key] = current_time
+        await enforce_rate_limit(request, response, "search")
         
         # Sanitize search query
         sanitized_query = sanitize_search_query(search_request.query)
         
-        # Configure yt-dlp for search
-        ydl_opts = {
-            'quiet': True,
-            'no_warnings': True,
-            'extract_flat': True,
-            'default_search': f'ytsearch{search_request.limit}',
-        }
-        
         search_results = []
         
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            # Search for videos
-            search_query = f"ytsearch{search_request.limit}:{sanitized_query}"
-            info = ydl.extract_info(search_query, download=False)
-            
-            if info and 'entries' in info:
-                for entry in info['entries']:
-                    if entry:  # Skip None entries
-                        search_results.append(SearchResult(
-                            id=entry.get('id', ''),
-                            title=entry.get('title', 'Unknown'),
-                            description=entry.get('description', ''),
-                            duration=entry.get('duration'),
-                            thumbnail=entry.get('thumbnail'),
-                            uploader=entry.get('uploader', ''),
-                            upload_date=entry.get('upload_date', ''),
-                            view_count=entry.get('view_count'),
-                            url=entry.get('url', ''),
-                            webpage_url=entry.get('webpage_url', entry.get('url', ''))
-                        ))
+        # Search for videos
+        search_query = f"ytsearch{search_request.limit}:{sanitized_query}"
+        info = await run_extraction(search_query, 'search')
+        
+        if info and 'entries' in info:
+            for entry in info['entries']:
+                if entry:  # Skip None entries
+                    search_results.append(SearchResult(
+                        id=entry.get('id', ''),
+                        title=entry.get('title', 'Unknown'),
+                        description=entry.get('description', ''),
+                        duration=entry.get('duration'),
+                        thumbnail=entry.get('thumbnail'),
+                        uploader=entry.get('uploader', ''),
+                        upload_date=entry.get('upload_date', ''),
+                        view_count=entry.get('view_count'),
+                        url=entry.get('url', ''),
+                        webpage_url=entry.get('webpage_url', entry.get('url', ''))
+                    ))
         
         search_time = time.time() - start_time
         
@@ -905,6 +2656,8 @@ async def search_videos(request: Request, search_request: SearchRequest) -> Sear
             search_time=search_time
         )
         
+    except HTTPException:
+        raise
     except yt_dlp.DownloadError as e:
         logger.error(f"Search error: {e}")
         raise HTTPException(status_code=400, detail="Search failed")
@@ -0,0 +1,185 @@
+"""
+In-process cache for yt-dlp metadata
+TTL + LRU (by entry count and approximate size) with single-flight loading
+"""
+
+import asyncio
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+# Query parameters that only track where a link was shared from
+_TRACKING_PARAMS = {"si", "feature", "pp", "fbclid", "gclid", "igshid", "ref", "ref_src"}
+
+_YOUTUBE_HOSTS = {"youtube.com", "www.youtube.com", "m.youtube.com", "music.youtube.com"}
+
+
+def canonicalize_url(url: str) -> str:
+    """Normalize a media URL so equivalent links share a cache entry"""
+    url = url.strip()
+    try:
+        parts = urlsplit(url)
+    except ValueError:
+        return url
+    if not parts.scheme or not parts.netloc:
+        return url
+
+    scheme = parts.scheme.lower()
+    host = parts.netloc.lower()
+    path = parts.path or "/"
+    query = [
+        (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if k not in _TRACKING_PARAMS and not k.startswith("utm_")
+    ]
+
+    if host == "youtu.be" and len(path) > 1:
+        video_id = path.lstrip("/").split("/")[0]
+        host, path = "www.youtube.com", "/watch"
+        query = [("v", video_id)] + [(k, v) for k, v in query if k != "v"]
+    elif host in _YOUTUBE_HOSTS:
+        host = "www.youtube.com"
+        if path.startswith("/shorts/"):
+            video_id = path[len("/shorts/"):].split("/")[0]
+            path = "/watch"
+            query = [("v", video_id)] + [(k, v) for k, v in query if k != "v"]
+
+    if scheme == "http":
+        scheme = "https"
+    if len(path) > 1:
+        path = path.rstrip("/")
+
+    return urlunsplit((scheme, host, path, urlencode(sorted(query)), ""))
+
+
+def _approx_size(value: Any) -> int:
+    try:
+        return len(json.dumps(value, default=str))
+    except (TypeError, ValueError):
+        return 0
+
+
+class MetadataCache:
+    """Bounded TTL/LRU cache of extracted info dicts"""
+
+    def __init__(self, ttl: float = 300.0, max_entries: int = 512, max_bytes: int = 64 * 1024 * 1024):
+        self.ttl = ttl
+        self.max_entries = max(1, max_entries)
+        self.max_bytes = max_bytes
+        # key -> (expires_at, size, value); ordered oldest access first
+        self._entries: "OrderedDict[Hashable, Tuple[float, int, Any]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self._counters = {
+            "hits": 0,
+            "misses": 0,
+            "coalesced": 0,
+            "evictions": 0,
+            "expired": 0,
+        }
+
+    @staticmethod
+    def key_for(url: str, playlist_info: bool = False) -> Tuple[str, bool]:
+        return canonicalize_url(url), bool(playlist_info)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Return a fresh cached value or None. Safe to call from any thread."""
+        return self._lookup(key, count=True)
+
+    def peek(self, key: Hashable) -> Optional[Any]:
+        """get() for opportunistic internal reuse, left out of the hit/miss counters"""
+        return self._lookup(key, count=False)
+
+    def _lookup(self, key: Hashable, count: bool) -> Optional[Any]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                if count:
+                    self._counters["misses"] += 1
+                return None
+            expires_at, size, value = entry
+            if expires_at <= now:
+                self._drop(key)
+                self._counters["expired"] += 1
+                if count:
+                    self._counters["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            if count:
+                self._counters["hits"] += 1
+            return value
+
+    def put(self, key: Hashable, value: Any, size: Optional[int] = None):
+        """Cache a value; ``size`` is its approximate byte size, computed here when not given"""
+        if value is None:
+            return
+        if size is None:
+            size = _approx_size(value)
+        if self.max_bytes and size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (time.monotonic() + self.ttl, size, value)
+            self._bytes += size
+            while self._entries and (
+                len(self._entries) > self.max_entries
+                or (self.max_bytes and self._bytes > self.max_bytes)
+            ):
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self._counters["evictions"] += 1
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+
+    def _drop(self, key: Hashable):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    async def get_or_load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        """Return the cached value, or load it once for all concurrent callers"""
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._load(key, loader))
+            self._inflight[key] = task
+        else:
+            with self._lock:
+                self._counters["coalesced"] += 1
+        # Shield so one caller going away does not cancel the shared load
+        return await asyncio.shield(task)
+
+    async def _load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        try:
+            value = await loader()
+            if value is not None:
+                # Sizing serializes the whole info dict, so it stays off the event loop
+                size = await asyncio.get_running_loop().run_in_executor(None, _approx_size, value)
+                self.put(key, value, size)
+            return value
+        finally:
+            self._inflight.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._counters["hits"] + self._counters["misses"]
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "ttl": self.ttl,
+                "inflight": len(self._inflight),
+                "hit_ratio": round(self._counters["hits"] / lookups, 4) if lookups else 0.0,
+                **self._counters,
+            }
@@ -0,0 +1,243 @@
+"""
+Prometheus text-format metrics
+Counters and histograms are in-process numbers updated on the hot path (a
+lock, a bisect and an add); nothing is formatted until /metrics is scraped.
+Gauges are callbacks run at scrape time, so state the components already
+keep costs nothing between scrapes.
+"""
+
+import bisect
+import math
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+# Seconds; suits extraction, queue waits, flushes and downloads
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+# Seconds; lock waits and holds are normally microseconds
+LOCK_BUCKETS = (1e-6, 5e-6, 1e-5, 5e-5, 1e-4, 5e-4, 1e-3, 5e-3, 0.01, 0.05, 0.1, 0.5)
+
+GaugeValue = Union[float, Dict[Tuple[str, ...], float]]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class _CounterChild:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum", "_lock")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+        # Unlabelled metrics keep their only series at hand, skipping the label lookup
+        self._unlabelled = None if self.labelnames else self.labels()
+
+    def _new_child(self):
+        return None
+
+    def labels(self, *values: str):
+        """The series for these label values, created on first use"""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _series(self) -> List[Tuple[Tuple[str, ...], object]]:
+        with self._lock:
+            return list(self._children.items())
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0):
+        self._unlabelled.inc(amount)
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        for values, child in self._series():
+            lines.append(f"{self.name}_total{_labels(self.labelnames, values)} {_number(child.value)}")
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Iterable[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self._unlabelled.observe(value)
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        for values, child in self._series():
+            with child._lock:
+                counts = list(child.counts)
+                total = child.sum
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                le = f'le="{_number(bound)}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, values, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, values)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, values)} {cumulative}")
+        return lines
+
+
+class Gauge(_Metric):
+    """A value read at scrape time: a number, or {label values: number} when labelled"""
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, read: Callable[[], GaugeValue],
+                 labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.read = read
+
+    def render(self) -> List[str]:
+        value = self.read()
+        if value is None:
+            return []
+        lines = super().render()
+        if isinstance(value, dict):
+            for values, number in value.items():
+                lines.append(f"{self.name}{_labels(self.labelnames, values)} {_number(float(number))}")
+        else:
+            lines.append(f"{self.name} {_number(float(value))}")
+        return lines
+
+
+class Registry:
+    """Named metrics; registering a name twice returns the existing metric"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                if isinstance(metric, Gauge):
+                    existing.read = metric.read
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name: str, documentation: str, read: Callable[[], GaugeValue],
+              labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, read, labelnames))
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines: List[str] = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class TimedLock:
+    """threading.Lock that records how long callers wait for it and hold it"""
+
+    def __init__(self, wait: Histogram, hold: Histogram):
+        self._lock = threading.Lock()
+        self._wait = wait.labels().observe
+        self._hold = hold.labels().observe
+        self._acquired_at = 0.0
+
+    def acquire(self, blocking: bool = True, timeout: float = -1) -> bool:
+        started = time.perf_counter()
+        acquired = self._lock.acquire(blocking, timeout)
+        if acquired:
+            # Only the holder writes this, so no extra synchronisation is needed
+            self._acquired_at = time.perf_counter()
+            self._wait(self._acquired_at - started)
+        return acquired
+
+    def release(self):
+        held = time.perf_counter() - self._acquired_at
+        self._lock.release()
+        self._hold(held)
+
+    def locked(self) -> bool:
+        return self._lock.locked()
+
+    def __enter__(self) -> bool:
+        return self.acquire()
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+# Process-wide registry that the instrumented modules register with
+registry = Registry()
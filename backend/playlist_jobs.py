@@ -0,0 +1,106 @@
+"""
+Playlist fan-out bookkeeping
+A playlist download is a parent job whose items run as independent child
+jobs. PlaylistJob keeps the parent's roll-up (status counts and aggregate
+bytes) up to date in O(1) per child update.
+"""
+
+from typing import Any, Dict, List, Optional, Tuple
+
+ACTIVE_STATUSES = ('pending', 'downloading', 'paused')
+UNSUCCESSFUL_STATUSES = ('failed', 'cancelled')
+
+
+class PlaylistJob:
+    """A parent download and the roll-up of its child jobs"""
+
+    def __init__(self, parent_id: str, request: Dict[str, Any], client_key: str, priority: int = 0):
+        self.parent_id = parent_id
+        # DownloadRequest fields, used to build (and rebuild, on retry) each child's options
+        self.request = request
+        self.client_key = client_key
+        self.priority = priority
+        self.expanded = False
+        self.children: List[str] = []
+        self.counts: Dict[str, int] = {}
+        self._status: Dict[str, str] = {}
+        # child_id -> (downloaded_bytes, total_bytes or None); unsuccessful items are left out
+        self._bytes: Dict[str, Tuple[int, Optional[int]]] = {}
+        self._downloaded = 0
+        self._known_total = 0
+        self._known_count = 0
+
+    def add_child(self, child_id: str, status: str = 'pending'):
+        self.children.append(child_id)
+        self._status[child_id] = status
+        self.counts[status] = self.counts.get(status, 0) + 1
+        self._set_bytes(child_id, 0, None)
+
+    def update(self, child_id: str, status: str, downloaded: int = 0, total: Optional[int] = None):
+        """Record a child's latest status and byte counts"""
+        old = self._status.get(child_id)
+        if old is None:
+            return
+        if old != status:
+            self.counts[old] -= 1
+            self.counts[status] = self.counts.get(status, 0) + 1
+            self._status[child_id] = status
+        if status in UNSUCCESSFUL_STATUSES:
+            self._drop_bytes(child_id)
+        else:
+            self._set_bytes(child_id, downloaded or 0, total or None)
+
+    def _drop_bytes(self, child_id: str):
+        previous = self._bytes.pop(child_id, None)
+        if previous is None:
+            return
+        self._downloaded -= previous[0]
+        if previous[1] is not None:
+            self._known_total -= previous[1]
+            self._known_count -= 1
+
+    def _set_bytes(self, child_id: str, downloaded: int, total: Optional[int]):
+        self._drop_bytes(child_id)
+        self._bytes[child_id] = (downloaded, total)
+        self._downloaded += downloaded
+        if total is not None:
+            self._known_total += total
+            self._known_count += 1
+
+    def status_of(self, child_id: str) -> Optional[str]:
+        return self._status.get(child_id)
+
+    @property
+    def downloaded_bytes(self) -> int:
+        return self._downloaded
+
+    def total_bytes_estimate(self) -> Optional[int]:
+        """Known sizes plus the average known size for items that have not reported one"""
+        if not self._known_count:
+            return None
+        unknown = len(self._bytes) - self._known_count
+        return self._known_total + round(unknown * self._known_total / self._known_count)
+
+    def progress(self) -> float:
+        total = self.total_bytes_estimate()
+        if not total:
+            return 0.0
+        return min(100.0, 100.0 * self._downloaded / total)
+
+    def active(self) -> int:
+        return sum(self.counts.get(status, 0) for status in ACTIVE_STATUSES)
+
+    def status(self) -> str:
+        """Parent status derived from its children"""
+        if self.expanded and not self.active():
+            if self.counts.get('failed'):
+                return 'failed'
+            return 'completed' if self.counts.get('completed') else 'cancelled'
+        if self.counts.get('downloading'):
+            return 'downloading'
+        if self.expanded and self.counts.get('paused') == self.active():
+            return 'paused'
+        return 'pending'
+
+    def summary(self) -> Dict[str, int]:
+        return {'total': len(self.children), **{k: v for k, v in self.counts.items() if v}}
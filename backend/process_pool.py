@@ -0,0 +1,293 @@
+"""
+Process-pool execution for yt-dlp downloads
+Each worker process runs one download at a time and relays hook events to
+the parent over a Pipe. Workers are recycled after a number of jobs or
+when their memory grows past a limit, and a crashed worker only fails the
+job it was running. After a yt-dlp upgrade, workers are replaced as they
+go idle so new jobs run on the new install (spawn/forkserver only).
+"""
+
+import multiprocessing
+import queue
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+import yt_dlp
+from loguru import logger
+
+from ydl_pool import warm_extractors
+from ytdlp_runtime import run_worker
+
+try:
+    import psutil
+except ImportError:  # pragma: no cover - psutil is in requirements.txt
+    psutil = None
+
+# Hook fields relayed to the parent; everything else in the hook dict stays in the worker
+_PROGRESS_FIELDS = (
+    'status', 'downloaded_bytes', 'total_bytes', 'total_bytes_estimate', 'speed', 'eta',
+    'elapsed', 'filename', 'tmpfilename', 'fragment_index', 'fragment_count',
+)
+_POSTPROCESSOR_FIELDS = ('status', 'postprocessor')
+
+ProgressCallback = Callable[[Dict[str, Any]], None]
+
+
+class WorkerCrashed(Exception):
+    """Raised when a worker process dies while running a job"""
+
+
+class _RemoteAbort(yt_dlp.utils.DownloadCancelled):
+    """Raised inside a worker when the parent asks the running job to stop"""
+
+
+def perform_download(url: str, ydl_opts: Dict[str, Any], cached_info: Optional[Dict[str, Any]] = None):
+    """Run one yt-dlp download, reusing a pre-extracted info dict when given"""
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        if cached_info is not None:
+            try:
+                # Same path as --load-info-json: strip the previous format selection
+                ydl.process_ie_result(ydl.sanitize_info(cached_info, remove_private_keys=True), download=True)
+                return
+            except yt_dlp.DownloadError as e:
+                logger.warning(f"Cached info failed for {url}, re-extracting: {e}")
+        ydl.download([url])
+
+
+def _slim(d: Dict[str, Any], fields) -> Dict[str, Any]:
+    return {k: d[k] for k in fields if k in d}
+
+
+def merges_formats(d: Dict[str, Any]) -> bool:
+    """Whether a progress hook's file is one of several merged after download"""
+    return bool((d.get('info_dict') or {}).get('requested_formats'))
+
+
+def _progress_event(d: Dict[str, Any]) -> Dict[str, Any]:
+    event = _slim(d, _PROGRESS_FIELDS)
+    event['merge'] = merges_formats(d)
+    return event
+
+
+def _rss_bytes() -> int:
+    if psutil is None:
+        return 0
+    try:
+        return psutil.Process().memory_info().rss
+    except Exception:
+        return 0
+
+
+def _worker_main(conn):
+    """Entry point of a worker process: serve jobs until told to stop"""
+    # A fresh interpreter: load extractors now rather than in the first job
+    warm_extractors()
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            return
+        if message[0] == 'stop':
+            return
+
+        _, url, ydl_opts, cached_info = message
+
+        def _relay(kind, payload):
+            # Pick up an abort sent in reply to an earlier event
+            while conn.poll():
+                if conn.recv()[0] == 'abort':
+                    raise _RemoteAbort()
+            conn.send(('hook', kind, payload))
+
+        ydl_opts = dict(ydl_opts)
+        ydl_opts['progress_hooks'] = [lambda d: _relay('progress', _progress_event(d))]
+        ydl_opts['postprocessor_hooks'] = [lambda d: _relay('postprocessor', _slim(d, _POSTPROCESSOR_FIELDS))]
+        ydl_opts['post_hooks'] = [lambda filename: _relay('file', {'filename': filename})]
+        try:
+            perform_download(url, ydl_opts, cached_info)
+            result = ('done', None)
+        except _RemoteAbort:
+            result = ('aborted', None)
+        except Exception as e:
+            result = ('error', str(e))
+        # Drain a late abort so it does not leak into the next job
+        while conn.poll():
+            conn.recv()
+        conn.send(result + (_rss_bytes(),))
+
+
+class _Worker:
+    def __init__(self, ctx, runtime_path: Optional[str] = None):
+        self.runtime_path = runtime_path
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=run_worker, args=(child_conn, runtime_path), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.jobs = 0
+        self.rss = 0
+
+    def stop(self, timeout: float = 5.0):
+        try:
+            self.conn.send(('stop',))
+        except (OSError, EOFError):
+            pass
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join(timeout)
+        self.conn.close()
+
+
+class DownloadProcessPool:
+    """Fixed-size pool of download worker processes"""
+
+    def __init__(self, size: int = 3, max_jobs_per_worker: int = 50, max_memory_mb: int = 1024,
+                 start_method: Optional[str] = None, runtime_path: Optional[str] = None):
+        self.size = max(1, size)
+        # yt-dlp install new workers import; None means the base environment's
+        self.runtime_path = runtime_path
+        self.max_jobs_per_worker = max(1, max_jobs_per_worker)
+        self.max_memory_bytes = max_memory_mb * 1024 * 1024 if max_memory_mb else 0
+        self._ctx = multiprocessing.get_context(start_method or 'spawn')
+        self._idle: "queue.Queue[Optional[_Worker]]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._workers: List[_Worker] = []
+        self._busy = 0
+        self._closed = False
+        self._counters = {
+            "jobs": 0,
+            "crashes": 0,
+            "recycled": 0,
+            "runtime_switches": 0,
+        }
+        for _ in range(self.size):
+            self._idle.put(None)  # spawned lazily on first checkout
+
+    def _checkout(self) -> _Worker:
+        worker = self._idle.get()
+        if self._closed:
+            self._idle.put(worker)
+            raise RuntimeError("Process pool is shut down")
+        if worker is not None and worker.runtime_path != self.runtime_path:
+            self._retire(worker)
+            worker = None
+        if worker is None or not worker.process.is_alive():
+            worker = _Worker(self._ctx, self.runtime_path)
+            with self._lock:
+                self._workers.append(worker)
+        with self._lock:
+            self._busy += 1
+        return worker
+
+    def _checkin(self, worker: _Worker, healthy: bool):
+        with self._lock:
+            self._busy -= 1
+        if worker.runtime_path != self.runtime_path:
+            # Finished its last job on the old yt-dlp; the replacement imports the new one
+            self._retire(worker)
+            worker = None
+        elif not healthy or worker.jobs >= self.max_jobs_per_worker or (
+            self.max_memory_bytes and worker.rss > self.max_memory_bytes
+        ):
+            if healthy:
+                self._counters["recycled"] += 1
+                logger.info(f"Recycling download worker pid={worker.process.pid} jobs={worker.jobs} rss={worker.rss}")
+            worker.stop()
+            with self._lock:
+                if worker in self._workers:
+                    self._workers.remove(worker)
+            worker = None
+        self._idle.put(worker)
+
+    def _retire(self, worker: _Worker):
+        self._counters["runtime_switches"] += 1
+        logger.info(f"Retiring download worker pid={worker.process.pid} after yt-dlp runtime switch")
+        worker.stop()
+        with self._lock:
+            if worker in self._workers:
+                self._workers.remove(worker)
+
+    def set_runtime(self, runtime_path: Optional[str]):
+        """Start new workers on another yt-dlp install; busy workers switch after their current job"""
+        self.runtime_path = runtime_path
+
+    def run(self, url: str, ydl_opts: Dict[str, Any], cached_info: Optional[Dict[str, Any]] = None,
+            on_progress: Optional[ProgressCallback] = None,
+            on_postprocess: Optional[ProgressCallback] = None,
+            on_file: Optional[Callable[[str], None]] = None):
+        """Run a download in a worker process, blocking until it finishes.
+
+        Hook callbacks run in the calling thread. If one raises, the worker
+        is told to abort and the exception is re-raised once it has stopped.
+        """
+        opts = {k: v for k, v in ydl_opts.items() if k not in ('progress_hooks', 'postprocessor_hooks', 'post_hooks')}
+        callbacks = {
+            'progress': on_progress,
+            'postprocessor': on_postprocess,
+            'file': (lambda d: on_file(d['filename'])) if on_file else None,
+        }
+        if cached_info is not None:
+            # Plain JSON-safe values only, so the job pickles cleanly
+            cached_info = yt_dlp.YoutubeDL.sanitize_info(cached_info, remove_private_keys=True)
+        worker = self._checkout()
+        healthy = False
+        pending_exc: Optional[BaseException] = None
+        try:
+            worker.conn.send(('run', url, opts, cached_info))
+            worker.jobs += 1
+            self._counters["jobs"] += 1
+            while True:
+                if not worker.conn.poll(1.0):
+                    if not worker.process.is_alive():
+                        raise EOFError
+                    continue
+                message = worker.conn.recv()
+                if message[0] == 'hook':
+                    _, kind, d = message
+                    callback = callbacks.get(kind)
+                    if callback is None or pending_exc is not None:
+                        continue
+                    try:
+                        callback(d)
+                    except BaseException as e:
+                        pending_exc = e
+                        worker.conn.send(('abort',))
+                    continue
+
+                status, error, rss = message
+                worker.rss = rss
+                healthy = True
+                if pending_exc is not None:
+                    raise pending_exc
+                if status == 'error':
+                    raise yt_dlp.DownloadError(error)
+                return
+        except (EOFError, OSError, BrokenPipeError):
+            self._counters["crashes"] += 1
+            # The pipe can close before the process is reaped
+            worker.process.join(1.0)
+            code = worker.process.exitcode
+            logger.error(f"Download worker pid={worker.process.pid} died (exit code {code})")
+            raise WorkerCrashed(f"Download worker exited unexpectedly (exit code {code})")
+        finally:
+            self._checkin(worker, healthy)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "size": self.size,
+                "busy": self._busy,
+                "alive": sum(1 for w in self._workers if w.process.is_alive()),
+                "max_jobs_per_worker": self.max_jobs_per_worker,
+                "max_memory_bytes": self.max_memory_bytes,
+                "runtime_path": self.runtime_path,
+                **self._counters,
+            }
+
+    def shutdown(self):
+        self._closed = True
+        with self._lock:
+            workers = list(self._workers)
+            self._workers = []
+        for worker in workers:
+            worker.stop(timeout=2.0)
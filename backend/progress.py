@@ -0,0 +1,84 @@
+"""
+Numeric download progress
+Progress hooks record raw byte counts, speed (bytes/s) and ETA (seconds);
+display strings are only produced when a response is built. Speed is an
+exponentially weighted moving average of the byte deltas between ticks.
+"""
+
+import math
+import time
+from typing import Optional, Tuple
+
+# Seconds over which older speed samples fade to 1/e of their weight
+SPEED_TIME_CONSTANT = 3.0
+
+_UNITS = ('B', 'KiB', 'MiB', 'GiB', 'TiB')
+
+
+class SpeedMeter:
+    """Per-download EWMA of transfer speed"""
+
+    __slots__ = ('speed', '_last_time', '_last_bytes', '_tau')
+
+    def __init__(self, time_constant: float = SPEED_TIME_CONSTANT):
+        self.speed: Optional[float] = None
+        self._last_time: Optional[float] = None
+        self._last_bytes = 0
+        self._tau = max(0.001, time_constant)
+
+    def update(self, downloaded_bytes: int, now: Optional[float] = None) -> Optional[float]:
+        """Fold in the byte count of a progress tick and return the smoothed speed"""
+        if now is None:
+            now = time.monotonic()
+        if self._last_time is None or downloaded_bytes < self._last_bytes:
+            # First tick, or yt-dlp moved on to the next file (e.g. audio after video)
+            self._last_time = now
+            self._last_bytes = downloaded_bytes
+            return self.speed
+        elapsed = now - self._last_time
+        if elapsed <= 0:
+            return self.speed
+        sample = (downloaded_bytes - self._last_bytes) / elapsed
+        if self.speed is None:
+            self.speed = sample
+        else:
+            # Irregular tick spacing: weight the sample by how long it covers
+            alpha = 1.0 - math.exp(-elapsed / self._tau)
+            self.speed += alpha * (sample - self.speed)
+        self._last_time = now
+        self._last_bytes = downloaded_bytes
+        return self.speed
+
+
+def progress_numbers(downloaded_bytes: int, total_bytes: Optional[int],
+                     speed: Optional[float]) -> Tuple[float, Optional[float]]:
+    """Percent complete and ETA in seconds (None when unknown)"""
+    if not total_bytes:
+        return 0.0, None
+    percent = min(100.0, 100.0 * downloaded_bytes / total_bytes)
+    eta = max(0.0, (total_bytes - downloaded_bytes) / speed) if speed else None
+    return percent, eta
+
+
+def format_bytes(count: Optional[float]) -> Optional[str]:
+    if count is None:
+        return None
+    value = float(count)
+    for unit in _UNITS:
+        if abs(value) < 1024 or unit == _UNITS[-1]:
+            return f"{value:.0f}{unit}" if unit == 'B' else f"{value:.2f}{unit}"
+        value /= 1024
+
+
+def format_speed(speed: Optional[float]) -> Optional[str]:
+    if speed is None:
+        return None
+    return f"{format_bytes(speed)}/s"
+
+
+def format_eta(seconds: Optional[float]) -> Optional[str]:
+    if seconds is None:
+        return None
+    minutes, secs = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours:02d}:{minutes:02d}:{secs:02d}"
@@ -0,0 +1,220 @@
+"""
+Sliding-window rate limiting
+Each (endpoint, client) pair keeps two fixed-window counters; the previous
+window's count is weighted by how much of it still overlaps the sliding
+window. Checks are O(1), and keys that have been idle long enough to be
+indistinguishable from new ones are evicted. SharedRateLimiter keeps the
+same counters in a cluster backend so several processes share one limit.
+"""
+
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+
+def parse_limits(spec: str) -> Dict[str, Tuple[int, float]]:
+    """Parse "info=30/60,search=1/1" into {endpoint: (requests, window seconds)}"""
+    limits: Dict[str, Tuple[int, float]] = {}
+    for item in spec.split(","):
+        name, sep, value = item.strip().partition("=")
+        if not sep or not name:
+            continue
+        count, _, window = value.partition("/")
+        try:
+            limits[name.strip()] = (int(count), float(window or 60))
+        except ValueError:
+            continue
+    return limits
+
+
+class RateLimitResult:
+    __slots__ = ("allowed", "limit", "remaining", "reset_after", "retry_after")
+
+    def __init__(self, allowed: bool, limit: int, remaining: int, reset_after: float, retry_after: float = 0.0):
+        self.allowed = allowed
+        self.limit = limit
+        self.remaining = remaining
+        self.reset_after = reset_after
+        self.retry_after = retry_after
+
+    def headers(self) -> Dict[str, str]:
+        headers = {
+            "X-RateLimit-Limit": str(self.limit),
+            "X-RateLimit-Remaining": str(self.remaining),
+            "X-RateLimit-Reset": str(math.ceil(self.reset_after)),
+        }
+        if not self.allowed:
+            headers["Retry-After"] = str(max(1, math.ceil(self.retry_after)))
+        return headers
+
+
+def _retry_after(limit: int, window: float, current: int, previous: int, elapsed: float) -> float:
+    """Seconds until the sliding estimate leaves room for one more request"""
+    room = limit - 1
+    if current > room:
+        # Wait for this window to become the previous one and decay enough
+        return (window - elapsed) + window * (1.0 - room / current)
+    # Only the previous window's weight is in the way
+    return window * (1.0 - (room - current) / previous) - elapsed
+
+
+class _Window:
+    __slots__ = ("start", "current", "previous")
+
+    def __init__(self, start: float):
+        self.start = start
+        self.current = 0
+        self.previous = 0
+
+
+class _EndpointLimiter:
+    def __init__(self, limit: int, window: float, max_keys: int):
+        self.limit = max(1, limit)
+        self.window = max(0.001, window)
+        self.max_keys = max_keys
+        # Least recently seen first, so idle keys are found at the front
+        self.keys: "OrderedDict[str, _Window]" = OrderedDict()
+
+    def check(self, key: str, now: float) -> Tuple[RateLimitResult, int]:
+        evicted = self._evict(now)
+        state = self.keys.get(key)
+        start = now - now % self.window
+        if state is None:
+            if len(self.keys) >= self.max_keys:
+                # Full of recently active keys: forget the least recently seen
+                self.keys.popitem(last=False)
+                evicted += 1
+            state = _Window(start)
+            self.keys[key] = state
+        else:
+            self.keys.move_to_end(key)
+            if start != state.start:
+                # Roll forward; anything older than one window no longer counts
+                state.previous = state.current if start - state.start < 1.5 * self.window else 0
+                state.current = 0
+                state.start = start
+
+        elapsed = now - start
+        overlap = 1.0 - elapsed / self.window
+        estimate = state.previous * overlap + state.current
+        reset_after = self.window - elapsed
+
+        if estimate + 1 > self.limit:
+            return RateLimitResult(False, self.limit, 0, reset_after, self._retry_after(state, elapsed)), evicted
+
+        state.current += 1
+        remaining = max(0, int(self.limit - (estimate + 1)))
+        return RateLimitResult(True, self.limit, remaining, reset_after), evicted
+
+    def _retry_after(self, state: _Window, elapsed: float) -> float:
+        return _retry_after(self.limit, self.window, state.current, state.previous, elapsed)
+
+    def _evict(self, now: float) -> int:
+        evicted = 0
+        # After two windows without requests a key carries no state worth keeping
+        while self.keys:
+            key, state = next(iter(self.keys.items()))
+            if now - state.start < 2 * self.window:
+                break
+            del self.keys[key]
+            evicted += 1
+        return evicted
+
+
+class RateLimiter:
+    """Per-endpoint sliding-window limits keyed by client"""
+
+    def __init__(self, limits: Dict[str, Tuple[int, float]], max_keys: int = 100_000):
+        self.max_keys = max(1, max_keys)
+        self._endpoints = {name: _EndpointLimiter(count, window, self.max_keys)
+                           for name, (count, window) in limits.items()}
+        self._lock = threading.Lock()
+        self._counters = {
+            "allowed": 0,
+            "limited": 0,
+            "evicted": 0,
+        }
+
+    def check(self, endpoint: str, client_key: str, now: Optional[float] = None) -> Optional[RateLimitResult]:
+        """Count a request; None when the endpoint has no configured limit"""
+        limiter = self._endpoints.get(endpoint)
+        if limiter is None:
+            return None
+        with self._lock:
+            result, evicted = limiter.check(client_key, time.monotonic() if now is None else now)
+            self._counters["evicted"] += evicted
+            self._counters["allowed" if result.allowed else "limited"] += 1
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {
+                "limits": {name: {"requests": e.limit, "window_seconds": e.window, "keys": len(e.keys)}
+                           for name, e in self._endpoints.items()},
+                **self._counters,
+            }
+
+
+class SharedRateLimiter:
+    """RateLimiter with its window counters kept in a cluster backend.
+
+    Every process of a deployment counts against the same numbers. Windows
+    are aligned to wall-clock time so they line up across nodes; a request
+    that is refused is taken back out of the count, as RateLimiter never
+    counts it.
+    """
+
+    def __init__(self, limits: Dict[str, Tuple[int, float]], backend):
+        self.backend = backend
+        self.limits = {name: (max(1, count), max(0.001, window)) for name, (count, window) in limits.items()}
+        self._lock = threading.Lock()
+        self._counters = {
+            "allowed": 0,
+            "limited": 0,
+            "errors": 0,
+        }
+
+    def _count(self, name: str):
+        with self._lock:
+            self._counters[name] += 1
+
+    def check(self, endpoint: str, client_key: str, now: Optional[float] = None) -> Optional[RateLimitResult]:
+        """Count a request; None when the endpoint has no limit or the backend cannot be reached"""
+        configured = self.limits.get(endpoint)
+        if configured is None:
+            return None
+        limit, window = configured
+        now = time.time() if now is None else now
+        start = now - now % window
+        key = f"{endpoint}:{client_key}"
+        try:
+            current, previous = self.backend.hit(key, start, window)
+        except Exception:
+            # Fail open: the API stays up, unlimited, while the backend is unreachable
+            self._count("errors")
+            return None
+
+        elapsed = now - start
+        # Includes this request
+        estimate = previous * (1.0 - elapsed / window) + current
+        reset_after = window - elapsed
+        if estimate > limit:
+            try:
+                self.backend.unhit(key, start)
+            except Exception:
+                self._count("errors")
+            self._count("limited")
+            retry_after = _retry_after(limit, window, current - 1, previous, elapsed)
+            return RateLimitResult(False, limit, 0, reset_after, retry_after)
+        self._count("allowed")
+        return RateLimitResult(True, limit, max(0, int(limit - estimate)), reset_after)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "limits": {name: {"requests": limit, "window_seconds": window, "shared": True}
+                           for name, (limit, window) in self.limits.items()},
+                **self._counters,
+            }
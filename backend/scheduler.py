@@ -0,0 +1,345 @@
+"""
+Fair-share download scheduler
+Replaces the FIFO download queue with weighted fair queuing across client
+keys, per-request priority within a client, per-host and per-group (e.g.
+one playlist's items) concurrency caps and a global bandwidth budget
+shared by the running jobs
+"""
+
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from metrics import registry
+
+QUEUE_WAIT = registry.histogram("widmate_queue_wait_seconds", "Time downloads spent queued before a worker took them")
+
+
+def host_of(url: str) -> str:
+    """Host used for per-host caps ("www." folded away)"""
+    try:
+        host = (urlsplit(url).hostname or "").lower()
+    except ValueError:
+        return ""
+    return host[4:] if host.startswith("www.") else host
+
+
+def parse_weights(spec: str) -> Dict[str, float]:
+    """Parse "key:abc=4,ip:10.0.0.1=0.5" into a client weight map"""
+    weights: Dict[str, float] = {}
+    for item in spec.split(","):
+        key, sep, value = item.strip().rpartition("=")
+        if not sep or not key:
+            continue
+        try:
+            weights[key] = float(value)
+        except ValueError:
+            continue
+    return weights
+
+
+class _Entry:
+    __slots__ = ("job", "download_id", "client_key", "priority", "host", "group", "seq", "enqueued_at")
+
+    def __init__(self, job, client_key, priority, host, group, seq):
+        self.job = job
+        self.download_id = job[0]
+        self.client_key = client_key
+        self.priority = priority
+        self.host = host
+        self.group = group
+        self.seq = seq
+        self.enqueued_at = time.monotonic()
+
+    def sort_key(self) -> Tuple[int, int]:
+        return (-self.priority, self.seq)
+
+
+class _ClientQueue:
+    __slots__ = ("key", "weight", "heap", "served")
+
+    def __init__(self, key: str, weight: float, served: float):
+        self.key = key
+        self.weight = weight
+        self.heap: List[Tuple[Tuple[int, int], _Entry]] = []
+        # Virtual service received so far, in jobs / weight
+        self.served = served
+
+
+class DownloadScheduler:
+    """Async job queue with weighted fair sharing between clients.
+
+    Jobs are ``(download_id, url, ydl_opts)`` tuples, as with the plain
+    asyncio.Queue this replaces. Each client key gets its own priority queue;
+    ``get()`` serves the backlogged client that has received the least
+    weighted service and whose best job's host is under its cap.
+    """
+
+    def __init__(self, concurrency: int = 3, max_per_host: int = 0, bandwidth_limit: int = 0,
+                 weights: Optional[Dict[str, float]] = None, max_per_group: int = 0):
+        self.concurrency = max(1, concurrency)
+        self.max_per_host = max(0, max_per_host)
+        self.max_per_group = max(0, max_per_group)
+        self.bandwidth_limit = max(0, bandwidth_limit)
+        self.weights = weights or {}
+
+        self._clients: Dict[str, _ClientQueue] = {}
+        self._entries: Dict[str, _Entry] = {}
+        self._running: Dict[str, _Entry] = {}
+        self._running_per_host: Dict[str, int] = {}
+        self._running_per_group: Dict[str, int] = {}
+        self._started_at: Dict[str, float] = {}
+        # A running job's own rate limit (None if it had none), put back when it finishes
+        self._own_rates: Dict[str, Optional[int]] = {}
+        self._seq = itertools.count()
+        self._changed = asyncio.Event()
+        self._avg_duration: Optional[float] = None
+        self._avg_wait: Optional[float] = None
+        self._counters = {
+            "enqueued": 0,
+            "dispatched": 0,
+            "removed": 0,
+            "replaced": 0,
+        }
+
+    # -- producer side -------------------------------------------------
+
+    def put_nowait(self, job: Tuple[str, str, Dict[str, Any]], client_key: str = "", priority: int = 0,
+                   host: Optional[str] = None, group: Optional[str] = None):
+        """Queue a job; higher priority runs first among the same client's jobs.
+
+        Jobs sharing a ``group`` run at most ``max_per_group`` at a time.
+        """
+        self._push(job, client_key, priority, host, group)
+        self._notify()
+
+    def put_many(self, jobs: Iterable[Tuple[Tuple[str, str, Dict[str, Any]], str, int, Optional[str]]]):
+        """Queue (job, client_key, priority, group) tuples together, waking the workers once"""
+        for job, client_key, priority, group in jobs:
+            self._push(job, client_key, priority, None, group)
+        self._notify()
+
+    def _push(self, job: Tuple[str, str, Dict[str, Any]], client_key: str, priority: int,
+              host: Optional[str], group: Optional[str]):
+        # A job queued again replaces its waiting entry rather than being dispatched twice
+        if self._drop_entry(job[0]):
+            self._counters["replaced"] += 1
+        entry = _Entry(job, client_key, int(priority), host if host is not None else host_of(job[1]), group,
+                       next(self._seq))
+        client = self._clients.get(client_key)
+        if client is None:
+            # A newly backlogged client starts level with the least-served active client
+            floor = min((c.served for c in self._clients.values()), default=0.0)
+            client = _ClientQueue(client_key, self.weights.get(client_key, 1.0) or 1.0, floor)
+            self._clients[client_key] = client
+        heapq.heappush(client.heap, (entry.sort_key(), entry))
+        self._entries[entry.download_id] = entry
+        self._counters["enqueued"] += 1
+
+    async def put(self, job: Tuple[str, str, Dict[str, Any]], client_key: str = "", priority: int = 0,
+                  host: Optional[str] = None, group: Optional[str] = None):
+        self.put_nowait(job, client_key, priority, host, group)
+
+    def remove(self, download_id: str) -> bool:
+        """Drop a queued job, e.g. after it was cancelled"""
+        if not self._drop_entry(download_id):
+            return False
+        self._counters["removed"] += 1
+        return True
+
+    def _drop_entry(self, download_id: str) -> bool:
+        entry = self._entries.pop(download_id, None)
+        if entry is None:
+            return False
+        client = self._clients[entry.client_key]
+        client.heap = [item for item in client.heap if item[1] is not entry]
+        heapq.heapify(client.heap)
+        if not client.heap:
+            del self._clients[entry.client_key]
+        return True
+
+    # -- consumer side -------------------------------------------------
+
+    async def get(self) -> Tuple[str, str, Dict[str, Any]]:
+        """Wait for the next eligible job and mark it running"""
+        while True:
+            entry = self._pick()
+            if entry is not None:
+                break
+            # Every put or release sets the event; all waiters wake and re-check
+            self._changed.clear()
+            await self._changed.wait()
+
+        now = time.monotonic()
+        # Queued again while still running: one slot, released by one task_done
+        previous = self._running.pop(entry.download_id, None)
+        if previous is not None:
+            self._release_slots(previous)
+        self._running[entry.download_id] = entry
+        self._running_per_host[entry.host] = self._running_per_host.get(entry.host, 0) + 1
+        if entry.group is not None:
+            self._running_per_group[entry.group] = self._running_per_group.get(entry.group, 0) + 1
+        self._started_at[entry.download_id] = now
+        self._avg_wait = self._ewma(self._avg_wait, now - entry.enqueued_at)
+        QUEUE_WAIT.observe(now - entry.enqueued_at)
+        self._counters["dispatched"] += 1
+        self._own_rates.setdefault(entry.download_id, entry.job[2].get('ratelimit'))
+        self._share_bandwidth()
+        return entry.job
+
+    def task_done(self, job: Tuple[str, str, Dict[str, Any]]):
+        """Release a job's host slot once it has finished running"""
+        download_id = job[0]
+        entry = self._running.pop(download_id, None)
+        if entry is None:
+            return
+        self._release_slots(entry)
+        own = self._own_rates.pop(download_id, None)
+        if self.bandwidth_limit:
+            if own:
+                entry.job[2]['ratelimit'] = own
+            else:
+                entry.job[2].pop('ratelimit', None)
+            self._share_bandwidth()
+        started = self._started_at.pop(download_id, None)
+        if started is not None:
+            self._avg_duration = self._ewma(self._avg_duration, time.monotonic() - started)
+        self._notify()
+
+    def bandwidth_share(self) -> Optional[int]:
+        """Rate limit in bytes/s each running job gets, so together they stay within the budget"""
+        if not self.bandwidth_limit:
+            return None
+        return max(1, self.bandwidth_limit // max(1, len(self._running)))
+
+    def _share_bandwidth(self):
+        """Split the budget evenly over the running jobs; re-applied whenever one starts or finishes.
+
+        yt-dlp reads ``ratelimit`` from the options dict at every chunk, so jobs
+        running in this process follow the new share. A job in a process pool
+        worker got a copy of its options and keeps the share it started with.
+        A job's own lower limit is kept.
+        """
+        share = self.bandwidth_share()
+        if share is None:
+            return
+        for download_id, entry in self._running.items():
+            own = self._own_rates.get(download_id)
+            entry.job[2]['ratelimit'] = min(own, share) if own else share
+
+    def _release_slots(self, entry: _Entry):
+        self._release(self._running_per_host, entry.host)
+        if entry.group is not None:
+            self._release(self._running_per_group, entry.group)
+
+    @staticmethod
+    def _release(counts: Dict[str, int], key: str):
+        remaining = counts.get(key, 1) - 1
+        if remaining > 0:
+            counts[key] = remaining
+        else:
+            counts.pop(key, None)
+
+    def _available(self, entry: _Entry) -> bool:
+        if self.max_per_host and self._running_per_host.get(entry.host, 0) >= self.max_per_host:
+            return False
+        if (self.max_per_group and entry.group is not None
+                and self._running_per_group.get(entry.group, 0) >= self.max_per_group):
+            return False
+        return True
+
+    def _best_eligible(self, client: _ClientQueue) -> Optional[_Entry]:
+        if not client.heap:
+            return None
+        entry = client.heap[0][1]
+        if self._available(entry):
+            return entry
+        # Head job's host or group is saturated; look for the client's best job elsewhere
+        for _, candidate in sorted(client.heap):
+            if self._available(candidate):
+                return candidate
+        return None
+
+    def _pick(self) -> Optional[_Entry]:
+        best: Optional[Tuple[float, int, _ClientQueue, _Entry]] = None
+        for client in self._clients.values():
+            entry = self._best_eligible(client)
+            if entry is None:
+                continue
+            rank = (client.served, entry.seq)
+            if best is None or rank < best[:2]:
+                best = (client.served, entry.seq, client, entry)
+        if best is None:
+            return None
+
+        _, _, client, entry = best
+        if client.heap[0][1] is entry:
+            heapq.heappop(client.heap)
+        else:
+            client.heap = [item for item in client.heap if item[1] is not entry]
+            heapq.heapify(client.heap)
+        client.served += 1.0 / client.weight
+        if not client.heap:
+            del self._clients[client.key]
+        self._entries.pop(entry.download_id, None)
+        return entry
+
+    def _notify(self):
+        self._changed.set()
+
+    @staticmethod
+    def _ewma(current: Optional[float], sample: float, alpha: float = 0.2) -> float:
+        return sample if current is None else current + alpha * (sample - current)
+
+    # -- introspection -------------------------------------------------
+
+    def position(self, download_id: str) -> Optional[Tuple[int, Optional[float]]]:
+        """Estimated (jobs ahead, seconds until start) for a queued job, or None"""
+        entry = self._entries.get(download_id)
+        if entry is None:
+            return None
+        own = self._clients[entry.client_key]
+        rank = sum(1 for key, _ in own.heap if key < entry.sort_key())
+
+        # Other clients are served in proportion to their weight while this one waits
+        ahead = rank
+        own_finish = own.served + (rank + 1) / own.weight
+        for client in self._clients.values():
+            if client is own:
+                continue
+            share = math.ceil((own_finish - client.served) * client.weight)
+            ahead += max(0, min(len(client.heap), share))
+
+        eta = None
+        if self._avg_duration is not None:
+            busy = len(self._running) >= self.concurrency
+            waves = ahead // self.concurrency + (1 if busy else 0)
+            eta = waves * self._avg_duration
+            if busy:
+                eta -= self._avg_duration / 2
+        elif ahead == 0 and len(self._running) < self.concurrency:
+            eta = 0.0
+        return ahead, eta
+
+    def qsize(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": len(self._entries),
+            "running": len(self._running),
+            "clients": len(self._clients),
+            "running_per_host": dict(self._running_per_host),
+            "max_per_host": self.max_per_host,
+            "running_groups": len(self._running_per_group),
+            "max_per_group": self.max_per_group,
+            "bandwidth_limit": self.bandwidth_limit,
+            "bandwidth_share": self.bandwidth_share(),
+            "avg_wait_seconds": round(self._avg_wait, 3) if self._avg_wait is not None else None,
+            "avg_duration_seconds": round(self._avg_duration, 3) if self._avg_duration is not None else None,
+            **self._counters,
+        }
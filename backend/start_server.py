@@ -8,6 +8,7 @@ This script starts the FastAPI backend server with proper configuration.
 import os
 import sys
 import subprocess
+import importlib.util
 from pathlib import Path
 
 def check_dependencies():
@@ -15,7 +16,9 @@ def check_dependencies():
     try:
         import fastapi
         import uvicorn
-        import yt_dlp
+        # Locate yt-dlp without importing it; main.py imports it from the active runtime
+        if importlib.util.find_spec("yt_dlp") is None:
+            raise ImportError("No module named 'yt_dlp'")
         print("✅ All dependencies are installed")
         return True
     except ImportError as e:
@@ -30,12 +33,19 @@ def create_directories():
         Path(directory).mkdir(exist_ok=True)
         print(f"📁 Created directory: {directory}")
 
-def start_server(host="127.0.0.1", port=8000, reload=True):
+def start_server(host="127.0.0.1", port=8000, reload=True, workers=1):
     """Start the FastAPI server"""
+    if workers > 1:
+        # uvicorn cannot reload several workers; they share jobs, limits and events
+        # through a cluster backend, a SQLite file next to the database by default
+        reload = False
+        os.environ.setdefault("CLUSTER_BACKEND", "sqlite:///cluster.db")
     print(f"🚀 Starting WidMate Backend Server...")
     print(f"📡 Server will be available at: http://{host}:{port}")
     print(f"📚 API Documentation: http://{host}:{port}/docs")
     print(f"🔄 Auto-reload: {'Enabled' if reload else 'Disabled'}")
+    if workers > 1:
+        print(f"👷 Workers: {workers} (cluster backend: {os.environ['CLUSTER_BACKEND'].split('://')[0]})")
     print("-" * 50)
     
     try:
@@ -45,6 +55,7 @@ def start_server(host="127.0.0.1", port=8000, reload=True):
             host=host,
             port=port,
             reload=reload,
+            workers=workers,
             log_level="info"
         )
     except KeyboardInterrupt:
@@ -68,6 +79,7 @@ def main():
     host = "127.0.0.1"
     port = 8000
     reload = True
+    workers = 1
     
     if len(sys.argv) > 1:
         if "--host" in sys.argv:
@@ -82,9 +94,14 @@ def main():
         
         if "--no-reload" in sys.argv:
             reload = False
+        
+        if "--workers" in sys.argv:
+            workers_index = sys.argv.index("--workers") + 1
+            if workers_index < len(sys.argv):
+                workers = int(sys.argv[workers_index])
     
     # Start server
-    start_server(host, port, reload)
+    start_server(host, port, reload, workers)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,87 +1,438 @@
+import base64
+import json
 import sqlite3
 import os
-from typing import Dict, Any
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, Any, Optional, List, Sequence, Tuple
+
+from metrics import registry
+from task_record import TaskRecord
 
 DB_PATH = os.getenv("DOWNLOAD_DB", "downloads.db")
+FLUSH_INTERVAL = float(os.getenv("DOWNLOAD_DB_FLUSH_INTERVAL", "2.0"))
+FLUSH_THRESHOLD = int(os.getenv("DOWNLOAD_DB_FLUSH_THRESHOLD", "200"))
 
-def _init_db():
-    conn = sqlite3.connect(DB_PATH)
-    try:
-        conn.execute(
-            """
-            CREATE TABLE IF NOT EXISTS downloads (
-                id TEXT PRIMARY KEY,
-                url TEXT,
-                status TEXT,
-                progress REAL,
-                speed TEXT,
-                eta TEXT,
-                downloaded_bytes INTEGER,
-                total_bytes INTEGER,
-                filename TEXT,
-                error TEXT,
-                created_at TEXT,
-                updated_at TEXT
-            )
-            """
+TERMINAL_STATUSES = ('completed', 'failed', 'cancelled')
+SORT_COLUMNS = ('created_at', 'updated_at')
+
+FLUSH_SECONDS = registry.histogram("widmate_store_flush_seconds", "Time to write a batch of dirty download rows")
+FLUSH_ROWS = registry.counter("widmate_store_rows_written", "Download rows written by store flushes")
+
+_UPSERT_SQL = """
+    INSERT OR REPLACE INTO downloads (
+        id, url, status, progress, speed, eta, downloaded_bytes,
+        total_bytes, filename, error, created_at, updated_at, parent_id
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+def _create_schema(conn: sqlite3.Connection):
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS downloads (
+            id TEXT PRIMARY KEY,
+            url TEXT,
+            status TEXT,
+            progress REAL,
+            speed TEXT,
+            eta TEXT,
+            downloaded_bytes INTEGER,
+            total_bytes INTEGER,
+            filename TEXT,
+            error TEXT,
+            created_at TEXT,
+            updated_at TEXT,
+            parent_id TEXT
         )
-        conn.commit()
-    finally:
-        conn.close()
+        """
+    )
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(downloads)")}
+    if 'parent_id' not in columns:
+        # Databases from before playlist fan-out
+        conn.execute("ALTER TABLE downloads ADD COLUMN parent_id TEXT")
+    # Listing filters by status and time range, ordered by timestamp with id as tiebreak
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_downloads_created ON downloads (created_at, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_downloads_updated ON downloads (updated_at, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_downloads_status_created ON downloads (status, created_at, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_downloads_status_updated ON downloads (status, updated_at, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_downloads_url ON downloads (url)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_downloads_parent ON downloads (parent_id)")
+    # The options a job was started with, so it can be queued again after a restart
+    conn.execute("CREATE TABLE IF NOT EXISTS job_options (id TEXT PRIMARY KEY, options TEXT)")
+    conn.commit()
+
+def db_time(epoch: float) -> str:
+    """Stored form of a timestamp: local, naive, sortable as text"""
+    return str(datetime.fromtimestamp(epoch))
 
-def save_download_tasks(tasks: Dict[str, Any]):
-    _init_db()
-    conn = sqlite3.connect(DB_PATH)
+def _epoch(value: Optional[str]) -> float:
     try:
-        for t in tasks.values():
-            conn.execute(
-                """
-                INSERT OR REPLACE INTO downloads (
-                    id, url, status, progress, speed, eta, downloaded_bytes,
-                    total_bytes, filename, error, created_at, updated_at
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """,
-                (
-                    t.get('id'),
-                    t.get('url'),
-                    t.get('status'),
-                    float(t.get('progress', 0.0)),
-                    t.get('speed'),
-                    t.get('eta'),
-                    int(t.get('downloaded_bytes', 0)),
-                    t.get('total_bytes') if t.get('total_bytes') is not None else None,
-                    t.get('filename'),
-                    t.get('error'),
-                    str(t.get('created_at')),
-                    str(t.get('updated_at')),
-                ),
-            )
-        conn.commit()
-    finally:
-        conn.close()
-
-def load_download_tasks() -> Dict[str, Any]:
-    _init_db()
-    conn = sqlite3.connect(DB_PATH)
+        return datetime.fromisoformat(value).timestamp()
+    except (TypeError, ValueError):
+        return 0.0
+
+def task_row(t: TaskRecord) -> Tuple:
+    """Stored form of a task: plain values in column order, JSON-safe"""
+    return (
+        t.id,
+        t.url,
+        t.status.value,
+        float(t.progress or 0.0),
+        t.speed,
+        t.eta,
+        int(t.downloaded_bytes or 0),
+        t.total_bytes,
+        t.filename,
+        t.error,
+        db_time(t.created_at),
+        db_time(t.updated_at),
+        t.parent_id,
+    )
+
+def _number(value) -> Optional[float]:
+    """Numeric speed/eta column value; None for display strings written by older versions"""
     try:
-        rows = conn.execute("SELECT * FROM downloads").fetchall()
-        tasks: Dict[str, Any] = {}
-        for r in rows:
-            task = {
-                'id': r[0],
-                'url': r[1],
-                'status': r[2],
-                'progress': float(r[3] or 0.0),
-                'speed': r[4],
-                'eta': r[5],
-                'downloaded_bytes': int(r[6] or 0),
-                'total_bytes': int(r[7]) if r[7] is not None else None,
-                'filename': r[8],
-                'error': r[9],
-                'created_at': r[10],
-                'updated_at': r[11],
-            }
-            tasks[task['id']] = task
-        return tasks
-    finally:
-        conn.close()
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+def row_task(r: Sequence) -> TaskRecord:
+    """TaskRecord from a stored row (see task_row)"""
+    return TaskRecord(
+        r[0],
+        r[1],
+        r[2],
+        created_at=_epoch(r[10]),
+        updated_at=_epoch(r[11]),
+        parent_id=r[12],
+        progress=float(r[3] or 0.0),
+        speed=_number(r[4]),
+        eta=_number(r[5]),
+        downloaded_bytes=int(r[6] or 0),
+        total_bytes=int(r[7]) if r[7] is not None else None,
+        filename=r[8],
+        error=r[9],
+    )
+
+def encode_cursor(sort_value: str, task_id: str) -> str:
+    raw = json.dumps([sort_value, task_id], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor: str) -> Tuple[str, str]:
+    """Inverse of encode_cursor; raises ValueError for a malformed cursor"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        sort_value, task_id = json.loads(raw)
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if not isinstance(sort_value, str) or not isinstance(task_id, str):
+        raise ValueError("Invalid cursor")
+    return sort_value, task_id
+
+
+class DownloadStore:
+    """Write-behind persistence for download task state.
+
+    Tasks are marked dirty as they change and a background thread writes
+    only the dirty rows, batched in a single transaction, every
+    ``flush_interval`` seconds or as soon as ``flush_threshold`` tasks are
+    pending. Repeated updates to the same task between flushes coalesce into
+    one row write. Durable updates (terminal status transitions) are written
+    before ``mark_dirty`` returns. ``on_flush`` is handed every batch of
+    rows once it is committed; it runs under the store's lock and must not
+    block.
+    """
+
+    def __init__(self, db_path: str = DB_PATH, flush_interval: float = FLUSH_INTERVAL,
+                 flush_threshold: int = FLUSH_THRESHOLD,
+                 on_flush: Optional[Callable[[List[Tuple]], None]] = None):
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        self.flush_threshold = max(1, flush_threshold)
+        self.on_flush = on_flush
+
+        self._conn: Optional[sqlite3.Connection] = None
+        self._conn_lock = threading.Lock()
+        self._dirty: Dict[str, Tuple] = {}
+        # id -> JSON job options, written in the same transaction as the rows
+        self._dirty_options: Dict[str, str] = {}
+        self._dirty_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread: Optional[threading.Thread] = None
+        # Row count, read once and then kept up to date by new=True writes and deletes
+        self._rows: Optional[int] = None
+
+        self.stats = {
+            "flushes": 0,
+            "rows_written": 0,
+            "last_flush_rows": 0,
+            "last_flush_seconds": 0.0,
+            "errors": 0,
+        }
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            _create_schema(conn)
+            self._conn = conn
+        return self._conn
+
+    def load_all(self) -> Dict[str, TaskRecord]:
+        """Load every persisted task keyed by id"""
+        with self._conn_lock:
+            rows = self._connection().execute("SELECT * FROM downloads").fetchall()
+        return {r[0]: row_task(r) for r in rows}
+
+    def load_active(self) -> Dict[str, TaskRecord]:
+        """Load the tasks that have not reached a terminal status"""
+        marks = ','.join('?' * len(TERMINAL_STATUSES))
+        with self._conn_lock:
+            rows = self._connection().execute(
+                f"SELECT * FROM downloads WHERE status NOT IN ({marks})", TERMINAL_STATUSES
+            ).fetchall()
+        return {r[0]: row_task(r) for r in rows}
+
+    def load_options(self, task_ids: Sequence[str]) -> Dict[str, Dict[str, Any]]:
+        """Job options saved with mark_dirty(options=...), for the given tasks that have them"""
+        self.flush()
+        options: Dict[str, Dict[str, Any]] = {}
+        ids = list(task_ids)
+        with self._conn_lock:
+            conn = self._connection()
+            # Chunked to stay under SQLite's bound-parameter limit
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                rows = conn.execute(
+                    f"SELECT id, options FROM job_options WHERE id IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall()
+                for task_id, raw in rows:
+                    try:
+                        options[task_id] = json.loads(raw)
+                    except ValueError:
+                        continue
+        return options
+
+    def get(self, task_id: str) -> Optional[TaskRecord]:
+        """Read one task, including changes not yet flushed"""
+        with self._dirty_lock:
+            row = self._dirty.get(task_id)
+        if row is None:
+            with self._conn_lock:
+                row = self._connection().execute("SELECT * FROM downloads WHERE id = ?", (task_id,)).fetchone()
+        return row_task(row) if row is not None else None
+
+    def query(self, statuses: Optional[Sequence[str]] = None, created_after: Optional[str] = None,
+              created_before: Optional[str] = None, url_prefix: Optional[str] = None,
+              sort: str = 'created_at', descending: bool = True, limit: int = 50,
+              cursor: Optional[str] = None) -> Tuple[List[TaskRecord], Optional[str]]:
+        """Return one page of tasks and the cursor for the next page (None at the end).
+
+        Keyset pagination on (sort column, id), so each page is an index range
+        scan regardless of how deep into the history it is. Only committed
+        rows are read: this is a plain read and never flushes, so rows still
+        waiting for the flusher show their last committed state.
+        """
+        if sort not in SORT_COLUMNS:
+            raise ValueError(f"Unsupported sort column: {sort}")
+        where: List[str] = []
+        params: List[Any] = []
+        if statuses:
+            where.append(f"status IN ({','.join('?' * len(statuses))})")
+            params.extend(statuses)
+        if created_after:
+            where.append("created_at >= ?")
+            params.append(created_after)
+        if created_before:
+            where.append("created_at < ?")
+            params.append(created_before)
+        if url_prefix:
+            # Range instead of LIKE so the url index applies
+            where.append("url >= ? AND url < ?")
+            params.extend([url_prefix, url_prefix + '\U0010ffff'])
+        if cursor:
+            sort_value, task_id = decode_cursor(cursor)
+            where.append(f"({sort}, id) {'<' if descending else '>'} (?, ?)")
+            params.extend([sort_value, task_id])
+        direction = 'DESC' if descending else 'ASC'
+        sql = "SELECT * FROM downloads"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += f" ORDER BY {sort} {direction}, id {direction} LIMIT ?"
+        params.append(limit + 1)
+
+        with self._conn_lock:
+            rows = self._connection().execute(sql, params).fetchall()
+        tasks = [row_task(r) for r in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit and tasks:
+            # The stored text, so the cursor compares exactly against the column
+            last = rows[limit - 1]
+            next_cursor = encode_cursor(last[10 if sort == 'created_at' else 11], last[0])
+        return tasks, next_cursor
+
+    def children(self, parent_id: str) -> List[TaskRecord]:
+        """Tasks created for a playlist's items, in creation order"""
+        self.flush()
+        with self._conn_lock:
+            rows = self._connection().execute(
+                "SELECT * FROM downloads WHERE parent_id = ? ORDER BY created_at, id", (parent_id,)
+            ).fetchall()
+        return [row_task(r) for r in rows]
+
+    def count(self) -> int:
+        """Number of stored tasks, including ones not flushed yet"""
+        if self._rows is None:
+            self.flush()
+            with self._conn_lock:
+                if self._rows is None:
+                    self._rows = self._connection().execute("SELECT COUNT(*) FROM downloads").fetchone()[0]
+        return self._rows
+
+    def _added(self, n: int):
+        with self._conn_lock:
+            if self._rows is not None:
+                self._rows += n
+
+    def delete_terminal(self) -> List[str]:
+        """Delete every finished, failed or cancelled task, returning their ids"""
+        marks = ','.join('?' * len(TERMINAL_STATUSES))
+        self.flush()
+        with self._conn_lock:
+            conn = self._connection()
+            with conn:
+                ids = [r[0] for r in conn.execute(
+                    f"SELECT id FROM downloads WHERE status IN ({marks})", TERMINAL_STATUSES
+                ).fetchall()]
+                conn.execute(f"DELETE FROM downloads WHERE status IN ({marks})", TERMINAL_STATUSES)
+                conn.execute("DELETE FROM job_options WHERE id NOT IN (SELECT id FROM downloads)")
+            if self._rows is not None:
+                self._rows -= len(ids)
+        return ids
+
+    def mark_dirty(self, task: TaskRecord, durable: bool = False, new: bool = False,
+                   options: Optional[Dict[str, Any]] = None):
+        """Queue a task for persistence.
+
+        The row is snapshotted immediately, so callers may keep mutating the
+        task afterwards. With ``durable=True`` all pending rows, including
+        this one, are committed before returning. Pass ``new=True`` the first
+        time a task is written so count() stays current, and ``options`` to
+        save what the job needs to be started again (see load_options).
+        """
+        row = task_row(task)
+        encoded = json.dumps(options) if options is not None else None
+        if new:
+            self._added(1)
+        with self._dirty_lock:
+            self._dirty[row[0]] = row
+            if encoded is not None:
+                self._dirty_options[row[0]] = encoded
+            pending = len(self._dirty)
+        if durable or self._thread is None:
+            self.flush()
+        elif pending >= self.flush_threshold:
+            self._wakeup.set()
+
+    def mark_dirty_many(self, tasks: Sequence[TaskRecord], durable: bool = False, new: bool = False,
+                        options: Optional[Dict[str, Dict[str, Any]]] = None):
+        """Queue several tasks at once; with ``durable=True`` they commit in one transaction"""
+        rows = [task_row(task) for task in tasks]
+        encoded = {task_id: json.dumps(value) for task_id, value in (options or {}).items()}
+        if new:
+            self._added(len(rows))
+        with self._dirty_lock:
+            for row in rows:
+                self._dirty[row[0]] = row
+            self._dirty_options.update(encoded)
+            pending = len(self._dirty)
+        if durable or self._thread is None:
+            self.flush()
+        elif pending >= self.flush_threshold:
+            self._wakeup.set()
+
+    def flush(self) -> int:
+        """Write all dirty rows in one transaction, returning the row count"""
+        # Holding the connection lock across the swap keeps concurrent
+        # flushes from committing an older snapshot after a newer one
+        with self._conn_lock:
+            with self._dirty_lock:
+                if not self._dirty and not self._dirty_options:
+                    return 0
+                rows: List[Tuple] = list(self._dirty.values())
+                options = list(self._dirty_options.items())
+                self._dirty = {}
+                self._dirty_options = {}
+
+            started = time.perf_counter()
+            try:
+                conn = self._connection()
+                with conn:
+                    conn.executemany("INSERT OR REPLACE INTO job_options (id, options) VALUES (?, ?)", options)
+                    conn.executemany(_UPSERT_SQL, rows)
+            except Exception:
+                # Put the rows back unless a newer snapshot arrived meanwhile
+                with self._dirty_lock:
+                    for row in rows:
+                        self._dirty.setdefault(row[0], row)
+                    for task_id, encoded in options:
+                        self._dirty_options.setdefault(task_id, encoded)
+                self.stats["errors"] += 1
+                raise
+            if self.on_flush is not None and rows:
+                try:
+                    self.on_flush(rows)
+                except Exception:
+                    self.stats["errors"] += 1
+
+        elapsed = time.perf_counter() - started
+        self.stats["flushes"] += 1
+        self.stats["rows_written"] += len(rows)
+        self.stats["last_flush_rows"] = len(rows)
+        self.stats["last_flush_seconds"] = elapsed
+        FLUSH_SECONDS.observe(elapsed)
+        FLUSH_ROWS.inc(len(rows))
+        return len(rows)
+
+    def pending(self) -> int:
+        with self._dirty_lock:
+            return len(self._dirty)
+
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Start the background flush thread"""
+        if self._thread and self._thread.is_alive():
+            return
+        with self._conn_lock:
+            self._connection()
+        self._stopping = False
+        self._thread = threading.Thread(target=self._flush_loop, name="download-store-flush", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """Stop the flush thread, write remaining rows and close the connection"""
+        self._stopping = True
+        self._wakeup.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=10)
+        self._thread = None
+        self.flush()
+        with self._conn_lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def _flush_loop(self):
+        while not self._stopping:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                # Rows were re-queued; retry on the next tick
+                time.sleep(min(self.flush_interval, 1.0))
@@ -0,0 +1,113 @@
+"""
+Background sampling of host statistics
+psutil calls and other aggregate queries run on a timer in one thread;
+/system/stats and the readiness probe read the last snapshot instead of
+sampling the host on every request.
+"""
+
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+
+import psutil
+from loguru import logger
+
+
+class SystemStatsCollector:
+    """Samples CPU, memory, disk and extra sources every ``interval`` seconds"""
+
+    def __init__(self, disk_path: Path, interval: float = 5.0,
+                 samplers: Optional[Dict[str, Callable[[], Any]]] = None):
+        self.disk_path = str(disk_path)
+        self.interval = max(0.5, interval)
+        self.samplers = dict(samplers or {})
+        self._snapshot: Dict[str, Any] = {}
+        self._sampled_at = 0.0
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread: Optional[threading.Thread] = None
+        self._counters = {
+            "samples": 0,
+            "failures": 0,
+        }
+
+    def sample(self) -> Dict[str, Any]:
+        """Take one sample now and make it the current snapshot"""
+        started = time.perf_counter()
+        disk = psutil.disk_usage(self.disk_path)
+        snapshot: Dict[str, Any] = {
+            # Non-blocking: CPU use since the previous sample
+            "cpu_percent": psutil.cpu_percent(interval=None),
+            "memory_percent": psutil.virtual_memory().percent,
+            "disk_usage": {
+                "path": self.disk_path,
+                "total": disk.total,
+                "used": disk.used,
+                "free": disk.free,
+            },
+        }
+        for name, sampler in self.samplers.items():
+            try:
+                snapshot[name] = sampler()
+            except Exception as e:
+                logger.warning(f"System stats sampler {name} failed: {e}")
+                snapshot[name] = None
+        snapshot["sample_seconds"] = time.perf_counter() - started
+        self._snapshot = snapshot
+        self._sampled_at = time.time()
+        self._counters["samples"] += 1
+        return snapshot
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Last sample with its age; taken now if nothing has been sampled yet"""
+        snapshot = self._snapshot or self.sample()
+        return {**snapshot, "sampled_at": self._sampled_at, "age": time.time() - self._sampled_at}
+
+    def age(self) -> float:
+        """Seconds since the last sample; infinite before the first"""
+        return time.time() - self._sampled_at if self._sampled_at else float("inf")
+
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Take a first sample and start the background thread"""
+        if self.is_running():
+            return
+        self._stopping = False
+        self._wakeup.clear()
+        try:
+            self.sample()
+        except Exception as e:
+            self._counters["failures"] += 1
+            logger.error(f"System stats sample failed: {e}")
+        self._thread = threading.Thread(target=self._loop, name="system-stats", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping = True
+        self._wakeup.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=5)
+        self._thread = None
+
+    def _loop(self):
+        while not self._stopping:
+            self._wakeup.wait(self.interval)
+            if self._stopping:
+                break
+            try:
+                self.sample()
+            except Exception as e:
+                # Keep serving the previous sample; its age shows it is getting old
+                self._counters["failures"] += 1
+                logger.error(f"System stats sample failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "interval": self.interval,
+            "age": self.age(),
+            "running": self.is_running(),
+            **self._counters,
+        }
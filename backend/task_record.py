@@ -0,0 +1,184 @@
+"""
+Compact download task records
+One slotted object per task instead of a dict, with the status held as an
+interned enum member and timestamps as epoch floats. to_json() builds the
+API representation directly, without a pydantic model per task. TaskTable
+keeps per-status counts of its records as their statuses change.
+"""
+
+import threading
+from datetime import datetime
+from enum import Enum
+from typing import Any, Dict, Optional
+
+from progress import format_eta, format_speed
+
+
+class TaskStatus(str, Enum):
+    PENDING = 'pending'
+    DOWNLOADING = 'downloading'
+    PAUSED = 'paused'
+    COMPLETED = 'completed'
+    FAILED = 'failed'
+    CANCELLED = 'cancelled'
+
+    def __str__(self) -> str:
+        return self.value
+
+
+# Plain strings and members hash alike, so either looks up the shared member
+_STATUSES: Dict[str, TaskStatus] = {status.value: status for status in TaskStatus}
+
+
+def intern_status(value: str) -> TaskStatus:
+    """The shared TaskStatus member for a status string; ValueError if unknown"""
+    try:
+        return _STATUSES[value]
+    except KeyError:
+        raise ValueError(f"Unknown download status: {value!r}")
+
+
+def iso_time(epoch: Optional[float]) -> Optional[str]:
+    """Local naive ISO-8601 form of an epoch timestamp, as the API has always returned"""
+    return datetime.fromtimestamp(epoch).isoformat() if epoch is not None else None
+
+
+class TaskRecord:
+    """State of one download"""
+
+    __slots__ = (
+        'id', 'url', '_status', 'progress', 'speed', 'eta', 'downloaded_bytes', 'total_bytes',
+        'filename', 'error', 'created_at', 'updated_at', 'parent_id', '_counts',
+    )
+
+    def __init__(self, id: str, url: str, status: str = 'pending', created_at: float = 0.0,
+                 updated_at: Optional[float] = None, parent_id: Optional[str] = None,
+                 progress: float = 0.0, speed: Optional[float] = None, eta: Optional[float] = None,
+                 downloaded_bytes: int = 0, total_bytes: Optional[int] = None,
+                 filename: Optional[str] = None, error: Optional[str] = None):
+        self.id = id
+        self.url = url
+        self._counts: Optional[StatusCounts] = None  # set while the record sits in a TaskTable
+        self.status = status
+        self.progress = progress
+        self.speed = speed  # bytes/s
+        self.eta = eta  # seconds
+        self.downloaded_bytes = downloaded_bytes
+        self.total_bytes = total_bytes
+        self.filename = filename
+        self.error = error
+        self.created_at = created_at
+        self.updated_at = created_at if updated_at is None else updated_at
+        self.parent_id = parent_id
+
+    @property
+    def status(self) -> TaskStatus:
+        return self._status
+
+    @status.setter
+    def status(self, value: str):
+        status = intern_status(value)
+        if self._counts is not None:
+            self._counts.move(self._status, status)
+        self._status = status
+
+    def copy(self) -> 'TaskRecord':
+        """Detached copy; its status changes are not counted"""
+        clone = TaskRecord.__new__(TaskRecord)
+        for slot in TaskRecord.__slots__:
+            setattr(clone, slot, getattr(self, slot))
+        clone._counts = None
+        return clone
+
+    def to_json(self) -> Dict[str, Any]:
+        """JSON-ready fields of the DownloadStatus response"""
+        return {
+            'id': self.id,
+            'status': self._status.value,
+            'progress': self.progress,
+            'speed': format_speed(self.speed),
+            'eta': format_eta(self.eta),
+            'speed_bps': self.speed,
+            'eta_seconds': self.eta,
+            'downloaded_bytes': self.downloaded_bytes,
+            'total_bytes': self.total_bytes,
+            'filename': self.filename,
+            'error': self.error,
+            'created_at': iso_time(self.created_at),
+            'updated_at': iso_time(self.updated_at),
+            'queue_position': None,
+            'estimated_start': None,
+            'parent_id': self.parent_id,
+            'items': None,
+        }
+
+    def __repr__(self) -> str:
+        return f"TaskRecord(id={self.id!r}, status={self._status.value!r})"
+
+
+class StatusCounts:
+    """Number of tracked tasks in each status"""
+
+    __slots__ = ('_counts', '_lock')
+
+    def __init__(self):
+        self._counts: Dict[TaskStatus, int] = {status: 0 for status in TaskStatus}
+        self._lock = threading.Lock()
+
+    def add(self, status: TaskStatus, n: int = 1):
+        with self._lock:
+            self._counts[status] += n
+
+    def move(self, old: TaskStatus, new: TaskStatus):
+        if old is new:
+            return
+        with self._lock:
+            self._counts[old] -= 1
+            self._counts[new] += 1
+
+    def get(self, status: str) -> int:
+        return self._counts[intern_status(status)]
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return {status.value: n for status, n in self._counts.items()}
+
+
+class TaskTable(dict):
+    """id -> TaskRecord map that keeps StatusCounts in step with its records.
+
+    Assignment, ``del`` and ``pop`` track and untrack records; status
+    changes on a tracked record update the counts as they happen.
+    """
+
+    def __init__(self, tasks: Optional[Dict[str, TaskRecord]] = None):
+        super().__init__()
+        self.counts = StatusCounts()
+        for task_id, task in (tasks or {}).items():
+            self[task_id] = task
+
+    def __setitem__(self, task_id: str, task: TaskRecord):
+        previous = dict.get(self, task_id)
+        if previous is not None:
+            self._untrack(previous)
+        dict.__setitem__(self, task_id, task)
+        task._counts = self.counts
+        self.counts.add(task._status)
+
+    def __delitem__(self, task_id: str):
+        task = dict.pop(self, task_id)
+        self._untrack(task)
+
+    def pop(self, task_id: str, *default):
+        if task_id not in self:
+            if default:
+                return default[0]
+            raise KeyError(task_id)
+        task = dict.pop(self, task_id)
+        self._untrack(task)
+        return task
+
+    def _untrack(self, task: TaskRecord):
+        if task._counts is self.counts:
+            self.counts.add(task._status, -1)
+            task._counts = None
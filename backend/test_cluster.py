@@ -0,0 +1,100 @@
+import time
+
+import pytest
+from cluster import ClusterNode, MemoryBackend, RedisBackend, SQLiteBackend
+
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def pair(request, tmp_path):
+    """Two handles on one shared backend, as two processes would have"""
+    if request.param == "memory":
+        backend = MemoryBackend()
+        yield backend, backend
+    elif request.param == "sqlite":
+        a, b = SQLiteBackend(str(tmp_path / "cluster.db")), SQLiteBackend(str(tmp_path / "cluster.db"))
+        yield a, b
+        a.close()
+        b.close()
+    else:
+        fakeredis = pytest.importorskip("fakeredis")
+        server = fakeredis.FakeServer()
+        yield (RedisBackend(fakeredis.FakeRedis(server=server, decode_responses=True)),
+               RedisBackend(fakeredis.FakeRedis(server=server, decode_responses=True)))
+
+
+def test_jobs_are_leased_once_and_requeued_when_the_lease_runs_out(pair):
+    a, b = pair
+    assert a.push_jobs([("j1", {"n": 1}, 0), ("j2", {"n": 2}, 5), ("j3", {"n": 3}, 0)]) == 3
+    assert not b.push_job("j1", {"n": 1})
+
+    assert a.claim_jobs("node-a", 2, lease=0.2) == [("j2", {"n": 2}), ("j1", {"n": 1})]
+    assert b.claim_jobs("node-b", 5, lease=30) == [("j3", {"n": 3})]
+    assert b.claim_jobs("node-b", 5, lease=30) == []
+    assert b.renew_jobs("node-b", ["j3", "j1"], lease=30) == ["j1"]
+
+    # node-a stops renewing: its jobs go back in the queue, in their original order
+    time.sleep(0.3)
+    assert b.requeue_expired() == 2
+    assert b.job_counts() == {"queued": 2, "leased": 1}
+    assert b.claim_jobs("node-b", 5, lease=30) == [("j2", {"n": 2}), ("j1", {"n": 1})]
+
+    a.push_job("j4", {"n": 4})
+    assert a.take_job("j4", "node-a", lease=30) == {"n": 4}
+    assert b.take_job("j4", "node-b", lease=30) is None
+    b.finish_jobs(["j1", "j2", "j3", "j4"])
+    assert a.job_counts() == {"queued": 0, "leased": 0}
+
+
+def test_leader_lease_bus_and_states(pair):
+    a, b = pair
+    assert a.try_lead("auto-updater", "node-a", ttl=30)
+    assert not b.try_lead("auto-updater", "node-b", ttl=30)
+    assert a.try_lead("auto-updater", "node-a", ttl=30)
+    assert b.leader("auto-updater") == "node-a"
+    a.resign("auto-updater", "node-a")
+    assert b.try_lead("auto-updater", "node-b", ttl=30)
+
+    cursor = b.latest_cursor()
+    a.publish([{"kind": "event", "body": {"id": "d1"}}, {"kind": "control", "body": {"id": "d2"}}])
+    cursor, messages = b.read(cursor)
+    assert [m["body"]["id"] for m in messages] == ["d1", "d2"]
+    assert b.read(cursor, block=0.05) == (cursor, [])
+
+    a.put_states({"d1": ["d1", "https://example.com", "completed"]})
+    assert b.get_state("d1") == ["d1", "https://example.com", "completed"]
+    assert b.get_state("missing") is None
+
+
+def test_nodes_coalesce_messages_and_elect_one_leader():
+    backend = MemoryBackend()
+    first = ClusterNode(backend, node_id="first", poll_interval=0.01)
+    second = ClusterNode(backend, node_id="second", poll_interval=0.01)
+    received = []
+    second.on("event", received.append)
+    for node in (first, second):
+        node.lead("auto-updater")
+
+    second.start()
+    # Queued before the sending thread runs, so only the newest progress for d1 goes out
+    first.publish("event", {"id": "d1", "progress": 10}, key="d1")
+    first.publish("event", {"id": "d2", "progress": 5}, key="d2")
+    first.publish("event", {"id": "d1", "progress": 20}, key="d1")
+    first.start()
+    try:
+        assert [first.is_leader("auto-updater"), second.is_leader("auto-updater")].count(True) == 1
+        deadline = time.time() + 5
+        while len(received) < 2 and time.time() < deadline:
+            time.sleep(0.01)
+        assert received == [{"id": "d2", "progress": 5}, {"id": "d1", "progress": 20}]
+
+        backend.push_job("j1", {})
+        assert backend.claim_jobs("first", 1, lease=30) == [("j1", {})]
+        first.hold("j1")
+        first.release("j1")
+        deadline = time.time() + 5
+        while backend.job_counts()["leased"] and time.time() < deadline:
+            time.sleep(0.01)
+        assert backend.job_counts() == {"queued": 0, "leased": 0}
+    finally:
+        first.stop()
+        second.stop()
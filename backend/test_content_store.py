@@ -0,0 +1,64 @@
+import os
+
+import content_store
+from content_store import ContentStore, dedup_key, download_name
+
+
+def _finished(root, download_id, data=b"same bytes"):
+    path = root / f"{download_id}_clip.mp4"
+    path.write_bytes(data)
+    return path
+
+
+def test_identical_files_share_one_blob_until_the_last_reference_goes(tmp_path):
+    store = ContentStore(tmp_path, str(tmp_path / "db.sqlite"))
+    key = dedup_key("https://example.com/v", "best")
+    first = store.ingest("a", _finished(tmp_path, "a"), key)
+    second = store.ingest("b", _finished(tmp_path, "b"))
+    assert first["digest"] == second["digest"]
+    assert first["path"] == tmp_path / "a_clip.mp4"
+    assert os.path.samefile(first["path"], second["path"])
+
+    blob = store.lookup(key)
+    assert blob["name"] == "clip.mp4"
+    attached = store.attach("c", blob["digest"], tmp_path / "c_clip.mp4")
+    assert os.path.samefile(attached, blob["path"])
+    assert store.stats() == {"blobs": 1, "bytes": len(b"same bytes"), "references": 3}
+
+    assert store.release("a")
+    assert store.release("b")
+    assert not (tmp_path / "a_clip.mp4").exists()
+    assert os.path.exists(blob["path"]) and store.lookup(key) is not None
+
+    assert store.release("c")
+    assert not os.path.exists(blob["path"])
+    assert store.lookup(key) is None
+    assert store.stats()["blobs"] == 0
+    assert not store.release("c")
+    store.close()
+
+
+def test_without_hardlinks_the_first_file_is_the_blob(tmp_path, monkeypatch):
+    def no_links(src, dst):
+        raise OSError("hardlinks not supported")
+
+    monkeypatch.setattr(content_store.os, "link", no_links)
+    store = ContentStore(tmp_path, str(tmp_path / "db.sqlite"))
+    first = store.ingest("a", _finished(tmp_path, "a"))
+    assert first["path"] == tmp_path / "a_clip.mp4"
+
+    # A duplicate is dropped and served from the first download's file
+    second = store.ingest("b", _finished(tmp_path, "b"))
+    assert second["path"] == first["path"]
+    assert not (tmp_path / "b_clip.mp4").exists()
+
+    assert store.release("b")
+    assert first["path"].exists()
+    assert store.release("a")
+    assert not first["path"].exists()
+    store.close()
+
+
+def test_download_name_strips_only_its_own_id():
+    assert download_name("abc", "/d/abc_My video.mp4") == "My video.mp4"
+    assert download_name("abc", "/d/.store/12/1234.mp4") == "1234.mp4"
@@ -0,0 +1,72 @@
+import itertools
+import sqlite3
+import uuid
+
+import disk_quota
+from content_store import ContentStore
+from disk_quota import DiskQuota
+
+
+def _file(root, size, suffix='.mp4'):
+    download_id = str(uuid.uuid4())
+    path = root / f"{download_id}_clip{suffix}"
+    path.write_bytes(b'x' * size)
+    return download_id, path
+
+
+def test_least_recently_used_downloads_are_evicted_with_sidecars(tmp_path, monkeypatch):
+    clock = itertools.count(1000)
+    monkeypatch.setattr(disk_quota.time, 'time', lambda: next(clock))
+    evicted = []
+    root, db = tmp_path / 'downloads', str(tmp_path / 'db.sqlite')
+    root.mkdir()
+    quota = DiskQuota(root, db, ContentStore(root, db),
+                      quota_bytes=100, high_watermark=0.9, low_watermark=0.5, on_evict=evicted.append)
+    a, b, c = (_file(root, 40) for _ in range(3))
+    for download_id, path in (a, b, c):
+        quota.record(download_id, path)
+    sidecar = root / f"{b[0]}_clip.info.json"
+    sidecar.write_text('{}')
+    quota.touch(a[0])
+
+    # 120 bytes against a 90 byte high watermark: drop to 50 by evicting b, then c
+    assert quota.enforce() == [b[0], c[0]]
+    assert evicted == [b[0], c[0]]
+    assert a[1].exists() and not b[1].exists() and not c[1].exists() and not sidecar.exists()
+    assert quota.scan() == 40
+
+
+def test_admission_reservations_and_orphan_sweep(tmp_path):
+    active = str(uuid.uuid4())
+    quota = DiskQuota(tmp_path, str(tmp_path / 'db.sqlite'), None, quota_bytes=1000, active_ids=lambda: {active})
+    assert quota.admit(600) is None
+    assert quota.reserve(active, 600) is None
+    # The running download's remaining 600 bytes leave 400 for everyone else
+    assert 'Not enough disk space' in quota.admit(500)
+    assert quota.reserve('other', 500)
+    quota.reserve(active, 600, 500)
+    assert quota.reserve('other', 500) is None
+    quota.release(active)
+    assert quota.stats()['reservations'] == 1
+
+    kept = tmp_path / f"{active}_clip.mp4.part"
+    kept.write_bytes(b'x')
+    _, orphan = _file(tmp_path, 1, '.f137.mp4.part')
+    _, fragment = _file(tmp_path, 1, '.mp4.part-Frag3')
+    assert quota.sweep_orphans() == 2
+    assert kept.exists() and not orphan.exists() and not fragment.exists()
+
+
+def test_removing_more_downloads_than_sqlite_binds_at_once(tmp_path):
+    root, db = tmp_path / 'downloads', str(tmp_path / 'db.sqlite')
+    root.mkdir()
+    quota = DiskQuota(root, db, ContentStore(root, db))
+    kept, gone = _file(root, 10), _file(root, 30)
+    for download_id, path in (kept, gone):
+        quota.record(download_id, path)
+
+    # Builds differ in how many parameters one statement may bind; pin it below the id count
+    quota._connection().setlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER, 999)
+    assert quota.remove([str(uuid.uuid4()) for _ in range(1500)] + [gone[0]]) == 30
+    assert kept[1].exists() and not gone[1].exists()
+    assert quota.scan() == 10
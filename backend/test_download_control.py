@@ -0,0 +1,238 @@
+import asyncio
+import threading
+import time
+import uuid
+from pathlib import Path
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from file_response import StreamAborted
+from rate_limit import RateLimiter
+from scheduler import DownloadScheduler
+
+client = TestClient(main.app)
+
+
+class FakeDownload:
+    """Stands in for yt-dlp: writes a .part file and reports progress until told to finish"""
+
+    def __init__(self):
+        self.finish = threading.Event()
+
+    def __call__(self, url, opts, cached=None):
+        part = Path(opts['outtmpl'].replace('%(title)s', 'clip').replace('%(ext)s', 'mp4') + '.part')
+        part.parent.mkdir(parents=True, exist_ok=True)
+        part.write_bytes(b'x')
+        downloaded = 0
+        while not self.finish.is_set():
+            with open(part, 'ab') as f:
+                f.write(b'x' * 100)
+            downloaded += 100
+            opts['progress_hooks'][0]({'status': 'downloading', 'downloaded_bytes': downloaded,
+                                       'tmpfilename': str(part)})
+            time.sleep(0.01)
+        final = part.with_suffix('')
+        part.rename(final)
+        opts['progress_hooks'][0]({'status': 'finished', 'filename': str(final)})
+        opts['post_hooks'][0](str(final))
+
+
+@pytest.fixture
+def fake(monkeypatch):
+    fake = FakeDownload()
+    monkeypatch.setattr(main, 'perform_download', fake)
+    monkeypatch.setattr(main, 'download_queue', DownloadScheduler())
+    monkeypatch.setattr(main, 'rate_limiter', RateLimiter({}))
+    yield fake
+    fake.finish.set()
+    # Finished downloads go with their files and stored blobs
+    client.delete('/downloads')
+    for path in main.DOWNLOADS_DIR.glob('*_clip.mp4*'):
+        path.unlink()
+
+
+def submit(n: int) -> str:
+    # Unique per run: completed files are deduplicated by URL across runs sharing a store
+    url = f'https://example.com/control/{n}?run={uuid.uuid4().hex}'
+    response = client.post('/download', json={'url': url, 'format_id': 'best'})
+    assert response.status_code == 200
+    return response.json()['download_id']
+
+
+def start(download_id: str) -> threading.Thread:
+    """Take the job off the queue and run it as a worker would, until it reports progress"""
+    main.download_queue.remove(download_id)
+    spec = main.job_specs[download_id]
+    worker = threading.Thread(target=main.download_video_task, args=(download_id, spec['url'], spec['ydl_opts']))
+    worker.start()
+    deadline = time.time() + 5
+    while main.get_task(download_id).status != 'downloading' and time.time() < deadline:
+        time.sleep(0.01)
+    return worker
+
+
+def status(download_id: str) -> str:
+    return client.get(f'/status/{download_id}').json()['status']
+
+
+def test_pause_stops_a_running_download_and_resume_requeues_it(fake):
+    download_id = submit(1)
+    worker = start(download_id)
+    assert status(download_id) == 'downloading'
+
+    assert client.post(f'/download/{download_id}/pause').json()['status'] == 'paused'
+    worker.join(timeout=5)
+    assert not worker.is_alive()
+    assert status(download_id) == 'paused'
+    assert download_id not in main.running_downloads
+    assert list(main.DOWNLOADS_DIR.glob(f'{download_id}_*.part'))
+    assert client.post(f'/download/{download_id}/pause').status_code == 400
+
+    assert client.post(f'/download/{download_id}/resume').json()['status'] == 'pending'
+    assert status(download_id) == 'pending'
+    assert main.download_queue.qsize() == 1
+
+    worker = start(download_id)
+    fake.finish.set()
+    worker.join(timeout=5)
+    assert status(download_id) == 'completed'
+    assert client.post(f'/download/{download_id}/pause').status_code == 400
+    assert client.post(f'/download/{download_id}/resume').status_code == 400
+    assert client.delete(f'/download/{download_id}').status_code == 400
+
+
+def test_cancelling_a_paused_download_removes_its_partial_file(fake):
+    download_id = submit(2)
+    worker = start(download_id)
+    client.post(f'/download/{download_id}/pause')
+    worker.join(timeout=5)
+    assert client.post(f'/download/{download_id}/resume').status_code == 200
+    assert client.post(f'/download/{download_id}/pause').json()['status'] == 'paused'
+    # Paused while queued: it leaves the queue
+    assert main.download_queue.qsize() == 0
+
+    assert client.delete(f'/download/{download_id}').json()['status'] == 'cancelled'
+    assert status(download_id) == 'cancelled'
+    assert not list(main.DOWNLOADS_DIR.glob(f'{download_id}_*'))
+    assert download_id not in main.job_specs
+    assert client.post(f'/download/{download_id}/resume').status_code == 400
+
+
+def test_cancel_stops_a_running_download(fake):
+    download_id = submit(3)
+    worker = start(download_id)
+    assert client.delete(f'/download/{download_id}').json()['status'] == 'cancelled'
+    worker.join(timeout=5)
+    assert not worker.is_alive()
+    assert status(download_id) == 'cancelled'
+    assert not list(main.DOWNLOADS_DIR.glob(f'{download_id}_*'))
+    assert client.post('/download/unknown/pause').status_code == 404
+
+
+def test_downloads_list_keeps_its_shape_unless_paging_is_asked_for(fake, monkeypatch):
+    first, second = submit(4), submit(5)
+    listed = client.get('/downloads', params={'status': 'pending', 'url_prefix': 'https://example.com/control/'})
+    assert {item['id'] for item in listed.json()} >= {first, second}
+    assert 'X-Next-Cursor' not in listed.headers
+
+    page = client.get('/downloads', params={'url_prefix': 'https://example.com/control/', 'limit': 1}).json()
+    assert len(page['items']) == 1 and page['next_cursor']
+
+    monkeypatch.setattr(main, 'DOWNLOADS_PAGE_MAX', 1)
+    capped = client.get('/downloads', params={'url_prefix': 'https://example.com/control/'})
+    assert len(capped.json()) == 1
+    rest = client.get('/downloads', params={'url_prefix': 'https://example.com/control/',
+                                           'cursor': capped.headers['X-Next-Cursor']}).json()
+    assert rest['items'][0]['id'] != capped.json()[0]['id']
+    for download_id in (first, second):
+        client.delete(f'/download/{download_id}')
+
+
+def test_stream_sends_the_file_while_it_is_written(fake, monkeypatch):
+    monkeypatch.setattr(main, 'STREAM_POLL_INTERVAL', 0.01)
+    download_id = submit(6)
+    worker = start(download_id)
+    threading.Timer(0.3, fake.finish.set).start()
+
+    streamed = client.get(f'/stream/{download_id}')
+    worker.join(timeout=5)
+    assert streamed.status_code == 200
+    assert 'clip.mp4' in streamed.headers['content-disposition']
+    assert status(download_id) == 'completed'
+    assert streamed.content == Path(main.get_task(download_id).filename).read_bytes()
+    assert len(streamed.content) > 1000
+
+
+def test_stream_ends_when_the_download_is_cancelled(fake, monkeypatch):
+    monkeypatch.setattr(main, 'STREAM_POLL_INTERVAL', 0.01)
+    download_id = submit(7)
+    worker = start(download_id)
+    threading.Timer(0.2, lambda: client.delete(f'/download/{download_id}')).start()
+
+    # The body is cut short without its final chunk
+    with pytest.raises(StreamAborted, match='download cancelled'):
+        client.get(f'/stream/{download_id}')
+    worker.join(timeout=5)
+    assert status(download_id) == 'cancelled'
+    assert client.get(f'/stream/{download_id}').status_code == 400
+
+
+def test_batch_rows_are_committed_off_the_event_loop(fake, monkeypatch):
+    writes = []
+    mark_dirty_many = main.task_store.mark_dirty_many
+
+    def recording(tasks, **kwargs):
+        try:
+            asyncio.get_running_loop()
+            writes.append('event loop')
+        except RuntimeError:
+            writes.append(kwargs['durable'])
+        return mark_dirty_many(tasks, **kwargs)
+
+    monkeypatch.setattr(main.task_store, 'mark_dirty_many', recording)
+    urls = [f'https://example.com/control/batch/{n}?run={uuid.uuid4().hex}' for n in range(3)]
+    response = client.post('/downloads/batch', json={'downloads': [{'url': url} for url in urls]})
+    assert response.status_code == 200
+    assert writes == [True]
+    ids = [item['download_id'] for item in response.json()['downloads']]
+    # Stored before the response
+    assert all(main.task_store.get(download_id).status == 'pending' for download_id in ids)
+    assert main.download_queue.qsize() == 3
+
+
+def test_batch_requests_for_a_stored_file_are_served_from_it(fake, monkeypatch):
+    url = f'https://example.com/control/stored?run={uuid.uuid4().hex}'
+    first = client.post('/download', json={'url': url, 'format_id': 'best'}).json()['download_id']
+    worker = start(first)
+    fake.finish.set()
+    worker.join(timeout=5)
+    assert status(first) == 'completed'
+
+    lookups = []
+    lookup = main.content_store.lookup
+    monkeypatch.setattr(main.content_store, 'lookup', lambda key: lookups.append(key) or lookup(key))
+    response = client.post('/downloads/batch', json={'downloads': [{'url': url, 'format_id': 'best'}] * 2})
+    served = response.json()['downloads']
+    assert [item['status'] for item in served] == ['completed', 'completed']
+    assert served[0]['message'] == "Download served from an existing file"
+    # Identical requests in one batch share a lookup
+    assert len(lookups) == 1
+    original = Path(main.get_task(first).filename).read_bytes()
+    for item in served:
+        assert Path(main.get_task(item['download_id']).filename).read_bytes() == original
+
+
+def test_listing_shows_the_live_state_of_tasks_the_store_has_not_caught_up_with(fake, monkeypatch):
+    download_id = submit(8)
+    stored = main.get_task(download_id)
+    worker = start(download_id)
+    # As if the flusher had not written the progress yet
+    monkeypatch.setattr(main.task_store, 'query', lambda **kwargs: ([stored], None))
+
+    listed = client.get('/downloads').json()
+    assert [item['status'] for item in listed] == ['downloading']
+    assert client.get('/downloads', params={'status': 'pending'}).json() == []
+    client.delete(f'/download/{download_id}')
+    worker.join(timeout=5)
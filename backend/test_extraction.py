@@ -0,0 +1,73 @@
+import asyncio
+import threading
+
+import pytest
+from extraction import ExtractionExecutor, ExtractionBusy, ExtractionTimeout
+
+
+def test_backlog_is_bounded_and_wait_is_tracked():
+    executor = ExtractionExecutor(max_workers=1, max_queue=1, timeout=5)
+    release = threading.Event()
+
+    async def scenario():
+        first = asyncio.ensure_future(executor.run(release.wait))
+        second = asyncio.ensure_future(executor.run(lambda: "done"))
+        await asyncio.sleep(0.05)
+
+        with pytest.raises(ExtractionBusy):
+            await executor.run(lambda: None)
+        assert executor.stats()["queued"] == 1
+
+        release.set()
+        return await first, await second
+
+    try:
+        assert asyncio.run(scenario()) == (True, "done")
+        stats = executor.stats()
+        assert stats["rejected"] == 1
+        assert stats["completed"] == 2
+        assert stats["max_wait_seconds"] > 0
+    finally:
+        release.set()
+        executor.shutdown()
+
+
+def test_slow_call_times_out():
+    executor = ExtractionExecutor(max_workers=1, max_queue=0, timeout=0.05)
+    release = threading.Event()
+    try:
+        with pytest.raises(ExtractionTimeout):
+            asyncio.run(executor.run(release.wait))
+        assert executor.stats()["timeouts"] == 1
+    finally:
+        release.set()
+        executor.shutdown()
+
+
+def test_cancelled_caller_releases_its_queue_slot():
+    executor = ExtractionExecutor(max_workers=1, max_queue=1, timeout=5)
+    release = threading.Event()
+
+    async def scenario():
+        first = asyncio.ensure_future(executor.run(release.wait))
+        queued = asyncio.ensure_future(executor.run(lambda: "never"))
+        await asyncio.sleep(0.05)
+        assert executor.stats()["queued"] == 1
+
+        queued.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await queued
+        assert executor.stats()["queued"] == 0
+
+        # The freed slot takes a new call instead of raising ExtractionBusy
+        second = asyncio.ensure_future(executor.run(lambda: "done"))
+        await asyncio.sleep(0.05)
+        release.set()
+        return await first, await second
+
+    try:
+        assert asyncio.run(scenario()) == (True, "done")
+        assert executor.stats()["completed"] == 2
+    finally:
+        release.set()
+        executor.shutdown()
@@ -0,0 +1,136 @@
+import asyncio
+import threading
+import time
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from file_response import DownloadFileResponse, StreamAborted, parse_range, tail_growing_file
+
+
+def test_parse_range():
+    assert parse_range("bytes=0-", 1000) == (0, 999)
+    assert parse_range("bytes=100-199", 1000) == (100, 199)
+    assert parse_range("bytes=-10", 1000) == (990, 999)
+    assert parse_range("bytes=0-1,5-6", 1000) is None
+    assert parse_range("bytes=9-2", 1000) is None
+    with pytest.raises(ValueError):
+        parse_range("bytes=1000-", 1000)
+
+
+@pytest.fixture
+def client(tmp_path):
+    path = tmp_path / "video.mp4"
+    path.write_bytes(bytes(range(256)) * 4)
+    app = FastAPI()
+
+    @app.get("/file")
+    async def serve(request: Request):
+        return DownloadFileResponse(request, path, filename=path.name)
+
+    return TestClient(app)
+
+
+def test_range_resume_and_conditional_get(client):
+    full = client.get("/file")
+    assert full.status_code == 200 and len(full.content) == 1024
+    etag = full.headers["etag"]
+
+    partial = client.get("/file", headers={"Range": "bytes=1000-", "If-Range": etag})
+    assert partial.status_code == 206
+    assert partial.headers["content-range"] == "bytes 1000-1023/1024"
+    assert partial.content == full.content[1000:]
+
+    stale = client.get("/file", headers={"Range": "bytes=1000-", "If-Range": '"other"'})
+    assert stale.status_code == 200 and len(stale.content) == 1024
+
+    assert client.get("/file", headers={"If-None-Match": etag}).status_code == 304
+    assert client.get("/file", headers={"Range": "bytes=2048-"}).status_code == 416
+
+
+class _Writer(threading.Thread):
+    """Writes a download the way yt-dlp does: appends to a .part file, then renames it"""
+
+    def __init__(self, tmp_path, chunks=20, outcome="completed", truncate=False):
+        super().__init__(daemon=True)
+        tmp_path.mkdir(exist_ok=True)
+        self.part = tmp_path / "video.mp4.part"
+        self.final = tmp_path / "video.mp4"
+        self.part.write_bytes(b"")
+        self.state = {"status": "downloading", "path": str(self.part), "merge": False}
+        self.chunks, self.outcome, self.truncate = chunks, outcome, truncate
+        self.written = b""
+
+    def run(self):
+        for i in range(self.chunks):
+            data = bytes([i]) * 1000
+            with open(self.part, "ab") as f:
+                f.write(data)
+            self.written += data
+            time.sleep(0.005)
+        if self.truncate:
+            self.part.write_bytes(b"restarted")
+        if self.outcome == "completed":
+            self.part.rename(self.final)
+            self.state = {"status": "completed", "path": str(self.final), "merge": False}
+        else:
+            self.state = {"status": self.outcome, "path": None, "merge": False}
+
+
+def _tail(writer):
+    async def collect():
+        received = b""
+        try:
+            async for chunk in tail_growing_file(lambda: writer.state, poll_interval=0.005, chunk_size=700):
+                received += chunk
+        except StreamAborted as e:
+            return received, str(e)
+        return received, None
+
+    writer.start()
+    try:
+        return asyncio.run(collect())
+    finally:
+        writer.join()
+
+
+def test_tail_follows_a_growing_file_through_its_rename(tmp_path):
+    writer = _Writer(tmp_path)
+    received, error = _tail(writer)
+    assert error is None
+    assert received == writer.written == writer.final.read_bytes()
+
+
+def test_tail_stops_when_the_download_fails_or_restarts(tmp_path):
+    received, error = _tail(_Writer(tmp_path / "failed", outcome="failed"))
+    assert error == "download failed"
+    assert len(received) <= 20 * 1000
+
+    received, error = _tail(_Writer(tmp_path / "restart", truncate=True))
+    assert error == "file was truncated (download restarted)"
+
+
+def test_range_on_a_file_still_being_written_serves_a_consistent_snapshot(tmp_path):
+    path = tmp_path / "video.mp4.part"
+    path.write_bytes(b"a" * 1000)
+    app = FastAPI()
+
+    @app.get("/file")
+    async def serve(request: Request):
+        response = DownloadFileResponse(request, path, filename="video.mp4")
+        # More bytes arrive after the size was taken
+        with open(path, "ab") as f:
+            f.write(b"b" * 1000)
+        return response
+
+    client = TestClient(app)
+    partial = client.get("/file", headers={"Range": "bytes=900-"})
+    assert partial.status_code == 206
+    assert partial.headers["content-range"] == "bytes 900-999/1000"
+    assert partial.content == b"a" * 100
+
+    # The next request sees the grown file and resumes where the last one ended
+    rest = client.get("/file", headers={"Range": "bytes=1000-"})
+    assert rest.headers["content-range"] == "bytes 1000-1999/2000"
+    assert rest.content == b"b" * 1000
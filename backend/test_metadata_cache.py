@@ -0,0 +1,87 @@
+import asyncio
+import threading
+
+import metadata_cache
+from metadata_cache import MetadataCache, canonicalize_url
+
+
+def test_equivalent_links_share_one_key():
+    watch = "https://www.youtube.com/watch?v=abc123"
+    assert canonicalize_url("https://youtu.be/abc123?si=share") == watch
+    assert canonicalize_url("http://m.youtube.com/watch?v=abc123&feature=shared&utm_source=x") == watch
+    assert canonicalize_url("https://youtube.com/shorts/abc123/") == watch
+    assert canonicalize_url(" https://Example.com/video/?b=2&a=1&fbclid=z ") == "https://example.com/video?a=1&b=2"
+    assert canonicalize_url("not a url") == "not a url"
+    assert MetadataCache.key_for("https://youtu.be/abc123") == (watch, False)
+
+
+def test_entries_expire_and_least_recent_is_evicted(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(metadata_cache.time, "monotonic", lambda: clock[0])
+    cache = MetadataCache(ttl=10, max_entries=2)
+
+    cache.put("a", {"title": "a"})
+    cache.put("b", {"title": "b"})
+    assert cache.get("a") == {"title": "a"}  # b is now the least recent
+    cache.put("c", {"title": "c"})
+    assert cache.get("b") is None
+    assert cache.get("a") == {"title": "a"}
+
+    clock[0] += 11
+    assert cache.get("a") is None
+    stats = cache.stats()
+    assert stats["evictions"] == 1
+    assert stats["expired"] == 1
+    assert stats["entries"] == 1
+
+
+def test_oversized_values_are_not_cached():
+    cache = MetadataCache(max_bytes=50)
+    cache.put("big", {"description": "x" * 100})
+    assert cache.get("big") is None
+    assert cache.stats()["bytes"] == 0
+
+
+def test_concurrent_misses_load_once():
+    cache = MetadataCache()
+    calls = []
+
+    async def loader():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return {"title": "loaded"}
+
+    async def scenario():
+        results = await asyncio.gather(*[cache.get_or_load("k", loader) for _ in range(5)])
+        return results, await cache.get_or_load("k", loader)
+
+    results, again = asyncio.run(scenario())
+    assert results == [{"title": "loaded"}] * 5
+    assert again == {"title": "loaded"}
+    assert len(calls) == 1
+    stats = cache.stats()
+    assert stats["coalesced"] == 4
+    assert stats["inflight"] == 0
+
+
+def test_internal_peeks_do_not_count_and_loads_are_sized_off_the_loop(monkeypatch):
+    cache = MetadataCache()
+    sized_on = []
+    approx_size = metadata_cache._approx_size
+
+    def recording_size(value):
+        sized_on.append(threading.current_thread() is threading.main_thread())
+        return approx_size(value)
+
+    monkeypatch.setattr(metadata_cache, "_approx_size", recording_size)
+
+    async def loader():
+        return {"title": "loaded"}
+
+    assert cache.peek("k") is None
+    assert asyncio.run(cache.get_or_load("k", loader)) == {"title": "loaded"}
+    assert cache.peek("k") == {"title": "loaded"}
+    assert sized_on == [False]
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (0, 1)
+    assert stats["bytes"] == approx_size({"title": "loaded"})
@@ -0,0 +1,51 @@
+import threading
+
+from metrics import LOCK_BUCKETS, Registry, TimedLock
+
+
+def test_render_counters_histograms_and_gauges():
+    registry = Registry()
+    limited = registry.counter("t_rate_limited", "Rejected", ("endpoint",))
+    limited.labels("info").inc()
+    limited.labels("info").inc(2)
+    latency = registry.histogram("t_latency_seconds", "Latency", ("extractor",), buckets=(0.1, 1.0))
+    latency.labels("Generic").observe(0.05)
+    latency.labels("Generic").observe(0.5)
+    latency.labels("Generic").observe(5)
+    registry.gauge("t_queued", "Queued", lambda: 3)
+    registry.gauge("t_absent", "Not started yet", lambda: None)
+    assert registry.counter("t_rate_limited", "Rejected", ("endpoint",)) is limited
+
+    lines = registry.render().splitlines()
+    assert 't_rate_limited_total{endpoint="info"} 3' in lines
+    assert '# TYPE t_latency_seconds histogram' in lines
+    assert 't_latency_seconds_bucket{extractor="Generic",le="0.1"} 1' in lines
+    assert 't_latency_seconds_bucket{extractor="Generic",le="1"} 2' in lines
+    assert 't_latency_seconds_bucket{extractor="Generic",le="+Inf"} 3' in lines
+    assert 't_latency_seconds_sum{extractor="Generic"} 5.55' in lines
+    assert 't_latency_seconds_count{extractor="Generic"} 3' in lines
+    assert 't_queued 3' in lines
+    assert not any(line.startswith('# HELP t_absent') for line in lines)
+
+
+def test_timed_lock_records_wait_and_hold():
+    registry = Registry()
+    wait = registry.histogram("t_wait", "Wait", buckets=LOCK_BUCKETS)
+    hold = registry.histogram("t_hold", "Hold", buckets=LOCK_BUCKETS)
+    lock = TimedLock(wait, hold)
+    counter = [0]
+
+    def work():
+        for _ in range(1000):
+            with lock:
+                counter[0] += 1
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert counter[0] == 4000
+    assert wait.labels().counts[-1] + sum(wait.labels().counts[:-1]) == 4000
+    assert sum(hold.labels().counts) == 4000
+    assert not lock.locked()
@@ -0,0 +1,47 @@
+from playlist_jobs import PlaylistJob
+
+
+def test_rollup_tracks_bytes_and_derives_status():
+    job = PlaylistJob("p", {"url": "u", "playlist_items": "1-3"}, "ip:a")
+    for child in ("a", "b", "c"):
+        job.add_child(child)
+    job.expanded = True
+    assert job.status() == "pending"
+    assert job.total_bytes_estimate() is None
+
+    job.update("a", "downloading", 50, 100)
+    job.update("b", "downloading", 100, 300)
+    assert job.status() == "downloading"
+    assert job.downloaded_bytes == 150
+    # c has not reported a size yet, so it counts as the average of the known ones
+    assert job.total_bytes_estimate() == 600
+    assert job.progress() == 25.0
+
+    job.update("a", "completed", 100, 100)
+    job.update("b", "failed", 100, 300)
+    assert job.downloaded_bytes == 100
+    assert job.summary() == {"total": 3, "completed": 1, "failed": 1, "pending": 1}
+
+    job.update("c", "completed", 200, 200)
+    assert job.status() == "failed"
+
+    # Retrying the failed item reopens the playlist
+    job.update("b", "pending")
+    assert job.status() == "pending"
+    job.update("b", "completed", 300, 300)
+    assert job.status() == "completed"
+    assert job.progress() == 100.0
+
+
+def test_paused_and_cancelled_playlists():
+    job = PlaylistJob("p", {}, "ip:a")
+    job.add_child("a", "paused")
+    job.add_child("b", "paused")
+    assert job.status() == "pending"  # not expanded yet
+    job.expanded = True
+    assert job.status() == "paused"
+
+    job.update("a", "cancelled")
+    job.update("b", "cancelled")
+    assert job.status() == "cancelled"
+    assert job.active() == 0
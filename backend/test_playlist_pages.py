@@ -0,0 +1,80 @@
+import uuid
+
+import pytest
+import yt_dlp
+from fastapi.testclient import TestClient
+
+import main
+from rate_limit import RateLimiter
+
+client = TestClient(main.app)
+
+
+def _entry(i):
+    return {'id': f'v{i}', 'title': f'Video {i}', 'url': f'https://example.com/v{i}'}
+
+
+@pytest.fixture
+def playlist(monkeypatch):
+    """A 12-entry playlist served through timed_extract; records how much of it was resolved"""
+    seen = {'entries': 0, 'pages': []}
+
+    def entries():
+        for i in range(12):
+            seen['entries'] += 1
+            yield _entry(i)
+
+    def fetch_page(page):
+        seen['pages'].append(page)
+        return [_entry(i) for i in range(page * 4, min(page * 4 + 4, 12))]
+
+    def fake_extract(ydl, url, process=True, ie_key=None):
+        lazy = yt_dlp.utils.OnDemandPagedList(fetch_page, 4) if 'paged' in url else entries()
+        return {'_type': 'playlist', 'id': 'pl', 'title': 'List', 'entries': lazy}
+
+    monkeypatch.setattr(main, 'timed_extract', fake_extract)
+    monkeypatch.setattr(main, 'rate_limiter', RateLimiter({}))
+    monkeypatch.setattr(main, 'PLAYLIST_PAGE_MAX', 5)
+    return seen
+
+
+def test_page_bounds_are_clamped():
+    def bounds(offset, limit):
+        request = main.VideoInfoRequest(url='https://example.com/list', playlist_offset=offset, playlist_limit=limit)
+        return main.playlist_page_bounds(request)
+
+    assert bounds(-3, 10) == (0, 10)
+    assert bounds(20, 0) == (20, 1)
+    assert bounds(0, 10_000) == (0, main.PLAYLIST_PAGE_MAX)
+
+
+def test_only_the_requested_page_is_resolved(playlist):
+    page = main.extract_playlist_page('https://example.com/list', 2, 5)
+    assert [e['index'] for e in page['entries']] == [3, 4, 5, 6, 7]
+    assert page['has_more']
+    # The page plus one entry to know there is more
+    assert playlist['entries'] == 8
+
+    last = main.extract_playlist_page('https://example.com/list', 10, 5)
+    assert [e['index'] for e in last['entries']] == [11, 12]
+    assert not last['has_more']
+
+    paged = main.extract_playlist_page('https://example.com/paged', 4, 3)
+    assert [e['id'] for e in paged['entries']] == ['v4', 'v5', 'v6']
+    assert paged['has_more']
+    assert playlist['pages'] == [1]
+
+
+def test_info_reports_the_clamped_page_and_whether_more_follow(playlist):
+    url = f'https://example.com/list?run={uuid.uuid4().hex}'
+    first = client.post('/info', json={'url': url, 'playlist_info': True,
+                                       'playlist_offset': -1, 'playlist_limit': 100}).json()
+    assert first['playlist_offset'] == 0
+    assert len(first['playlist_entries']) == 5
+    assert first['playlist_has_more']
+
+    last = client.post('/info', json={'url': url, 'playlist_info': True,
+                                      'playlist_offset': 10, 'playlist_limit': 5}).json()
+    assert [e['index'] for e in last['playlist_entries']] == [11, 12]
+    assert not last['playlist_has_more']
+    assert last['playlist_count'] == 12
@@ -0,0 +1,106 @@
+import pytest
+from process_pool import DownloadProcessPool, WorkerCrashed
+
+# A yt-dlp stand-in the workers import from their runtime path. The file the
+# post hook reports is "<runtime>:<pid>", so tests can tell which worker ran a job.
+_FAKE_YT_DLP = """
+import os, time, types
+
+class DownloadError(Exception):
+    pass
+
+class DownloadCancelled(Exception):
+    pass
+
+utils = types.SimpleNamespace(DownloadCancelled=DownloadCancelled)
+extractor = types.SimpleNamespace(gen_extractor_classes=lambda: [])
+
+class YoutubeDL:
+    def __init__(self, params):
+        self.params = params
+    def __enter__(self):
+        return self
+    def __exit__(self, *exc):
+        pass
+    @staticmethod
+    def sanitize_info(info, remove_private_keys=False):
+        return info
+    def download(self, urls):
+        url = urls[0]
+        if url == 'crash':
+            os._exit(3)
+        if url == 'fail':
+            raise DownloadError('no formats')
+        for i in range(500 if url == 'slow' else 1):
+            self.params['progress_hooks'][0]({'status': 'downloading', 'downloaded_bytes': i, 'info_dict': {}})
+            time.sleep(0.01)
+        self.params['post_hooks'][0](f'{RUNTIME}:{os.getpid()}')
+"""
+
+
+def _runtime(root, name):
+    package = root / name / "yt_dlp"
+    package.mkdir(parents=True)
+    (package / "__init__.py").write_text(f"RUNTIME = {name!r}\n" + _FAKE_YT_DLP)
+    return str(root / name)
+
+
+def _run(pool, url, **callbacks):
+    files = []
+    pool.run(url, {}, on_file=files.append, **callbacks)
+    return files[0].split(":")
+
+
+@pytest.fixture
+def runtimes(tmp_path):
+    return _runtime(tmp_path, "old"), _runtime(tmp_path, "new")
+
+
+def test_crashed_worker_fails_only_its_job_and_workers_are_recycled(runtimes):
+    pool = DownloadProcessPool(size=1, max_jobs_per_worker=2, max_memory_mb=0, runtime_path=runtimes[0])
+    try:
+        _, first = _run(pool, "ok")
+        assert _run(pool, "ok")[1] == first
+        # Two jobs done: the next one gets a fresh process
+        _, second = _run(pool, "ok")
+        assert second != first
+        assert pool.stats()["recycled"] == 1
+
+        with pytest.raises(WorkerCrashed, match="exit code 3"):
+            _run(pool, "crash")
+        with pytest.raises(Exception, match="no formats"):
+            _run(pool, "fail")
+        assert _run(pool, "ok")[1] not in (first, second)
+        stats = pool.stats()
+        assert stats["crashes"] == 1
+        assert stats["jobs"] == 6
+        assert stats["busy"] == 0
+    finally:
+        pool.shutdown()
+
+
+def test_hook_errors_abort_the_job_and_runtime_switch_retires_workers(runtimes):
+    pool = DownloadProcessPool(size=1, max_memory_mb=0, runtime_path=runtimes[0])
+    seen = []
+
+    def stop_after_three(d):
+        seen.append(d["downloaded_bytes"])
+        if len(seen) == 3:
+            raise KeyError("stop")
+
+    try:
+        runtime, pid = _run(pool, "ok")
+        assert runtime == "old"
+        with pytest.raises(KeyError):
+            pool.run("slow", {}, on_progress=stop_after_three)
+        # The worker stopped early and stays in service
+        assert len(seen) < 10
+        assert _run(pool, "ok") == ["old", pid]
+
+        pool.set_runtime(runtimes[1])
+        runtime, new_pid = _run(pool, "ok")
+        assert (runtime, new_pid != pid) == ("new", True)
+        assert pool.stats()["runtime_switches"] == 1
+        assert pool.stats()["crashes"] == 0
+    finally:
+        pool.shutdown()
@@ -0,0 +1,22 @@
+from progress import SpeedMeter, format_bytes, format_eta, format_speed, progress_numbers
+
+
+def test_speed_meter_smooths_and_resets_between_files():
+    meter = SpeedMeter(time_constant=1.0)
+    assert meter.update(0, now=0.0) is None
+    assert meter.update(1000, now=1.0) == 1000.0
+    # A burst only moves the average part of the way
+    speed = meter.update(4000, now=2.0)
+    assert 1000.0 < speed < 3000.0
+    # Byte count going backwards is the next file starting; keep the estimate
+    assert meter.update(100, now=2.5) == speed
+
+
+def test_progress_numbers_and_display_strings():
+    assert progress_numbers(250, 1000, 50.0) == (25.0, 15.0)
+    assert progress_numbers(250, None, 50.0) == (0.0, None)
+    assert progress_numbers(250, 1000, None) == (25.0, None)
+    assert format_bytes(512) == "512B"
+    assert format_speed(1.5 * 1024 * 1024) == "1.50MiB/s"
+    assert format_eta(150) == "00:02:30"
+    assert format_eta(None) is None
@@ -0,0 +1,68 @@
+import asyncio
+import threading
+
+import pytest
+from fastapi import HTTPException, Request, Response
+
+import main
+from cluster import MemoryBackend
+from rate_limit import RateLimiter, SharedRateLimiter, parse_limits
+
+
+def test_sliding_window_limits_and_reports_retry_after():
+    limiter = RateLimiter(parse_limits("info=3/10"))
+    results = [limiter.check("info", "ip:a", now=100.0 + i) for i in range(4)]
+
+    assert [r.allowed for r in results] == [True, True, True, False]
+    assert results[2].remaining == 0
+    assert results[3].headers()["Retry-After"] == "11"
+    assert limiter.check("info", "ip:b", now=103.0).allowed
+    assert limiter.check("search", "ip:a") is None
+
+    # Halfway into the next window the previous window counts for half
+    assert limiter.check("info", "ip:a", now=115.0).allowed
+
+
+def test_idle_keys_are_evicted():
+    limiter = RateLimiter(parse_limits("info=5/10"), max_keys=2)
+    for i in range(3):
+        limiter.check("info", f"ip:{i}", now=100.0)
+    assert limiter.stats()["limits"]["info"]["keys"] == 2
+
+    limiter.check("info", "ip:late", now=130.0)
+    assert limiter.stats()["limits"]["info"]["keys"] == 1
+
+
+def test_shared_limiter_counts_across_processes():
+    backend = MemoryBackend()
+    nodes = [SharedRateLimiter(parse_limits("info=3/10"), backend) for _ in range(2)]
+    results = [nodes[i % 2].check("info", "ip:a", now=100.0 + i) for i in range(4)]
+
+    assert [r.allowed for r in results] == [True, True, True, False]
+    assert results[2].remaining == 0
+    assert results[3].headers()["Retry-After"] == "11"
+    assert nodes[1].check("search", "ip:a") is None
+    assert nodes[0].check("info", "ip:a", now=115.0).allowed
+
+
+def test_shared_limit_is_checked_off_the_event_loop(monkeypatch):
+    limiter = SharedRateLimiter(parse_limits("search=1/60"), MemoryBackend())
+    check, threads = limiter.check, []
+
+    def recording_check(*args, **kwargs):
+        threads.append(threading.get_ident())
+        return check(*args, **kwargs)
+
+    monkeypatch.setattr(limiter, "check", recording_check)
+    monkeypatch.setattr(main, "rate_limiter", limiter)
+    request = Request({"type": "http", "headers": [], "query_string": b"", "client": ("10.0.0.1", 1)})
+
+    async def scenario():
+        await main.enforce_rate_limit(request, Response(), "search")
+        with pytest.raises(HTTPException) as rejected:
+            await main.enforce_rate_limit(request, Response(), "search")
+        assert rejected.value.status_code == 429
+        return threading.get_ident()
+
+    loop_thread = asyncio.run(scenario())
+    assert len(threads) == 2 and loop_thread not in threads
@@ -0,0 +1,133 @@
+import asyncio
+
+from scheduler import DownloadScheduler
+
+
+def _job(download_id, url="https://example.com/v"):
+    return (download_id, url, {})
+
+
+def _drain(scheduler, count):
+    async def run():
+        order = []
+        for _ in range(count):
+            job = await scheduler.get()
+            order.append(job[0])
+            scheduler.task_done(job)
+        return order
+    return asyncio.run(run())
+
+
+def test_backlogged_client_does_not_starve_others():
+    scheduler = DownloadScheduler(concurrency=1)
+    for i in range(5):
+        scheduler.put_nowait(_job(f"bulk-{i}"), client_key="key:bulk")
+    scheduler.put_nowait(_job("small-0"), client_key="key:small")
+    scheduler.put_nowait(_job("small-1"), client_key="key:small")
+
+    assert _drain(scheduler, 7)[:4] == ["bulk-0", "small-0", "bulk-1", "small-1"]
+
+
+def test_priority_orders_jobs_within_a_client():
+    scheduler = DownloadScheduler(concurrency=1)
+    scheduler.put_nowait(_job("low"), client_key="a")
+    scheduler.put_nowait(_job("high"), client_key="a", priority=5)
+
+    assert _drain(scheduler, 2) == ["high", "low"]
+
+
+def test_per_host_cap_skips_to_another_host():
+    scheduler = DownloadScheduler(concurrency=2, max_per_host=1)
+    scheduler.put_nowait(_job("a1", "https://a.example/1"), client_key="c")
+    scheduler.put_nowait(_job("a2", "https://a.example/2"), client_key="c")
+    scheduler.put_nowait(_job("b1", "https://b.example/1"), client_key="c")
+
+    async def run():
+        first = await scheduler.get()
+        second = await scheduler.get()
+        return first[0], second[0]
+
+    assert asyncio.run(run()) == ("a1", "b1")
+    assert scheduler.position("a2")[0] == 0
+
+
+def test_position_counts_other_clients_fair_share():
+    scheduler = DownloadScheduler(concurrency=1)
+    for i in range(10):
+        scheduler.put_nowait(_job(f"bulk-{i}"), client_key="bulk")
+    scheduler.put_nowait(_job("mine"), client_key="me")
+
+    position, _ = scheduler.position("mine")
+    assert position <= 2
+    assert scheduler.remove("mine")
+    assert scheduler.position("mine") is None
+
+
+def test_group_cap_limits_one_playlists_parallelism():
+    scheduler = DownloadScheduler(concurrency=3, max_per_group=2)
+    for i in range(3):
+        scheduler.put_nowait(_job(f"p-{i}", f"https://a.example/{i}"), client_key="c", group="playlist")
+    scheduler.put_nowait(_job("single", "https://b.example/1"), client_key="c")
+
+    async def run():
+        return [(await scheduler.get())[0] for _ in range(3)]
+
+    assert asyncio.run(run()) == ["p-0", "p-1", "single"]
+
+
+def test_put_many_queues_jobs_in_order_with_their_priorities():
+    scheduler = DownloadScheduler(concurrency=1)
+    scheduler.put_many([
+        (_job("first"), "c", 0, None),
+        (_job("urgent"), "c", 5, None),
+        (_job("second"), "c", 0, None),
+    ])
+
+    assert scheduler.stats()["queued"] == 3
+    assert _drain(scheduler, 3) == ["urgent", "first", "second"]
+
+
+def test_queuing_a_job_again_replaces_its_entry():
+    scheduler = DownloadScheduler(concurrency=2)
+    scheduler.put_nowait(_job("again"), client_key="c", group="playlist")
+    scheduler.put_nowait(_job("other"), client_key="c")
+    scheduler.put_nowait(_job("again"), client_key="c", priority=5, group="playlist")
+    assert scheduler.qsize() == 2
+
+    async def run():
+        first = await scheduler.get()
+        # Queued again while running (e.g. requeued by a resume), then dispatched once more
+        scheduler.put_nowait(first, client_key="c", group="playlist")
+        assert (await scheduler.get())[0] == "other"
+        assert (await scheduler.get())[0] == "again"
+        return first
+
+    first = asyncio.run(run())
+    assert first[0] == "again"
+    scheduler.task_done(first)
+    scheduler.task_done(_job("other"))
+    stats = scheduler.stats()
+    assert stats["replaced"] == 1
+    assert stats["running"] == 0
+    assert stats["running_per_host"] == {}
+    assert stats["running_groups"] == 0
+
+
+def test_bandwidth_budget_is_split_over_the_running_jobs():
+    scheduler = DownloadScheduler(concurrency=4, bandwidth_limit=1000)
+    capped = ("capped", "https://example.com/c", {"ratelimit": 200})
+    scheduler.put_many([(_job("a"), "c", 0, None), (_job("b"), "c", 0, None), (capped, "c", 0, None)])
+
+    async def run():
+        return [await scheduler.get() for _ in range(3)]
+
+    a, b, capped = asyncio.run(run())
+    assert scheduler.bandwidth_share() == 333
+    assert [job[2]["ratelimit"] for job in (a, b, capped)] == [333, 333, 200]
+
+    scheduler.task_done(a)
+    # The jobs still running are sped up, and a finished one loses its share
+    assert b[2]["ratelimit"] == 500 and capped[2]["ratelimit"] == 200
+    assert "ratelimit" not in a[2]
+    scheduler.task_done(capped)
+    assert b[2]["ratelimit"] == 1000 and capped[2]["ratelimit"] == 200
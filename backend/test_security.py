@@ -2,6 +2,7 @@
 import pytest
 from fastapi.testclient import TestClient
 from main import app, download_tasks, DOWNLOADS_DIR
+from task_record import TaskRecord
 import os
 from pathlib import Path
 import shutil
@@ -28,13 +29,13 @@ def test_path_traversal_vulnerability():
     # This filename attempts to traverse up from the 'downloads' directory
     malicious_filename = str(Path.cwd() / "test_secret_file.txt")
 
-    download_tasks[malicious_download_id] = {
-        'id': malicious_download_id,
-        'status': 'completed',
-        'filename': malicious_filename,
-        'created_at': '2025-01-01T00:00:00',
-        'updated_at': '2025-01-01T00:00:00'
-    }
+    download_tasks[malicious_download_id] = TaskRecord(
+        malicious_download_id,
+        'https://example.com/video',
+        'completed',
+        created_at=1735689600.0,
+        filename=malicious_filename,
+    )
 
     # 2. Attempt to access the file using the vulnerable endpoint
     response = client.get(f"/file/{malicious_download_id}")
@@ -0,0 +1,127 @@
+import sqlite3
+from datetime import datetime
+
+import pytest
+from storage import DownloadStore
+from task_record import TaskRecord, TaskStatus
+
+
+def _task(task_id, status='pending', progress=0.0):
+    return TaskRecord(task_id, 'https://example.com/video', status,
+                      created_at=datetime(2025, 1, 1).timestamp(), progress=progress)
+
+
+def _rows(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        return {r[0]: r for r in conn.execute("SELECT id, status, progress FROM downloads")}
+    finally:
+        conn.close()
+
+
+@pytest.fixture
+def store(tmp_path):
+    s = DownloadStore(str(tmp_path / "downloads.db"), flush_interval=3600, flush_threshold=100)
+    s.start()
+    yield s
+    s.close()
+
+
+def test_progress_updates_are_coalesced_until_flush(store):
+    task = _task('a')
+    for progress in (1.0, 2.0, 3.0):
+        task.progress = progress
+        store.mark_dirty(task)
+
+    assert store.pending() == 1
+    assert _rows(store.db_path) == {}
+
+    assert store.flush() == 1
+    assert _rows(store.db_path)['a'][2] == 3.0
+
+
+def test_durable_update_is_written_immediately(store):
+    store.mark_dirty(_task('a', status='downloading'))
+    store.mark_dirty(_task('b', status='completed', progress=100.0), durable=True)
+
+    rows = _rows(store.db_path)
+    assert rows['a'][1] == 'downloading'
+    assert rows['b'][1] == 'completed'
+    assert store.pending() == 0
+
+
+def test_close_flushes_pending_rows(tmp_path):
+    db_path = str(tmp_path / "downloads.db")
+    store = DownloadStore(db_path, flush_interval=3600)
+    store.start()
+    store.mark_dirty(_task('a', status='downloading', progress=42.0))
+    store.close()
+
+    reopened = DownloadStore(db_path)
+    try:
+        assert reopened.load_all()['a'].progress == 42.0
+    finally:
+        reopened.close()
+
+
+def test_query_pages_with_cursor_and_filters(store):
+    for i in range(5):
+        task = _task(f"t{i}", status='completed' if i % 2 else 'failed')
+        task.created_at = datetime(2025, 1, i + 1).timestamp()
+        task.url = f"https://example.com/{'a' if i < 3 else 'b'}/{i}"
+        store.mark_dirty(task)
+    # Queries read committed rows only
+    assert store.query()[0] == []
+    store.flush()
+
+    first, cursor = store.query(limit=2)
+    second, cursor = store.query(limit=2, cursor=cursor)
+    third, cursor = store.query(limit=2, cursor=cursor)
+    assert [t.id for t in first + second + third] == ['t4', 't3', 't2', 't1', 't0']
+    assert cursor is None
+
+    completed, _ = store.query(statuses=['completed'], descending=False)
+    assert [t.id for t in completed] == ['t1', 't3']
+
+    ranged, _ = store.query(created_after="2025-01-02", created_before="2025-01-04",
+                            url_prefix="https://example.com/a/")
+    assert [t.id for t in ranged] == ['t2', 't1']
+
+
+def test_load_active_skips_finished_tasks(store):
+    store.mark_dirty(_task('running', status='downloading'))
+    store.mark_dirty(_task('done', status='completed'), durable=True)
+
+    assert list(store.load_active()) == ['running']
+    assert store.get('done').status is TaskStatus.COMPLETED
+    assert store.delete_terminal() == ['done']
+
+
+def test_count_is_read_once_then_kept_current(store):
+    store.mark_dirty(_task('old', status='completed'), durable=True)
+    assert store.count() == 1
+
+    store.mark_dirty_many([_task('a'), _task('b')], new=True)
+    store.mark_dirty(_task('a', progress=50.0))
+    assert store.count() == 3
+    store.delete_terminal()
+    assert store.count() == 2
+
+
+def test_job_options_survive_a_restart_until_cleared(tmp_path):
+    db = str(tmp_path / "downloads.db")
+    first = DownloadStore(db, flush_interval=3600)
+    first.start()
+    options = {'url': 'https://example.com/video', 'ydl_opts': {'format': 'best'}, 'priority': 1}
+    first.mark_dirty_many([_task('a'), _task('b')], options={'a': options})
+    first.mark_dirty(_task('c', status='completed'), options=options)
+    first.close()
+
+    second = DownloadStore(db)
+    try:
+        assert list(second.load_active()) == ['a', 'b']
+        assert second.load_options(['a', 'b', 'c']) == {'a': options, 'c': options}
+        second.delete_terminal()
+        assert second.load_options(['a', 'c']) == {'a': options}
+    finally:
+        second.close()
@@ -0,0 +1,46 @@
+from datetime import datetime
+
+import pytest
+from task_record import TaskRecord, TaskStatus, TaskTable
+
+
+def test_status_is_interned_and_validated():
+    task = TaskRecord('a', 'https://example.com/video', created_at=0.0)
+    task.status = 'downloading'
+    assert task.status is TaskStatus.DOWNLOADING
+    assert task.status == 'downloading'
+    with pytest.raises(ValueError):
+        task.status = 'exploded'
+    assert not hasattr(task, '__dict__')
+
+
+def test_to_json_formats_at_the_edge():
+    created = datetime(2025, 1, 2, 3, 4, 5).timestamp()
+    task = TaskRecord('a', 'https://example.com/video', 'downloading', created_at=created,
+                      speed=2048.0, eta=90.0)
+    view = task.to_json()
+    assert view['status'] == 'downloading' and type(view['status']) is str
+    assert view['speed'] == '2.00KiB/s' and view['speed_bps'] == 2048.0
+    assert view['eta'] == '00:01:30'
+    assert view['created_at'] == view['updated_at'] == '2025-01-02T03:04:05'
+
+
+def test_task_table_counts_follow_status_changes():
+    tasks = TaskTable({'a': TaskRecord('a', 'u'), 'b': TaskRecord('b', 'u', 'downloading')})
+    assert tasks.counts.get('pending') == 1 and tasks.counts.get('downloading') == 1
+
+    tasks['a'].status = 'downloading'
+    tasks['b'].status = 'completed'
+    assert tasks.counts.snapshot()['downloading'] == 1
+    assert tasks.counts.get('completed') == 1
+
+    # Replaced, removed and copied records stop counting
+    tasks['a'] = TaskRecord('a', 'u', 'paused')
+    removed = tasks.pop('b')
+    removed.status = 'failed'
+    tasks['a'].copy().status = 'failed'
+    assert tasks.counts.snapshot() == {
+        'pending': 0, 'downloading': 0, 'paused': 1, 'completed': 0, 'failed': 0, 'cancelled': 0,
+    }
+    del tasks['a']
+    assert sum(tasks.counts.snapshot().values()) == 0
@@ -0,0 +1,92 @@
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from version_service import VersionService
+
+INDEX = {
+    "info": {"version": "2099.1.1"},
+    "releases": {"2099.1.1": [{"packagetype": "sdist", "digests": {"sha256": "abc"}}]},
+}
+
+
+class _Index(BaseHTTPRequestHandler):
+    hits = []
+
+    def do_GET(self):
+        self.hits.append(self.headers.get("If-None-Match"))
+        if self.headers.get("If-None-Match") == '"v1"':
+            self.send_response(304)
+            self.end_headers()
+            return
+        body = json.dumps(INDEX).encode()
+        self.send_response(200)
+        self.send_header("ETag", '"v1"')
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_refresh_caches_with_etag_and_persists(tmp_path):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Index)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/yt-dlp/json"
+    cache = tmp_path / "version_cache.json"
+    try:
+        service = VersionService(index_url=url, cache_path=str(cache), ttl=60)
+        assert service.snapshot()["latest_version"] == "unknown"
+
+        snapshot = asyncio.run(service.refresh())
+        assert snapshot["latest_version"] == "2099.1.1"
+        assert snapshot["update_available"]
+        assert service.latest() == ("2099.1.1", "abc")
+
+        # Fresh: no request; forced: conditional request answered with 304
+        asyncio.run(service.refresh())
+        asyncio.run(service.refresh(max_age=0))
+        assert _Index.hits == [None, '"v1"']
+        assert service.stats()["not_modified"] == 1
+
+        # A new process starts from the persisted answer without asking the index
+        reloaded = VersionService(index_url=url, cache_path=str(cache), ttl=60)
+        assert reloaded.latest() == ("2099.1.1", "abc")
+        assert not reloaded.is_stale()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_unreachable_index_keeps_last_known_answer(tmp_path):
+    cache = tmp_path / "version_cache.json"
+    cache.write_text(json.dumps({"index_url": "http://127.0.0.1:9/", "latest_version": "2099.1.1", "checked_at": 0}))
+    service = VersionService(index_url="http://127.0.0.1:9/", cache_path=str(cache), ttl=60, timeout=1)
+
+    snapshot = asyncio.run(service.refresh())
+    assert snapshot["latest_version"] == "2099.1.1"
+    assert snapshot["error"]
+    # Backs off instead of retrying on every read
+    assert not service.is_stale()
+
+
+def test_version_installed_for_the_next_restart_is_not_offered_again(tmp_path):
+    cache = tmp_path / "version_cache.json"
+    cache.write_text(json.dumps({"index_url": "http://127.0.0.1:9/", "latest_version": "2099.1.1",
+                                 "checked_at": 1e12}))
+    service = VersionService(index_url="http://127.0.0.1:9/", cache_path=str(cache))
+    service.refresh_current("2024.1.1")
+    assert service.snapshot()["update_available"]
+
+    service.mark_installed("2099.1.1")
+    snapshot = service.snapshot()
+    assert snapshot["current_version"] == "2024.1.1"
+    assert snapshot["pending_version"] == "2099.1.1"
+    assert not snapshot["update_available"]
+
+    # Switching over in-process clears it
+    service.refresh_current("2099.1.1")
+    assert service.snapshot()["pending_version"] is None
+    assert not service.snapshot()["update_available"]
@@ -0,0 +1,67 @@
+import asyncio
+import time
+
+import ws_fanout
+from ws_fanout import EventHub, Subscriber
+
+
+def test_subscriber_keeps_only_the_latest_event_per_download():
+    sub = Subscriber(ws=None, ids=["a", "b", "c"], max_pending=2)
+    sub.offer({"id": "a", "progress": 1})
+    sub.offer({"id": "b", "progress": 1})
+    sub.offer({"id": "a", "progress": 2})
+    sub.offer({"id": "other", "progress": 1})
+    assert list(sub.pending.items()) == [("b", {"id": "b", "progress": 1}), ("a", {"id": "a", "progress": 2})]
+    assert sub.coalesced == 1
+
+    sub.offer({"id": "c", "progress": 1})
+    assert list(sub.pending) == ["a", "c"]
+    assert sub.dropped == 1
+
+
+def test_progress_is_throttled_per_download_and_terminal_events_pass():
+    published = []
+    hub = EventHub(max_rate=20, render=lambda event: published.append(event) or event)
+
+    async def scenario():
+        hub.bind(asyncio.get_running_loop())
+        for progress in (1, 2, 3):
+            hub.publish_threadsafe({"id": "d1", "progress": progress})
+        hub.publish_threadsafe({"id": "d2", "progress": 1})
+        await asyncio.sleep(0.01)
+        assert published == [{"id": "d1", "progress": 1}, {"id": "d2", "progress": 1}]
+
+        # The newest throttled event goes out once the window opens
+        await asyncio.sleep(0.1)
+        assert published[-1] == {"id": "d1", "progress": 3}
+
+        hub.publish_threadsafe({"id": "d1", "progress": 4})
+        hub.publish_threadsafe({"id": "d1", "progress": 5})
+        hub.publish_threadsafe({"id": "d1", "status": "completed"}, terminal=True)
+        await asyncio.sleep(0.1)
+
+    asyncio.run(scenario())
+    assert published[-1] == {"id": "d1", "status": "completed"}
+    # The terminal event replaces the throttled progress that was waiting
+    assert {"id": "d1", "progress": 5} not in published
+    assert hub.stats()["throttled"] == 3
+    assert hub.stats()["throttled_downloads"] == 1  # d2 never finished
+
+
+def test_throttle_state_is_dropped_for_finished_and_stale_downloads():
+    hub = EventHub(max_rate=1000)
+
+    async def scenario():
+        hub.bind(asyncio.get_running_loop())
+        hub.publish_threadsafe({"id": "removed"})
+        hub.forget("removed")
+        assert hub.stats()["throttled_downloads"] == 0
+
+        for i in range(ws_fanout.PRUNE_MIN):
+            hub.publish_threadsafe({"id": f"d{i}"})
+        time.sleep(0.01)
+        hub.publish_threadsafe({"id": "latest"})
+        await asyncio.sleep(0)
+
+    asyncio.run(scenario())
+    assert hub.stats()["throttled_downloads"] == 1
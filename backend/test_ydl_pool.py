@@ -0,0 +1,18 @@
+from ydl_pool import YoutubeDLPool
+
+
+def test_instances_are_reused_with_overrides_restored():
+    pool = YoutubeDLPool({'flat': {'quiet': True, 'extract_flat': 'in_playlist'}}, max_idle=1, max_uses=2)
+
+    with pool.checkout('flat', playlist_items='1-3') as first:
+        assert first.params['playlist_items'] == '1-3'
+    with pool.checkout('flat') as second:
+        assert second is first
+        assert 'playlist_items' not in second.params
+        assert second.params['extract_flat'] == 'in_playlist'
+
+    # Past max_uses the instance is closed and the next checkout builds a new one
+    with pool.checkout('flat') as third:
+        assert third is not first
+    stats = pool.stats()
+    assert (stats['created'], stats['reused'], stats['recycled']) == (2, 1, 1)
@@ -0,0 +1,48 @@
+import json
+
+import pytest
+from ytdlp_runtime import RuntimeInstallError, RuntimeStore
+
+
+def _fake_pip(init_source):
+    """Stands in for pip: lays out a yt-dlp 'install' in the staging directory"""
+    def install(requirement, staging):
+        version = requirement.split("==")[1]
+        package = staging / "yt_dlp"
+        package.mkdir(parents=True)
+        (package / "__init__.py").write_text(init_source)
+        dist_info = staging / f"yt_dlp-{version}.dist-info"
+        dist_info.mkdir()
+        (dist_info / "METADATA").write_text(f"Metadata-Version: 2.1\nName: yt-dlp\nVersion: {version}\n")
+    return install
+
+
+_WORKING = """
+import types
+class YoutubeDL:
+    def __init__(self, params): pass
+    def __enter__(self): return self
+    def __exit__(self, *exc): pass
+extractor = types.SimpleNamespace(gen_extractor_classes=lambda: [])
+"""
+
+
+def test_candidate_is_activated_only_after_smoke_test(tmp_path, monkeypatch):
+    store = RuntimeStore(str(tmp_path))
+    monkeypatch.setattr(store, "_pip_install", _fake_pip(_WORKING))
+
+    state = store.install("2099.1.1")
+    assert state["version"] == "2099.1.1"
+    assert store.active_path() == state["path"]
+    assert json.loads((tmp_path / "current.json").read_text())["previous"] is None
+
+    # A candidate that cannot even be imported is discarded; the active runtime stays
+    monkeypatch.setattr(store, "_pip_install", _fake_pip("raise ImportError('broken build')"))
+    with pytest.raises(RuntimeInstallError, match="broken build"):
+        store.install("2099.2.2")
+    assert store.active_path() == state["path"]
+    assert sorted(p.name for p in tmp_path.iterdir()) == sorted(["current.json", state["path"].split("/")[-1]])
+    assert store.stats()["rolled_back"] == 1
+
+    # Same version again is a no-op
+    assert store.install("2099.1.1") == store.active()
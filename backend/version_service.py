@@ -0,0 +1,223 @@
+"""
+yt-dlp version lookups shared by the API and the auto-updater
+The latest release is fetched from the package index with a non-blocking
+HTTP client and kept, with its ETag, in a small JSON cache file. Readers
+always get the last known answer straight away; a stale answer triggers
+one background revalidation (stale-while-revalidate).
+"""
+
+import asyncio
+import json
+import os
+import threading
+import time
+from importlib import metadata
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+import httpx
+from loguru import logger
+
+DEFAULT_INDEX_URL = "https://pypi.org/pypi/yt-dlp/json"
+
+
+def installed_version(distribution: str = "yt-dlp") -> str:
+    """Version of the installed distribution, or "unknown" """
+    try:
+        return metadata.version(distribution)
+    except metadata.PackageNotFoundError:
+        try:
+            import yt_dlp.version
+            return yt_dlp.version.__version__
+        except Exception:
+            return "unknown"
+
+
+class VersionService:
+    """Cached current/latest yt-dlp versions with background revalidation"""
+
+    def __init__(self, index_url: str = DEFAULT_INDEX_URL, cache_path: Optional[str] = None,
+                 ttl: float = 1800, timeout: float = 10):
+        self.index_url = index_url
+        self.cache_path = Path(cache_path) if cache_path else None
+        self.ttl = ttl
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self._current: Optional[str] = None
+        # Installed but only used after a restart (thread downloads share this process's yt-dlp)
+        self._pending: Optional[str] = None
+        # After a failed fetch, stale reads wait this long before trying again
+        self.retry_interval = min(ttl, 60)
+        self._retry_after = 0.0
+        self._state: Dict[str, Any] = {
+            "latest_version": "unknown",
+            "sha256": None,
+            "etag": None,
+            "checked_at": 0.0,
+            "error": None,
+        }
+        self._counters = {
+            "fetches": 0,
+            "not_modified": 0,
+            "failures": 0,
+        }
+        self._load()
+
+    def _load(self):
+        if self.cache_path is None or not self.cache_path.exists():
+            return
+        try:
+            with open(self.cache_path, "r") as f:
+                cached = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable version cache {self.cache_path}: {e}")
+            return
+        if cached.get("index_url") != self.index_url:
+            return
+        for key in ("latest_version", "sha256", "etag", "checked_at"):
+            if key in cached:
+                self._state[key] = cached[key]
+
+    def _save(self):
+        if self.cache_path is None:
+            return
+        with self._lock:
+            cached = {"index_url": self.index_url, **self._state}
+        cached.pop("error", None)
+        try:
+            self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.cache_path.with_suffix(self.cache_path.suffix + ".tmp")
+            with open(tmp, "w") as f:
+                json.dump(cached, f, indent=2)
+            os.replace(tmp, self.cache_path)
+        except OSError as e:
+            logger.error(f"Failed to save version cache: {e}")
+
+    def current_version(self) -> str:
+        """Installed yt-dlp version, read once and cached until refresh_current()"""
+        if self._current is None:
+            self._current = installed_version()
+        return self._current
+
+    def refresh_current(self, version: Optional[str] = None) -> str:
+        """Re-read the installed version after an upgrade, or set the one downloads now run on"""
+        self._current = version
+        self._pending = None
+        return self.current_version()
+
+    def mark_installed(self, version: str):
+        """Record a version installed for the next restart, so it is no longer offered as an update"""
+        self._pending = version
+
+    def is_stale(self, max_age: Optional[float] = None) -> bool:
+        if time.time() < self._retry_after:
+            return False
+        max_age = self.ttl if max_age is None else max_age
+        return time.time() - self._state["checked_at"] >= max_age
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Last known versions; never touches the network"""
+        current = self.current_version()
+        pending = self._pending
+        with self._lock:
+            latest = self._state["latest_version"]
+            return {
+                "current_version": current,
+                "latest_version": latest,
+                "update_available": latest != "unknown" and latest not in (current, pending),
+                "pending_version": pending,
+                "last_check": self._state["checked_at"],
+                "stale": time.time() - self._state["checked_at"] >= self.ttl,
+                "refreshing": self._refreshing,
+                "error": self._state["error"],
+            }
+
+    def latest(self) -> Tuple[str, Optional[str]]:
+        """Last known latest version and its sdist SHA256"""
+        with self._lock:
+            return self._state["latest_version"], self._state["sha256"]
+
+    async def refresh(self, max_age: Optional[float] = None) -> Dict[str, Any]:
+        """Revalidate against the index if the cache is older than max_age, then return snapshot()
+
+        Only one refresh runs at a time; concurrent callers get the current
+        snapshot instead of waiting for it.
+        """
+        if not self.is_stale(max_age):
+            return self.snapshot()
+        with self._lock:
+            busy = self._refreshing
+            self._refreshing = True
+            etag = self._state["etag"]
+        if busy:
+            return self.snapshot()
+        try:
+            await self._fetch(etag)
+        finally:
+            with self._lock:
+                self._refreshing = False
+        return self.snapshot()
+
+    def revalidate(self, max_age: Optional[float] = None) -> Optional[asyncio.Task]:
+        """Schedule refresh() on the running loop when the cache is stale; returns at once"""
+        if not self.is_stale(max_age) or self._refreshing:
+            return None
+        return asyncio.get_running_loop().create_task(self.refresh(max_age))
+
+    async def _fetch(self, etag: Optional[str]):
+        headers = {"Accept": "application/json"}
+        if etag:
+            headers["If-None-Match"] = etag
+        try:
+            # A client per refresh: the auto-updater thread runs its own event loop
+            async with httpx.AsyncClient(timeout=self.timeout, follow_redirects=True) as client:
+                response = await client.get(self.index_url, headers=headers)
+            if response.status_code == 304:
+                with self._lock:
+                    self._state["checked_at"] = time.time()
+                    self._state["error"] = None
+                    self._counters["not_modified"] += 1
+            else:
+                response.raise_for_status()
+                version, sha256 = self._parse(response.json())
+                with self._lock:
+                    self._state.update(
+                        latest_version=version,
+                        sha256=sha256,
+                        etag=response.headers.get("etag"),
+                        checked_at=time.time(),
+                        error=None,
+                    )
+                    self._counters["fetches"] += 1
+                logger.info(f"yt-dlp version check: current={self.current_version()}, latest={version}")
+        except (httpx.HTTPError, ValueError, KeyError, TypeError) as e:
+            # Keep serving the last known answer, and retry on the next stale read
+            reason = str(e) or type(e).__name__
+            logger.error(f"Failed to get latest yt-dlp version: {reason}")
+            with self._lock:
+                self._state["error"] = reason
+                self._retry_after = time.time() + self.retry_interval
+                self._counters["failures"] += 1
+            return
+        self._save()
+
+    @staticmethod
+    def _parse(data: Dict[str, Any]) -> Tuple[str, Optional[str]]:
+        version = data["info"]["version"]
+        for release in data.get("releases", {}).get(version, []):
+            if release.get("packagetype") == "sdist":
+                return version, release.get("digests", {}).get("sha256")
+        for release in data.get("urls", []):
+            if release.get("packagetype") == "sdist":
+                return version, release.get("digests", {}).get("sha256")
+        return version, None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "index_url": self.index_url,
+                "checked_at": self._state["checked_at"],
+                "refreshing": self._refreshing,
+                **self._counters,
+            }
@@ -0,0 +1,213 @@
+"""
+WebSocket progress fan-out
+Each connection gets its own bounded, per-download coalescing buffer and
+sender task, so a slow client only ever falls behind to the latest state
+"""
+
+import asyncio
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, Optional, Set
+
+from fastapi import WebSocket, WebSocketDisconnect
+from loguru import logger
+
+from metrics import registry
+
+# Throttle entries kept before stale ones are swept
+PRUNE_MIN = 1024
+
+SEND_SECONDS = registry.histogram("widmate_ws_send_seconds", "Time to send one event to a WebSocket client")
+
+
+class Subscriber:
+    """One WebSocket connection and its pending events"""
+
+    def __init__(self, ws: WebSocket, ids: Optional[Iterable[str]] = None, max_pending: int = 256):
+        self.ws = ws
+        self.ids: Optional[Set[str]] = set(ids) if ids else None
+        self.max_pending = max(1, max_pending)
+        self.pending: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.wakeup = asyncio.Event()
+        self.closed = False
+        self.coalesced = 0
+        self.dropped = 0
+
+    def wants(self, download_id: str) -> bool:
+        return self.ids is None or download_id in self.ids
+
+    def offer(self, event: Dict[str, Any]):
+        """Queue an event, replacing any unsent event for the same download"""
+        download_id = event.get('id')
+        if self.closed or not self.wants(download_id):
+            return
+        if download_id in self.pending:
+            self.coalesced += 1
+            self.pending.move_to_end(download_id)
+        self.pending[download_id] = event
+        if len(self.pending) > self.max_pending:
+            self.pending.popitem(last=False)
+            self.dropped += 1
+        self.wakeup.set()
+
+
+class EventHub:
+    """Fans download events out to WebSocket subscribers"""
+
+    def __init__(self, max_rate: float = 4.0, max_pending: int = 256, send_timeout: float = 10.0,
+                 render: Optional[Callable[[Dict[str, Any]], Dict[str, Any]]] = None):
+        # Events per second per download; terminal events are never throttled
+        self.min_interval = 1.0 / max_rate if max_rate > 0 else 0.0
+        self.max_pending = max_pending
+        self.send_timeout = send_timeout
+        # Turns a raw event into what clients receive; applied only to events that survive throttling
+        self.render = render
+        self.subscribers: Set[Subscriber] = set()
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+
+        self._lock = threading.Lock()
+        self._last_emit: Dict[str, float] = {}
+        self._deferred: Dict[str, Dict[str, Any]] = {}
+        # _last_emit size that triggers a sweep of entries whose window has passed
+        self._prune_at = PRUNE_MIN
+        self._counters = {
+            "published": 0,
+            "throttled": 0,
+            "sent": 0,
+            "send_failures": 0,
+        }
+
+    def bind(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+
+    def publish_threadsafe(self, event: Dict[str, Any], terminal: bool = False):
+        """Publish from any thread, throttling non-terminal events per download"""
+        loop = self.loop
+        if loop is None or loop.is_closed():
+            return
+        download_id = event.get('id')
+        now = time.monotonic()
+        with self._lock:
+            if terminal:
+                self._last_emit.pop(download_id, None)
+                self._deferred.pop(download_id, None)
+            else:
+                last = self._last_emit.get(download_id)
+                if last is not None and now - last < self.min_interval:
+                    # Keep only the newest throttled event and send it when the window opens
+                    self._counters["throttled"] += 1
+                    first_deferral = download_id not in self._deferred
+                    self._deferred[download_id] = event
+                    if first_deferral:
+                        delay = self.min_interval - (now - last)
+                        loop.call_soon_threadsafe(loop.call_later, delay, self._flush_deferred, download_id)
+                    return
+                self._last_emit[download_id] = now
+                if len(self._last_emit) > self._prune_at:
+                    self._prune(now)
+        loop.call_soon_threadsafe(self.publish, event)
+
+    def _prune(self, now: float):
+        """Drop throttle entries whose window has passed; call under _lock"""
+        # Downloads that never sent a terminal event (removed, crashed, coalesced away) leave these behind
+        self._last_emit = {download_id: last for download_id, last in self._last_emit.items()
+                           if now - last < self.min_interval or download_id in self._deferred}
+        self._prune_at = max(PRUNE_MIN, 2 * len(self._last_emit))
+
+    def forget(self, download_id: str):
+        """Drop throttle state for a download that will publish nothing more"""
+        with self._lock:
+            self._last_emit.pop(download_id, None)
+            self._deferred.pop(download_id, None)
+
+    def _flush_deferred(self, download_id: str):
+        with self._lock:
+            event = self._deferred.pop(download_id, None)
+            if event is None:
+                return
+            self._last_emit[download_id] = time.monotonic()
+        self.publish(event)
+
+    def publish(self, event: Dict[str, Any]):
+        """Publish from the event loop thread"""
+        self._counters["published"] += 1
+        if self.render is not None:
+            event = self.render(event)
+        for sub in self.subscribers:
+            sub.offer(event)
+
+    async def serve(self, ws: WebSocket, ids: Optional[Iterable[str]] = None):
+        """Run an accepted WebSocket connection until it disconnects.
+
+        Clients may narrow or widen their subscription at any time by sending
+        ``{"action": "subscribe", "ids": [...]}``,
+        ``{"action": "unsubscribe", "ids": [...]}`` or
+        ``{"action": "subscribe_all"}``. Other messages are ignored.
+        """
+        sub = Subscriber(ws, ids, self.max_pending)
+        self.subscribers.add(sub)
+        sender = asyncio.create_task(self._send_loop(sub))
+        try:
+            while True:
+                message = await ws.receive_text()
+                self._handle_message(sub, message)
+        except WebSocketDisconnect:
+            pass
+        except Exception as e:
+            logger.debug(f"WebSocket receive error: {e}")
+        finally:
+            sub.closed = True
+            self.subscribers.discard(sub)
+            sender.cancel()
+
+    def _handle_message(self, sub: Subscriber, message: str):
+        try:
+            data = json.loads(message)
+        except (ValueError, TypeError):
+            return
+        if not isinstance(data, dict):
+            return
+        action = data.get('action')
+        ids = [str(i) for i in data.get('ids') or []]
+        if action == 'subscribe':
+            sub.ids = (sub.ids or set()) | set(ids)
+        elif action == 'unsubscribe' and sub.ids is not None:
+            sub.ids -= set(ids)
+        elif action == 'subscribe_all':
+            sub.ids = None
+
+    async def _send_loop(self, sub: Subscriber):
+        try:
+            while not sub.closed:
+                await sub.wakeup.wait()
+                sub.wakeup.clear()
+                while sub.pending:
+                    _, event = sub.pending.popitem(last=False)
+                    started = time.perf_counter()
+                    await asyncio.wait_for(sub.ws.send_json(event), self.send_timeout)
+                    SEND_SECONDS.observe(time.perf_counter() - started)
+                    self._counters["sent"] += 1
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            # A client that cannot keep up within send_timeout is disconnected
+            self._counters["send_failures"] += 1
+            logger.debug(f"Dropping WebSocket subscriber: {e}")
+            sub.closed = True
+            self.subscribers.discard(sub)
+            try:
+                await sub.ws.close()
+            except Exception:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "subscribers": len(self.subscribers),
+            "throttled_downloads": len(self._last_emit),
+            "pending": sum(len(s.pending) for s in self.subscribers),
+            "coalesced": sum(s.coalesced for s in self.subscribers),
+            "dropped": sum(s.dropped for s in self.subscribers),
+            **self._counters,
+        }
@@ -0,0 +1,135 @@
+"""
+Pooled YoutubeDL instances for metadata extraction
+Building a YoutubeDL sets up its extractor table, cookie jar and HTTP
+handlers; a pooled instance keeps all of them, including keep-alive
+connections, across requests. Each option profile has its own pool and an
+instance is used by one thread at a time.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List
+
+import yt_dlp
+from loguru import logger
+
+_MISSING = object()
+
+
+def warm_extractors(sample_url: str = "https://example.com/") -> int:
+    """Load every extractor class and compile its URL pattern, returning the count.
+
+    The patterns are cached on the classes, so this benefits every
+    YoutubeDL in the process, pooled or not.
+    """
+    classes = yt_dlp.extractor.gen_extractor_classes()
+    for ie in classes:
+        try:
+            ie.suitable(sample_url)
+        except Exception:
+            pass
+    return len(classes)
+
+
+class _Pooled:
+    __slots__ = ("ydl", "uses")
+
+    def __init__(self, ydl: yt_dlp.YoutubeDL):
+        self.ydl = ydl
+        self.uses = 0
+
+
+class YoutubeDLPool:
+    """Idle YoutubeDL instances per option profile, checked out per call"""
+
+    def __init__(self, profiles: Dict[str, Dict[str, Any]], max_idle: int = 4, max_uses: int = 500):
+        self.profiles = profiles
+        self.max_idle = max(1, max_idle)
+        # Instances are rebuilt now and then so per-instance caches cannot grow without bound
+        self.max_uses = max(1, max_uses)
+        self._idle: Dict[str, List[_Pooled]] = {name: [] for name in profiles}
+        self._lock = threading.Lock()
+        self._counters = {
+            "created": 0,
+            "reused": 0,
+            "recycled": 0,
+        }
+
+    def _create(self, profile: str) -> _Pooled:
+        ydl = yt_dlp.YoutubeDL(dict(self.profiles[profile]))
+        with self._lock:
+            self._counters["created"] += 1
+        return _Pooled(ydl)
+
+    @contextmanager
+    def checkout(self, profile: str, **overrides) -> Iterator[yt_dlp.YoutubeDL]:
+        """Borrow an instance of ``profile``, with per-call option overrides applied"""
+        with self._lock:
+            idle = self._idle[profile]
+            pooled = idle.pop() if idle else None
+            if pooled is not None:
+                self._counters["reused"] += 1
+        if pooled is None:
+            pooled = self._create(profile)
+
+        params = pooled.ydl.params
+        saved = {key: params.get(key, _MISSING) for key in overrides}
+        params.update(overrides)
+        try:
+            yield pooled.ydl
+        finally:
+            for key, value in saved.items():
+                if value is _MISSING:
+                    params.pop(key, None)
+                else:
+                    params[key] = value
+            pooled.uses += 1
+            self._release(profile, pooled)
+
+    def _release(self, profile: str, pooled: _Pooled):
+        with self._lock:
+            idle = self._idle[profile]
+            keep = pooled.uses < self.max_uses and len(idle) < self.max_idle
+            if keep:
+                idle.append(pooled)
+            elif pooled.uses >= self.max_uses:
+                self._counters["recycled"] += 1
+        if not keep:
+            self._close(pooled)
+
+    @staticmethod
+    def _close(pooled: _Pooled):
+        try:
+            pooled.ydl.close()
+        except Exception as e:
+            logger.debug(f"Error closing pooled YoutubeDL: {e}")
+
+    def warm(self) -> float:
+        """Load extractors and put one idle instance in each profile's pool; returns seconds taken"""
+        started = time.monotonic()
+        count = warm_extractors()
+        for profile in self.profiles:
+            pooled = self._create(profile)
+            self._release(profile, pooled)
+        elapsed = time.monotonic() - started
+        logger.info(f"Warmed {count} extractors and {len(self.profiles)} YoutubeDL profiles in {elapsed:.2f}s")
+        return elapsed
+
+    def clear(self):
+        """Close every idle instance, e.g. after yt-dlp was upgraded"""
+        with self._lock:
+            pooled = [p for idle in self._idle.values() for p in idle]
+            for idle in self._idle.values():
+                idle.clear()
+        for p in pooled:
+            self._close(p)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "idle": {name: len(idle) for name, idle in self._idle.items()},
+                "max_idle": self.max_idle,
+                "max_uses": self.max_uses,
+                **self._counters,
+            }
@@ -0,0 +1,193 @@
+"""
+Side-by-side yt-dlp installs for upgrades without downtime
+Each version is pip-installed into its own directory under a runtime root
+and smoke-tested in a separate interpreter before it becomes active; the
+live environment is never modified. Download worker processes started
+after the switch import the new version while running jobs finish on the
+one they started with. A candidate that fails its smoke test is deleted
+and the active version stays as it was.
+
+This module must not import yt_dlp: it decides where yt_dlp is imported from.
+"""
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+_STATE_FILE = "current.json"
+
+# Run in a fresh interpreter with the candidate directory first on sys.path
+_SMOKE_SCRIPT = r"""
+import json, os, sys
+candidate, url = sys.argv[1], sys.argv[2]
+sys.path.insert(0, candidate)
+from importlib.metadata import version
+import yt_dlp
+if not os.path.realpath(yt_dlp.__file__).startswith(os.path.realpath(candidate)):
+    raise SystemExit(f"yt_dlp was imported from {yt_dlp.__file__}, not the candidate")
+with yt_dlp.YoutubeDL({"quiet": True, "no_warnings": True, "skip_download": True}) as ydl:
+    if url:
+        info = ydl.extract_info(url, download=False)
+        if not info or not (info.get("id") or info.get("entries")):
+            raise SystemExit(f"Smoke extraction of {url} returned nothing")
+    else:
+        yt_dlp.extractor.gen_extractor_classes()
+print(json.dumps({"version": version("yt-dlp")}))
+"""
+
+
+class RuntimeInstallError(Exception):
+    """Raised when a candidate yt-dlp fails to install or to pass its smoke test"""
+
+
+def _read_state(root: Path) -> Dict[str, Any]:
+    try:
+        with open(root / _STATE_FILE, "r") as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if not state.get("path") or not Path(state["path"]).is_dir():
+        return {}
+    return state
+
+
+def use_active_runtime(root: str) -> Optional[str]:
+    """Put the active runtime first on sys.path; call before anything imports yt_dlp"""
+    path = _read_state(Path(root)).get("path")
+    if path and path not in sys.path:
+        sys.path.insert(0, path)
+    return path
+
+
+def run_worker(conn, runtime_path: Optional[str]):
+    """Download worker process entry: import yt-dlp from runtime_path, then serve jobs"""
+    if runtime_path:
+        sys.path.insert(0, runtime_path)
+    from process_pool import _worker_main
+    _worker_main(conn)
+
+
+class RuntimeStore:
+    """Versioned yt-dlp install directories and the pointer to the active one"""
+
+    def __init__(self, root: str, keep: int = 3, smoke_url: str = "",
+                 install_timeout: float = 600, smoke_timeout: float = 120):
+        self.root = Path(root)
+        self.keep = max(2, keep)
+        self.smoke_url = smoke_url
+        self.install_timeout = install_timeout
+        self.smoke_timeout = smoke_timeout
+        self._lock = threading.Lock()
+        self._counters = {
+            "installed": 0,
+            "rolled_back": 0,
+        }
+
+    def active(self) -> Dict[str, Any]:
+        """The active runtime's version and path; empty when the base environment's yt-dlp is used"""
+        return _read_state(self.root)
+
+    def active_path(self) -> Optional[str]:
+        return self.active().get("path")
+
+    def install(self, version: str, requirement: Optional[str] = None) -> Dict[str, Any]:
+        """Install, smoke-test and activate a yt-dlp version; returns the new active state.
+
+        ``requirement`` is anything pip accepts, e.g. a verified sdist path;
+        it defaults to ``yt-dlp==<version>``. Raises RuntimeInstallError, with
+        the active runtime unchanged, if the candidate does not work.
+        """
+        if not self._lock.acquire(blocking=False):
+            raise RuntimeInstallError("Another yt-dlp upgrade is already running")
+        try:
+            current = self.active()
+            if current.get("version") == version:
+                return current
+            self.root.mkdir(parents=True, exist_ok=True)
+            target = self.root / f"{version}-{int(time.time())}"
+            staging = self.root / f".{target.name}.staging"
+            shutil.rmtree(staging, ignore_errors=True)
+            try:
+                self._pip_install(requirement or f"yt-dlp=={version}", staging)
+                installed = self._smoke_test(staging)
+                os.replace(staging, target)
+            except RuntimeInstallError:
+                self._counters["rolled_back"] += 1
+                raise
+            finally:
+                shutil.rmtree(staging, ignore_errors=True)
+
+            state = {
+                "version": installed,
+                "path": str(target.resolve()),
+                "previous": current.get("path"),
+                "activated_at": time.time(),
+            }
+            self._write_state(state)
+            self._counters["installed"] += 1
+            self._prune(state)
+            return state
+        finally:
+            self._lock.release()
+
+    def _pip_install(self, requirement: str, staging: Path):
+        # yt-dlp has no required dependencies; optional ones are shared with the base environment
+        command = [
+            sys.executable, "-m", "pip", "install", "--no-deps", "--no-input",
+            "--disable-pip-version-check", "--target", str(staging), requirement,
+        ]
+        try:
+            result = subprocess.run(command, capture_output=True, text=True, timeout=self.install_timeout)
+        except subprocess.TimeoutExpired:
+            raise RuntimeInstallError(f"pip install timed out after {self.install_timeout:.0f}s")
+        if result.returncode != 0:
+            raise RuntimeInstallError(f"pip install failed: {result.stderr.strip()[-2000:]}")
+
+    def _smoke_test(self, staging: Path) -> str:
+        """Import the candidate in a fresh interpreter and run a smoke extraction; returns its version"""
+        try:
+            result = subprocess.run(
+                [sys.executable, "-c", _SMOKE_SCRIPT, str(staging.resolve()), self.smoke_url],
+                capture_output=True, text=True, timeout=self.smoke_timeout,
+            )
+        except subprocess.TimeoutExpired:
+            raise RuntimeInstallError(f"Smoke test timed out after {self.smoke_timeout:.0f}s")
+        if result.returncode != 0:
+            raise RuntimeInstallError(f"Smoke test failed: {result.stderr.strip()[-2000:]}")
+        try:
+            return json.loads(result.stdout.strip().splitlines()[-1])["version"]
+        except (ValueError, KeyError, IndexError):
+            raise RuntimeInstallError(f"Smoke test gave no version: {result.stdout[-200:]}")
+
+    def _write_state(self, state: Dict[str, Any]):
+        tmp = self.root / (_STATE_FILE + ".tmp")
+        with open(tmp, "w") as f:
+            json.dump(state, f, indent=2)
+        os.replace(tmp, self.root / _STATE_FILE)
+
+    def _prune(self, state: Dict[str, Any]):
+        """Delete old runtimes, keeping the newest few and always the active and previous ones"""
+        pinned = {state.get("path"), state.get("previous")}
+        runtimes = sorted(
+            (p for p in self.root.iterdir() if p.is_dir() and not p.name.startswith(".")),
+            key=lambda p: p.stat().st_mtime,
+            reverse=True,
+        )
+        for path in runtimes[self.keep:]:
+            if str(path.resolve()) not in pinned:
+                shutil.rmtree(path, ignore_errors=True)
+
+    def stats(self) -> Dict[str, Any]:
+        active = self.active()
+        return {
+            "version": active.get("version"),
+            "path": active.get("path"),
+            "upgrading": self._lock.locked(),
+            **self._counters,
+        }